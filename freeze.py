@@ -439,7 +439,6 @@ build_exe_options["include_files"] = src_files + external_so_files
 build_exe_options["includes"] = python_modules
 build_exe_options["excludes"] = ["distutils",
                                  "sentry_sdk.integrations.django",
-                                 "numpy",
                                  "setuptools",
                                  "tkinter",
                                  "pydoc_data",
@@ -52,6 +52,8 @@ USER_PATH = os.path.join(HOME_PATH, ".openshot_qt")
 BACKUP_PATH = os.path.join(USER_PATH)
 RECOVERY_PATH = os.path.join(USER_PATH, "recovery")
 THUMBNAIL_PATH = os.path.join(USER_PATH, "thumbnail")
+THUMBNAIL_CACHE_PATH = os.path.join(USER_PATH, "thumbnail-cache")
+WAVEFORM_CACHE_PATH = os.path.join(USER_PATH, "waveform-cache")
 CACHE_PATH = os.path.join(USER_PATH, "cache")
 BLENDER_PATH = os.path.join(USER_PATH, "blender")
 TITLE_PATH = os.path.join(USER_PATH, "title")
@@ -98,6 +100,9 @@ LOG_LEVEL_CONSOLE = 'INFO'
 # Web backend selection, overridable at launch
 WEB_BACKEND = 'auto'
 
+# Custom URL scheme for timeline thumbnails (WebEngine only)
+THUMBNAIL_SCHEME = "openshot-thumb"
+
 # Languages
 CMDLINE_LANGUAGE = None
 CURRENT_LANGUAGE = 'en_US'
@@ -39,6 +39,7 @@ from classes.app import get_app
 from classes.image_types import is_image
 from classes.json_data import JsonDataStore
 from classes.logger import log
+from classes.thumbnail_pack import ThumbnailPackStore, PACK_FILENAME, is_pack_file
 from classes.updates import UpdateInterface
 from classes.assets import get_assets_path
 from windows.views.find_file import find_missing_file
@@ -831,6 +832,13 @@ class ProjectDataStore(JsonDataStore, UpdateInterface):
             for thumb_path in os.listdir(info.THUMBNAIL_PATH):
                 working_thumb_path = os.path.join(info.THUMBNAIL_PATH, thumb_path)
                 target_thumb_filepath = os.path.join(target_thumb_path, thumb_path)
+                if is_pack_file(thumb_path):
+                    # Thumbnail pack store (merged into any existing pack store, ignoring its journal)
+                    if thumb_path != PACK_FILENAME or working_thumb_path == target_thumb_filepath:
+                        continue
+                    if os.path.exists(target_thumb_filepath):
+                        ThumbnailPackStore.merge(working_thumb_path, target_thumb_filepath)
+                        continue
                 if not os.path.exists(target_thumb_filepath):
                     shutil.copy2(working_thumb_path, target_thumb_filepath)
 
@@ -0,0 +1,758 @@
+"""
+ @file
+ @brief This file contains the export renderer (which writes a range of timeline frames to a file)
+ @author Jonathan Thomas <jonathan@openshot.org>
+
+ @section LICENSE
+
+ Copyright (c) 2008-2018 OpenShot Studios, LLC
+ (http://www.openshotstudios.com). This file is part of
+ OpenShot Video Editor (http://www.openshot.org), an open-source project
+ dedicated to delivering high quality video editing and animation solutions
+ to the world.
+
+ OpenShot Video Editor is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ OpenShot Video Editor is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with OpenShot Library.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+import os
+import sys
+import json
+import locale
+import time
+import ctypes
+from threading import Condition, Event, Thread
+
+import openshot
+
+# Try to get the security-patched XML functions from defusedxml
+try:
+    from defusedxml import minidom as xml
+except ImportError:
+    from xml.dom import minidom as xml
+
+from xml.parsers.expat import ExpatError
+
+from classes import info
+from classes.json_data import JsonDataStore
+from classes.keyframe_scaler import KeyframeScaler
+from classes.logger import log
+from classes.render_report import ExportReport, build_report, get_peak_memory, save_report
+
+# Frames kept in the export cache (in addition to the frames rendered ahead by the export pipeline)
+EXPORT_CACHE_FRAMES = 8
+
+# Largest part of the available memory used by export caches
+EXPORT_CACHE_MEMORY_FRACTION = 0.25
+
+# Number of threads rendering frames ahead of the writer (when the export pipeline is enabled)
+PIPELINE_RENDER_THREADS = 2
+
+# Types of export (which streams are written)
+EXPORT_VIDEO_AUDIO = "video-audio"
+EXPORT_VIDEO = "video"
+EXPORT_AUDIO = "audio"
+EXPORT_TYPES = [EXPORT_VIDEO_AUDIO, EXPORT_VIDEO, EXPORT_AUDIO]
+
+# Quality levels of export presets
+PRESET_QUALITIES = ["Low", "Med", "High"]
+
+
+def get_launch_command():
+    """Get the command line which starts OpenShot again (i.e. to render in a separate process), or None
+    if OpenShot can't be started from this process"""
+    if getattr(sys, "frozen", False):
+        # Frozen builds have no launch.py (the executable is the launcher), and Windows GUI builds
+        # have no console output, so prefer the console launcher next to them (if any)
+        name, ext = os.path.splitext(sys.executable)
+        cli_executable = "%s-cli%s" % (name, ext)
+        if os.path.isfile(cli_executable):
+            return [cli_executable]
+        return [sys.executable]
+    launch_path = os.path.join(info.PATH, "launch.py")
+    if not sys.executable or not os.path.isfile(launch_path):
+        return None
+    return [sys.executable, launch_path]
+
+
+def convert_to_bytes(BitRateString):
+    """Convert a bit rate string (i.e. '5 Mb/s', '15 crf') to a number"""
+    bit_rate_bytes = 0
+
+    # split the string into pieces
+    s = BitRateString.lower().split(" ")
+
+    try:
+        # Get Bit Rate
+        if len(s) >= 2:
+            raw_number_string = s[0]
+            raw_measurement = s[1]
+
+            # convert string number to float (based on locale settings)
+            raw_number = locale.atof(raw_number_string)
+
+            if "kb" in raw_measurement:
+                # Kbit to bytes
+                bit_rate_bytes = raw_number * 1000.0
+
+            elif "mb" in raw_measurement:
+                # Mbit to bytes
+                bit_rate_bytes = raw_number * 1000.0 * 1000.0
+
+            elif ("crf" in raw_measurement) or ("cqp" in raw_measurement):
+                # Just a number
+                if raw_number > 63:
+                    raw_number = 63
+                if raw_number < 0:
+                    raw_number = 0
+                bit_rate_bytes = raw_number
+
+            elif "qp" in raw_measurement:
+                # Just a number
+                if raw_number > 255:
+                    raw_number = 255
+                if raw_number < 0:
+                    raw_number = 0
+                bit_rate_bytes = raw_number
+
+    except:
+        log.warning('Failed to convert bitrate string to bytes: %s' % BitRateString)
+
+    # return the bit rate in bytes
+    return str(int(bit_rate_bytes))
+
+
+def get_quality_option(BitRateString):
+    """Get the encoder option of a quality-based bit rate string (crf, cqp or qp), or None"""
+    for option in ["crf", "cqp", "qp"]:
+        if option in BitRateString:
+            return option
+    return None
+
+
+def resolve_audio_codec(audio_codec_name):
+    """Get an available audio codec for a preset's audio codec"""
+    if audio_codec_name == "aac":
+        # Determine which version of AAC encoder is available
+        if openshot.FFmpegWriter.IsValidCodec("libfaac"):
+            return "libfaac"
+        elif openshot.FFmpegWriter.IsValidCodec("libvo_aacenc"):
+            return "libvo_aacenc"
+        elif openshot.FFmpegWriter.IsValidCodec("aac"):
+            return "aac"
+        else:
+            # fallback audio codec
+            return "ac3"
+    return audio_codec_name
+
+
+def get_profiles():
+    """Get the path of every profile, by name ('<description> (<width>x<height>)')"""
+    profile_paths = {}
+    for profile_folder in [info.USER_PROFILES_PATH, info.PROFILES_PATH]:
+        for file in os.listdir(profile_folder):
+            profile_path = os.path.join(profile_folder, file)
+            try:
+                # Load Profile
+                profile = openshot.Profile(profile_path)
+                profile_name = "%s (%sx%s)" % (profile.info.description, profile.info.width, profile.info.height)
+                profile_paths[profile_name] = profile_path
+
+            except RuntimeError as e:
+                # This exception occurs when there's a problem parsing the Profile file - display a message and continue
+                log.error("Failed to parse file '%s' as a profile: %s" % (profile_path, e))
+    return profile_paths
+
+
+def find_profile(name):
+    """Get the path of a profile by path, file name, or description (or None if not found)"""
+    if os.path.isfile(name):
+        return name
+    profile_paths = get_profiles()
+    for profile_name, path in sorted(profile_paths.items()):
+        if name in [profile_name, os.path.basename(path)] or profile_name.startswith(name + " ("):
+            return path
+    for profile_name, path in sorted(profile_paths.items()):
+        if name in profile_name:
+            return path
+    return None
+
+
+def get_preset_paths():
+    """Get the path of every export preset"""
+    return [os.path.join(preset_folder, file)
+            for preset_folder in [info.EXPORT_PRESETS_PATH, info.USER_PRESETS_PATH]
+            for file in os.listdir(preset_folder)]
+
+
+def load_preset(preset_path):
+    """Read an export preset (XML) into a dict (of untranslated values)"""
+    xmldoc = xml.parse(preset_path)
+
+    def text(tag, default=""):
+        elements = xmldoc.getElementsByTagName(tag)
+        return elements[0].childNodes[0].data if elements and elements[0].childNodes else default
+
+    def bitrates(tag):
+        elements = xmldoc.getElementsByTagName(tag)
+        if not elements:
+            return {quality: "" for quality in PRESET_QUALITIES}
+        return {quality: elements[-1].attributes[quality.lower()].value for quality in PRESET_QUALITIES}
+
+    preset = {
+        "path": preset_path,
+        "type": text("type"),
+        "title": text("title"),
+        "videoformat": text("videoformat"),
+        "videocodec": text("videocodec"),
+        "audiocodec": text("audiocodec"),
+        "samplerate": int(text("samplerate", "0")),
+        "audiochannels": int(text("audiochannels", "0")),
+        "audiochannellayout": int(text("audiochannellayout", "0")),
+        "videobitrate": bitrates("videobitrate"),
+        "audiobitrate": bitrates("audiobitrate"),
+        "projectprofiles": [profile.childNodes[0].data for profile in xmldoc.getElementsByTagName("projectprofile")],
+    }
+
+    # Free up DOM memory
+    xmldoc.unlink()
+    return preset
+
+
+def find_preset(name):
+    """Get an export preset by path, file name or title (or None if not found)"""
+    if os.path.isfile(name):
+        return load_preset(name)
+    for preset_path in get_preset_paths():
+        try:
+            preset = load_preset(preset_path)
+        except (ExpatError, ValueError) as e:
+            log.error("Failed to parse file '%s' as a preset: %s" % (preset_path, e))
+            continue
+        file_name = os.path.splitext(os.path.basename(preset_path))[0]
+        if name.lower() in [file_name.lower(), preset["title"].lower()]:
+            return preset
+    return None
+
+
+def load_project_data(file_path):
+    """Read a project file (merged with the default project), without loading it into the application"""
+    data_store = JsonDataStore()
+    data_store.data_type = "project data"
+    default_project = data_store.read_from_file(os.path.join(info.PATH, 'settings', '_default.project'))
+    project_data = data_store.read_from_file(file_path, path_mode="absolute")
+    return data_store.merge_settings(default_project, project_data)
+
+
+def rescale_project_data(project_data, video_settings):
+    """Rescale all keyframes of project data (if the export frame rate differs from the project)"""
+    current_fps = project_data.get("fps")
+    current_fps_float = float(current_fps["num"]) / float(current_fps["den"])
+    new_fps_float = float(video_settings["fps"]["num"]) / float(video_settings["fps"]["den"])
+    export_fps_factor = new_fps_float / current_fps_float
+    if export_fps_factor != 1.0:
+        log.info('Scale all keyframes by a factor of %s', export_fps_factor)
+        project_data = KeyframeScaler(factor=export_fps_factor)(project_data)
+    return project_data
+
+
+def get_export_settings(preset, profile_path, quality="High", export_type=EXPORT_VIDEO_AUDIO,
+                        start_frame=1, end_frame=None):
+    """Get the video and audio settings of an export (the same settings the Export dialog would use
+    for this preset, profile and quality). An end_frame of None exports to the end of the timeline."""
+    # Use the requested quality (or the highest quality the preset has)
+    qualities = [q for q in PRESET_QUALITIES if preset["videobitrate"][q] or preset["audiobitrate"][q]]
+    if quality not in qualities and qualities:
+        quality = qualities[-1]
+    video_bitrate = preset["videobitrate"].get(quality, "")
+    audio_bitrate = preset["audiobitrate"].get(quality, "")
+
+    profile = openshot.Profile(profile_path)
+    video_settings = {"has_video": export_type in [EXPORT_VIDEO_AUDIO, EXPORT_VIDEO],
+                      "vformat": preset["videoformat"],
+                      "vcodec": preset["videocodec"],
+                      "fps": {"num": profile.info.fps.num, "den": profile.info.fps.den},
+                      "width": profile.info.width,
+                      "height": profile.info.height,
+                      "pixel_ratio": {"num": profile.info.pixel_ratio.num, "den": profile.info.pixel_ratio.den},
+                      "video_bitrate": int(convert_to_bytes(video_bitrate)),
+                      "quality_option": get_quality_option(video_bitrate),
+                      "start_frame": start_frame,
+                      "end_frame": end_frame,
+                      "interlace": bool(profile.info.interlaced_frame),
+                      "topfirst": bool(profile.info.interlaced_frame),
+                      }
+
+    audio_settings = {"has_audio": export_type in [EXPORT_VIDEO_AUDIO, EXPORT_AUDIO],
+                      "acodec": resolve_audio_codec(preset["audiocodec"]),
+                      "sample_rate": preset["samplerate"],
+                      "channels": preset["audiochannels"],
+                      "channel_layout": preset["audiochannellayout"],
+                      "audio_bitrate": int(convert_to_bytes(audio_bitrate)),
+                      }
+    return video_settings, audio_settings
+
+
+def get_available_memory():
+    """Get the physical memory available to new allocations (in bytes), or None if unknown"""
+    try:
+        if sys.platform == "win32":
+            class MEMORYSTATUSEX(ctypes.Structure):
+                _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+                            ("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+                            ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                            ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+                            ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+            status = MEMORYSTATUSEX()
+            status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+            ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status))
+            return status.ullAvailPhys
+        if os.path.exists("/proc/meminfo"):
+            # Includes reclaimable memory (page cache), unlike free memory
+            with open("/proc/meminfo", 'r') as meminfo:
+                for line in meminfo:
+                    if line.startswith("MemAvailable:"):
+                        return int(line.split()[1]) * 1024
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+    except (AttributeError, OSError, ValueError) as ex:
+        log.debug("Failed to get available memory: %s" % ex)
+        return None
+
+
+def get_frame_bytes(video_settings, audio_settings):
+    """Get the approximate size of a cached frame (RGBA image, and float audio samples)"""
+    frame_bytes = video_settings.get("width") * video_settings.get("height") * 4
+    fps = float(video_settings["fps"]["num"]) / float(video_settings["fps"]["den"])
+    samples_per_frame = int(audio_settings.get("sample_rate") or 0) / fps
+    return int(frame_bytes + samples_per_frame * int(audio_settings.get("channels") or 0) * 4)
+
+
+def get_export_cache_bytes(video_settings, audio_settings, look_ahead=0, limit_mb=0, shares=1):
+    """Get the size of an export cache (in bytes), and the reason for it. The cache holds the frames
+    rendered ahead (look_ahead) and a few more, but no more than a share of the available memory,
+    unless limit_mb overrides the size."""
+    if limit_mb:
+        return limit_mb * 1024 * 1024, "preferences"
+    frame_bytes = get_frame_bytes(video_settings, audio_settings)
+
+    cache_bytes = frame_bytes * (look_ahead + EXPORT_CACHE_FRAMES)
+    reason = "%s frames of %.1f MB" % (look_ahead + EXPORT_CACHE_FRAMES, frame_bytes / 1024 / 1024)
+    available = get_available_memory()
+    if available:
+        memory_limit = int(available * EXPORT_CACHE_MEMORY_FRACTION / max(1, shares))
+        if memory_limit < cache_bytes:
+            cache_bytes = memory_limit
+            reason = "limited by %.0f MB of available memory" % (available / 1024 / 1024)
+
+    # Always keep the frame being written (and the next one)
+    return max(cache_bytes, frame_bytes * 2), reason
+
+
+def create_export_timeline(project_data, video_settings, audio_settings, timeline_info=None,
+                           look_ahead=0, cache_limit_mb=0, cache_shares=1):
+    """Create (and open) a new Timeline for exporting project data with the export settings
+    (and an export cache big enough for look_ahead frames, see get_export_cache_bytes). Returns the
+    timeline and its cache, which the caller must keep until the timeline is closed (the timeline
+    only holds a pointer to it)."""
+    fps = openshot.Fraction(video_settings.get("fps").get("num"), video_settings.get("fps").get("den"))
+    timeline = openshot.Timeline(
+        video_settings.get("width"), video_settings.get("height"), fps,
+        audio_settings.get("sample_rate"), audio_settings.get("channels"), audio_settings.get("channel_layout"))
+
+    # Init various properties (copied from the project timeline, if any)
+    for key, value in (timeline_info or {}).items():
+        setattr(timeline.info, key, value)
+
+    # Load the "export" Timeline reader with the JSON from the project
+    timeline.SetJson(json.dumps(project_data))
+
+    # Re-update the export settings again (since the timeline just got clobbered)
+    timeline.info.width = video_settings.get("width")
+    timeline.info.height = video_settings.get("height")
+    timeline.info.fps.num = video_settings.get("fps").get("num")
+    timeline.info.fps.den = video_settings.get("fps").get("den")
+    timeline.info.sample_rate = audio_settings.get("sample_rate")
+    timeline.info.channels = audio_settings.get("channels")
+    timeline.info.channel_layout = audio_settings.get("channel_layout")
+
+    # Open the "export" Timeline reader
+    timeline.Open()
+
+    # Set MaxSize (so we don't have any downsampling)
+    timeline.SetMaxSize(video_settings.get("width"), video_settings.get("height"))
+
+    # Set lossless cache settings (sized for the export resolution and pipeline)
+    cache_bytes, reason = get_export_cache_bytes(
+        video_settings, audio_settings, look_ahead, cache_limit_mb, cache_shares)
+    log.info("Export cache: %.1f MB (%s)" % (cache_bytes / 1024 / 1024, reason))
+    export_cache_object = openshot.CacheMemory(cache_bytes)
+    timeline.SetCache(export_cache_object)
+
+    # Apply mappers to timeline readers
+    timeline.ApplyMapperToClips()
+    return timeline, export_cache_object
+
+
+def create_writer(export_file_path, video_settings, audio_settings):
+    """Create (and open) a FFmpegWriter for the export settings"""
+    w = openshot.FFmpegWriter(export_file_path)
+
+    # Set video options
+    if video_settings.get("has_video"):
+        w.SetVideoOptions(True,
+                          video_settings.get("vcodec"),
+                          openshot.Fraction(video_settings.get("fps").get("num"),
+                                            video_settings.get("fps").get("den")),
+                          video_settings.get("width"),
+                          video_settings.get("height"),
+                          openshot.Fraction(video_settings.get("pixel_ratio").get("num"),
+                                            video_settings.get("pixel_ratio").get("den")),
+                          video_settings.get("interlace"),
+                          video_settings.get("topfirst"),
+                          video_settings.get("video_bitrate"))
+
+    # Set audio options
+    if audio_settings.get("has_audio"):
+        w.SetAudioOptions(True,
+                          audio_settings.get("acodec"),
+                          audio_settings.get("sample_rate"),
+                          audio_settings.get("channels"),
+                          audio_settings.get("channel_layout"),
+                          audio_settings.get("audio_bitrate"))
+
+    # Prepare the streams
+    w.PrepareStreams()
+
+    # These extra options should be set in an extra method
+    # No feedback is given to the user
+    # TODO: Tell user if option is not available
+    if not video_settings.get("has_video"):
+        # Muxing options for mp4/mov
+        w.SetOption(openshot.AUDIO_STREAM, "muxing_preset", "mp4_faststart")
+    else:
+        # Muxing options for mp4/mov
+        w.SetOption(openshot.VIDEO_STREAM, "muxing_preset", "mp4_faststart")
+        # Set the quality in case crf, cqp or qp was selected
+        quality_option = video_settings.get("quality_option")
+        if quality_option:
+            w.SetOption(openshot.VIDEO_STREAM, quality_option, str(int(video_settings.get("video_bitrate"))))
+        # Fixed group of pictures (so separately rendered segments can be joined)
+        if video_settings.get("gop_size"):
+            w.SetOption(openshot.VIDEO_STREAM, "gop_size", str(int(video_settings.get("gop_size"))))
+
+    # Open the writer
+    w.Open()
+    return w
+
+
+class FramePipeline:
+    """ Renders timeline frames on worker threads (up to depth frames ahead of the writer), so frames
+    are composited while earlier frames are encoded. Frames are returned in order by get(). """
+
+    def __init__(self, timeline, start_frame, end_frame, depth, threads=PIPELINE_RENDER_THREADS, report=None):
+        self.timeline = timeline
+        self.report = report
+        self.end_frame = end_frame
+        self.depth = max(1, depth)
+        self.condition = Condition()
+        self.frames = {}
+        self.next_frame = start_frame
+        self.write_frame = start_frame
+        self.error = None
+        self.stopped = False
+
+        # Seconds the writer waited for rendered frames, and the render threads waited for free space
+        self.render_wait_seconds = 0.0
+        self.encode_wait_seconds = 0.0
+
+        self.threads = [Thread(target=self.run, name="export-render-%s" % index, daemon=True)
+                        for index in range(max(1, min(threads, self.depth)))]
+        for thread in self.threads:
+            thread.start()
+
+    def run(self):
+        """Render the next frame (until the end frame, or stopped)"""
+        while True:
+            with self.condition:
+                wait_start = time.time()
+                while (not self.stopped and self.next_frame <= self.end_frame
+                       and self.next_frame >= self.write_frame + self.depth):
+                    self.condition.wait()
+                self.encode_wait_seconds += time.time() - wait_start
+                if self.stopped or self.next_frame > self.end_frame:
+                    return
+                number = self.next_frame
+                self.next_frame += 1
+
+            try:
+                render_start = time.time()
+                openshot_frame = self.timeline.GetFrame(number)
+                if self.report:
+                    self.report.add_render(number, time.time() - render_start)
+            except Exception as ex:
+                # Stop every render thread (the export fails at the first error)
+                with self.condition:
+                    if self.error is None:
+                        self.error = ex
+                    self.stopped = True
+                    self.condition.notify_all()
+                return
+
+            with self.condition:
+                self.frames[number] = openshot_frame
+                self.condition.notify_all()
+
+    def get(self, number):
+        """Wait for a rendered frame (frames must be requested in order)"""
+        with self.condition:
+            self.write_frame = number
+            self.condition.notify_all()
+
+            wait_start = time.time()
+            while number not in self.frames and self.error is None:
+                self.condition.wait()
+            self.render_wait_seconds += time.time() - wait_start
+
+            # Fail as soon as any frame failed (even if this frame was rendered before the error)
+            if self.error is not None:
+                raise self.error
+            return self.frames.pop(number)
+
+    def close(self):
+        """Stop rendering (and wait for the render threads)"""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.frames.clear()
+
+
+class ExportRenderer:
+    """ Writes a range of frames from project data to a file. Runs on any thread (it creates its own
+    Timeline), reports progress to a callback, and can be paused, resumed or cancelled from another thread. """
+
+    def __init__(self, project_data, export_file_path, video_settings, audio_settings, timeline_info=None,
+                 pipeline_depth=0):
+        self.project_data = project_data
+        self.export_file_path = export_file_path
+        self.video_settings = video_settings
+        self.audio_settings = audio_settings
+        self.timeline_info = timeline_info
+
+        # Number of frames rendered ahead of the writer (0 renders and writes each frame in turn)
+        self.pipeline_depth = pipeline_depth
+
+        # Seconds spent on each stage of the export (see log_stats)
+        self.stats = {}
+
+        # Path of the performance report (None to skip the report), and the report of the last export
+        self.report_path = None
+        self.report = None
+
+        # Size of the export cache in MB (0 sizes it automatically), and the number of exports sharing memory
+        self.cache_limit_mb = 0
+        self.cache_shares = 1
+
+        self.cancelled = False
+        self.resumed = Event()
+        self.resumed.set()
+        self.paused_seconds = 0.0
+
+        # Seconds between progress callbacks
+        self.progress_interval = 1.0
+
+    def pause(self):
+        self.resumed.clear()
+
+    def resume(self):
+        self.resumed.set()
+
+    def cancel(self):
+        self.cancelled = True
+        self.resumed.set()
+
+    def wait_if_paused(self):
+        """Block while paused (paused time is not counted as elapsed)"""
+        if not self.resumed.is_set():
+            paused_time = time.time()
+            self.resumed.wait()
+            self.paused_seconds += time.time() - paused_time
+
+    def log_stats(self):
+        """Log the time spent rendering and encoding frames"""
+        if self.pipeline_depth:
+            log.info("Export pipeline (depth %s): %.2f seconds waiting for rendered frames, "
+                     "%.2f seconds waiting for the encoder, %.2f seconds encoding" % (
+                         self.pipeline_depth, self.stats.get("render_wait_seconds", 0.0),
+                         self.stats.get("encode_wait_seconds", 0.0), self.stats.get("encode_seconds", 0.0)))
+        else:
+            log.info("Export: %.2f seconds rendering frames, %.2f seconds encoding" % (
+                self.stats.get("render_seconds", 0.0), self.stats.get("encode_seconds", 0.0)))
+
+    def create_writers(self):
+        """Create (and open) the writers of the export"""
+        return [create_writer(self.export_file_path, self.video_settings, self.audio_settings)]
+
+    def render(self, progress_callback=None):
+        """Export all frames (calling progress_callback with the current frame and elapsed seconds),
+        and return the last frame written"""
+        look_ahead = self.pipeline_depth + PIPELINE_RENDER_THREADS if self.pipeline_depth else 0
+        timeline, export_cache_object = create_export_timeline(
+            self.project_data, self.video_settings, self.audio_settings, self.timeline_info,
+            look_ahead, self.cache_limit_mb, self.cache_shares)
+        pipeline = None
+        try:
+            # Export to the end of the timeline (if no end frame)
+            if not self.video_settings.get("end_frame"):
+                self.video_settings["end_frame"] = timeline.GetMaxFrame()
+            start_frame = self.video_settings.get("start_frame")
+            end_frame = self.video_settings.get("end_frame")
+
+            writers = self.create_writers()
+
+            progressstep = max(1, round((end_frame - start_frame) / 1000))
+            start_time_export = time.time()
+            last_progress_time = 0.0
+            self.stats = {"render_seconds": 0.0, "encode_seconds": 0.0}
+            report = ExportReport(start_frame, end_frame) if self.report_path else None
+
+            # Render frames ahead of the writer (if enabled)
+            if self.pipeline_depth:
+                pipeline = FramePipeline(timeline, start_frame, end_frame, self.pipeline_depth, report=report)
+
+            # Write each frame in the selected range
+            frame = start_frame
+            for frame in range(start_frame, end_frame + 1):
+                self.wait_if_paused()
+
+                # Check if we need to bail out
+                if self.cancelled:
+                    log.info("Export cancelled at frame %s" % frame)
+                    break
+
+                # Report progress (every progressstep frames, or once per second)
+                if progress_callback and (frame % progressstep == 0
+                                          or time.time() - last_progress_time > self.progress_interval):
+                    progress_callback(frame, time.time() - start_time_export - self.paused_seconds)
+                    last_progress_time = time.time()
+                    if report:
+                        report.sample_cache(export_cache_object)
+
+                # Write the frame object to the video
+                render_start = time.time()
+                if pipeline:
+                    openshot_frame = pipeline.get(frame)
+                else:
+                    openshot_frame = timeline.GetFrame(frame)
+                encode_start = time.time()
+                for w in writers:
+                    w.WriteFrame(openshot_frame)
+                self.stats["render_seconds"] += encode_start - render_start
+                self.stats["encode_seconds"] += time.time() - encode_start
+                if report:
+                    if not pipeline:
+                        report.add_render(frame, encode_start - render_start)
+                    report.add_encode(frame, time.time() - encode_start)
+
+            if pipeline:
+                pipeline.close()
+                self.stats["render_wait_seconds"] = pipeline.render_wait_seconds
+                self.stats["encode_wait_seconds"] = pipeline.encode_wait_seconds
+                pipeline = None
+
+            # Close writers
+            for w in writers:
+                w.Close()
+            self.log_stats()
+
+            # Save the report (unless cancelled, since a partial export is not comparable)
+            if report and not self.cancelled:
+                report.sample_cache(export_cache_object)
+                self.report = build_report(self, report.frame_times(),
+                                           time.time() - start_time_export - self.paused_seconds,
+                                           report.cache_stats(), get_peak_memory())
+                save_report(self.report, self.report_path)
+
+            if progress_callback:
+                progress_callback(frame, time.time() - start_time_export - self.paused_seconds)
+            return frame
+
+        finally:
+            # Stop rendering ahead (if the export failed or was cancelled)
+            if pipeline:
+                pipeline.close()
+
+            # Close timeline object, and clear all cache
+            timeline.Close()
+            timeline.ClearAllCache()
+
+
+class MultiExportRenderer(ExportRenderer):
+    """ Writes a range of frames from project data to several files at once (i.e. a master and smaller
+    renditions). Each frame is composited once, at the largest size of any output, and every writer
+    scales it to the size of its own output. """
+
+    def __init__(self, project_data, outputs, timeline_info=None, pipeline_depth=0):
+        # Each output is a dict of export_file_path, video_settings and audio_settings
+        self.outputs = outputs
+        video_outputs = [output for output in outputs if output["video_settings"].get("has_video")]
+        audio_outputs = [output for output in outputs if output["audio_settings"].get("has_audio")]
+
+        # All outputs need the same frames (and outputs with video the same frame rate, since audio only
+        # outputs use the frame rate of the project)
+        for output in outputs[1:]:
+            for key in ["start_frame", "end_frame"]:
+                if output["video_settings"].get(key) != outputs[0]["video_settings"].get(key):
+                    raise ValueError("Outputs of a multi-output export need the same %s: %s" % (
+                        key, output["export_file_path"]))
+        for output in video_outputs[1:]:
+            if output["video_settings"].get("fps") != video_outputs[0]["video_settings"].get("fps"):
+                raise ValueError("Outputs of a multi-output export need the same fps: %s" % (
+                    output["export_file_path"]))
+
+        # Composite at the largest size, and mix audio at the highest sample rate (and most channels)
+        largest = max(video_outputs or outputs,
+                      key=lambda output: output["video_settings"]["width"] * output["video_settings"]["height"])
+        for output in video_outputs:
+            if self.display_ratio(output["video_settings"]) != self.display_ratio(largest["video_settings"]):
+                log.warning("Output %s has a different aspect ratio (and will be stretched)" % (
+                    output["export_file_path"]))
+        video_settings = dict(largest["video_settings"], has_video=bool(video_outputs))
+        audio_settings = dict(max(audio_outputs or outputs, key=lambda output: (
+            output["audio_settings"].get("sample_rate"), output["audio_settings"].get("channels")))["audio_settings"],
+            has_audio=bool(audio_outputs))
+
+        super().__init__(project_data, largest["export_file_path"], video_settings, audio_settings, timeline_info,
+                         pipeline_depth)
+
+    @staticmethod
+    def display_ratio(video_settings):
+        pixel_ratio = video_settings["pixel_ratio"]
+        return round(video_settings["width"] * pixel_ratio["num"] / pixel_ratio["den"] / video_settings["height"], 3)
+
+    def create_writers(self):
+        """Create (and open) a writer for each output"""
+        writers = []
+        try:
+            for output in self.outputs:
+                # Write the same range of frames as the composited timeline
+                video_settings = dict(output["video_settings"], end_frame=self.video_settings.get("end_frame"))
+                log.info("Export output: %s (%sx%s)" % (
+                    output["export_file_path"], video_settings.get("width"), video_settings.get("height")))
+                writers.append(create_writer(output["export_file_path"], video_settings, output["audio_settings"]))
+        except Exception:
+            for w in writers:
+                w.Close()
+            raise
+        return writers
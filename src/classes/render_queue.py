@@ -0,0 +1,270 @@
+"""
+ @file
+ @brief This file contains the headless (command line) renderer, and render queue files
+ @author Jonathan Thomas <jonathan@openshot.org>
+
+ @section LICENSE
+
+ Copyright (c) 2008-2018 OpenShot Studios, LLC
+ (http://www.openshotstudios.com). This file is part of
+ OpenShot Video Editor (http://www.openshot.org), an open-source project
+ dedicated to delivering high quality video editing and animation solutions
+ to the world.
+
+ OpenShot Video Editor is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ OpenShot Video Editor is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with OpenShot Library.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+# A render queue file is JSON, with a list of jobs (relative paths are relative to the queue file):
+#  {
+#    "concurrency": 2,
+#    "jobs": [
+#      {"project": "intro.osp", "preset": "MP4 (h.264)", "out": "intro.mp4"},
+#      {"project": "intro.osp", "preset": "webm", "profile": "HD 720p 30 fps", "quality": "Med",
+#       "export_type": "video-audio", "start_frame": 1, "end_frame": 300, "out": "intro-720p.webm",
+#       "processes": 4, "pipeline_depth": 8, "report": true,
+#       "smart_render": true, "cache_limit_mb": 0},
+#      {"project": "intro.osp", "end_frame": 300, "outputs": [
+#        {"preset": "MP4 (h.264)", "profile": "4K UHD 2160p 30 fps", "out": "intro-2160p.mp4"},
+#        {"preset": "MP4 (h.264)", "profile": "HD 1080p 30 fps", "quality": "Med", "out": "intro-1080p.mp4"},
+#        {"preset": "MP3 (audio only)", "export_type": "audio", "out": "intro.mp3"}
+#      ]}
+#    ]
+#  }
+# Jobs with a list of outputs render every output in a single pass (see MultiExportRenderer).
+
+import os
+import sys
+import json
+import time
+import signal
+import subprocess
+
+import openshot
+
+from classes.logger import log
+from classes.render import (
+    EXPORT_VIDEO_AUDIO, MultiExportRenderer, find_preset, find_profile, get_export_settings, get_launch_command,
+    load_project_data, rescale_project_data
+)
+from classes.render_report import get_report_path
+from classes.render_segments import create_renderer, render_segment
+
+# Keys of a render job (and their command line arguments, see launch.py)
+JOB_ARGUMENTS = [
+    ("project", "--render"),
+    ("preset", "--preset"),
+    ("profile", "--profile"),
+    ("quality", "--quality"),
+    ("export_type", "--export-type"),
+    ("start_frame", "--start-frame"),
+    ("end_frame", "--end-frame"),
+    ("out", "--out"),
+    ("processes", "--processes"),
+    ("pipeline_depth", "--pipeline-depth"),
+    ("report", "--report"),
+    ("smart_render", "--smart-render"),
+    ("cache_limit_mb", "--cache-limit-mb"),
+    ("outputs", "--outputs"),
+]
+
+
+def get_output(job, output, project_data):
+    """Get the export settings of an output (preset, profile, quality, export_type and out) of a job,
+    or None if the preset or profile are not found"""
+    preset = find_preset(output.get("preset"))
+    if not preset:
+        log.error("Export preset not found: %s" % output.get("preset"))
+        return None
+
+    # Use the requested profile, or the preset's profile, or the project's profile (like the Export dialog)
+    profile_name = output.get("profile") or (sorted(preset["projectprofiles"]) or [project_data.get("profile")])[0]
+    profile_path = find_profile(profile_name)
+    if not profile_path:
+        log.error("Profile not found: %s" % profile_name)
+        return None
+
+    video_settings, audio_settings = get_export_settings(
+        preset, profile_path, output.get("quality") or "High", output.get("export_type") or EXPORT_VIDEO_AUDIO,
+        int(job.get("start_frame") or 1), int(job["end_frame"]) if job.get("end_frame") else None)
+    log.info("Rendering %s to %s (%s, %s)" % (job.get("project"), output.get("out"), preset["title"], profile_path))
+    os.makedirs(os.path.dirname(os.path.abspath(output.get("out"))), exist_ok=True)
+    return {"export_file_path": output.get("out"), "video_settings": video_settings, "audio_settings": audio_settings}
+
+
+def render_job(job, progress=True):
+    """Render a single job (dict of JOB_ARGUMENTS keys), and return True if successful"""
+    project_path = job.get("project")
+    job_outputs = job.get("outputs") or [job]
+    if not project_path or not all(output.get("preset") and output.get("out") for output in job_outputs):
+        log.error("Render jobs need a project, preset and output path: %s" % job)
+        return False
+
+    try:
+        project_data = load_project_data(project_path)
+    except Exception as ex:
+        log.error("Failed to load project %s: %s" % (project_path, ex))
+        return False
+
+    outputs = [get_output(job, output, project_data) for output in job_outputs]
+    if None in outputs:
+        return False
+    # Frame rate of the export (audio only outputs use the frame rate of the project)
+    video_outputs = [output for output in outputs if output["video_settings"].get("has_video")]
+    project_data = rescale_project_data(project_data, (video_outputs or outputs)[0]["video_settings"])
+    export_file_path = outputs[0]["export_file_path"]
+
+    if len(outputs) > 1:
+        # Composite each frame once (for every output)
+        if int(job.get("processes") or 1) > 1 or job.get("smart_render"):
+            log.warning("Rendering %s in a single process (processes and smart_render do not apply to "
+                        "jobs with several outputs)" % project_path)
+        try:
+            renderer = MultiExportRenderer(project_data, outputs, pipeline_depth=int(job.get("pipeline_depth") or 0))
+        except ValueError as ex:
+            log.error("Failed to render %s: %s" % (project_path, ex))
+            return False
+        renderer.cache_limit_mb = int(job.get("cache_limit_mb") or 0)
+        if job.get("report"):
+            renderer.report_path = get_report_path(renderer.export_file_path)
+    else:
+        renderer = create_renderer(project_data, export_file_path,
+                                   outputs[0]["video_settings"], outputs[0]["audio_settings"],
+                                   processes=int(job.get("processes") or 1),
+                                   pipeline_depth=int(job.get("pipeline_depth") or 0),
+                                   report=bool(job.get("report")),
+                                   smart_render=bool(job.get("smart_render")),
+                                   cache_limit_mb=int(job.get("cache_limit_mb") or 0))
+
+    def print_progress(frame, seconds_elapsed):
+        start_frame = renderer.video_settings.get("start_frame")
+        end_frame = renderer.video_settings.get("end_frame")
+        portion = (frame - start_frame) / max(1, end_frame - start_frame)
+        fps = (frame - start_frame) / seconds_elapsed if seconds_elapsed else 0.0
+        print("%s: %5.1f%% (frame %d of %d, %.2f FPS)" % (
+            os.path.basename(export_file_path), portion * 100, frame, end_frame, fps), flush=True)
+
+    try:
+        renderer.render(print_progress if progress else None)
+    except Exception as ex:
+        log.error("Failed to render %s: %s" % (export_file_path, ex))
+        return False
+    return True
+
+
+def job_command(job):
+    """Get the command line to render a job in a separate process"""
+    command = get_launch_command()
+    for key, argument in JOB_ARGUMENTS:
+        if isinstance(job.get(key), bool):
+            # Flags (i.e. --report)
+            if job.get(key):
+                command.append(argument)
+        elif isinstance(job.get(key), list):
+            # Lists (i.e. --outputs) are passed as JSON
+            command.extend([argument, json.dumps(job.get(key))])
+        elif job.get(key) is not None:
+            command.extend([argument, str(job.get(key))])
+    return command
+
+
+def load_queue(queue_path):
+    """Read a render queue file, and get its concurrency and jobs (with paths relative to the queue file)"""
+    with open(queue_path, 'r', encoding='utf-8') as queue_file:
+        queue = json.load(queue_file)
+
+    queue_folder = os.path.dirname(os.path.abspath(queue_path))
+    jobs = []
+    for job in queue.get("jobs", []):
+        job = dict(job)
+        for key in ["project", "out"]:
+            if job.get(key):
+                job[key] = os.path.join(queue_folder, os.path.expanduser(job[key]))
+        if job.get("outputs"):
+            job["outputs"] = [dict(output, out=os.path.join(queue_folder, os.path.expanduser(output["out"])))
+                              if output.get("out") else dict(output) for output in job["outputs"]]
+        jobs.append(job)
+    return int(queue.get("concurrency", 1)), jobs
+
+
+def render_queue(jobs, concurrency=1):
+    """Render jobs one at a time (in this process), or several at once (in separate processes).
+    Returns the number of failed jobs."""
+    if concurrency > 1 and not get_launch_command():
+        log.warning("Rendering one job at a time (OpenShot can't be started in a separate process)")
+        concurrency = 1
+    if concurrency <= 1:
+        return sum(1 for job in jobs if not render_job(job))
+
+    failed = 0
+    pending = list(jobs)
+    running = []
+    while pending or running:
+        # Start jobs (up to the concurrency limit)
+        while pending and len(running) < concurrency:
+            job = pending.pop(0)
+            log.info("Starting render process for %s" % job.get("out"))
+            running.append((job, subprocess.Popen(job_command(job))))
+
+        time.sleep(0.5)
+        for job, process in list(running):
+            if process.poll() is not None:
+                running.remove((job, process))
+                if process.returncode != 0:
+                    log.error("Render process failed for %s (exit code %s)" % (job.get("out"), process.returncode))
+                    failed += 1
+    return failed
+
+
+def init_headless():
+    """Create the Qt application needed to render (without a display), and return it"""
+    from PyQt5.QtGui import QGuiApplication
+
+    # libopenshot needs a Qt application (for fonts and images), but not a display
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app = QGuiApplication([sys.argv[0]])
+
+    # Allow Ctrl+C to stop rendering
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    # Use high quality scaling (same as the Export dialog)
+    openshot.Settings.Instance().HIGH_QUALITY_SCALING = True
+    return app
+
+
+def main(args):
+    """Render from the command line (without the main window), and return the exit code"""
+    app = init_headless()  # noqa: F841
+
+    if args.render_segment:
+        # One segment of a segmented export (see render_segments.py)
+        return render_segment(args.render_segment)
+
+    if args.render_queue:
+        try:
+            concurrency, jobs = load_queue(args.render_queue)
+        except (OSError, ValueError) as ex:
+            log.error("Failed to read render queue %s: %s" % (args.render_queue, ex))
+            return 1
+        failed = render_queue(jobs, args.render_jobs or concurrency)
+        log.info("Rendered %d of %d jobs" % (len(jobs) - failed, len(jobs)))
+        return 1 if failed else 0
+
+    job = {key: getattr(args, argument[2:].replace("-", "_")) for key, argument in JOB_ARGUMENTS}
+    if job.get("outputs"):
+        try:
+            job["outputs"] = json.loads(job["outputs"])
+        except ValueError as ex:
+            log.error("Failed to read outputs %s: %s" % (job["outputs"], ex))
+            return 1
+    return 0 if render_job(job) else 1
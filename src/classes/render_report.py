@@ -0,0 +1,200 @@
+"""
+ @file
+ @brief This file contains the export performance report (per-frame timings, and the slowest parts of an export)
+ @author Jonathan Thomas <jonathan@openshot.org>
+
+ @section LICENSE
+
+ Copyright (c) 2008-2018 OpenShot Studios, LLC
+ (http://www.openshotstudios.com). This file is part of
+ OpenShot Video Editor (http://www.openshot.org), an open-source project
+ dedicated to delivering high quality video editing and animation solutions
+ to the world.
+
+ OpenShot Video Editor is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ OpenShot Video Editor is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with OpenShot Library.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+import sys
+import json
+import time
+
+try:
+    # Not available on Windows
+    import resource
+except ImportError:
+    resource = None
+
+from classes.logger import log
+
+REPORT_VERSION = 1
+
+# Number of slowest frames and slowest time ranges in a report
+REPORT_SLOWEST_FRAMES = 10
+REPORT_SLOWEST_RANGES = 5
+
+# Length of the time ranges compared in a report (in seconds)
+REPORT_RANGE_SECONDS = 1.0
+
+
+def get_report_path(export_file_path):
+    """Get the path of the performance report of an export (next to the exported file)"""
+    return "%s.report.json" % export_file_path
+
+
+def get_peak_memory():
+    """Get the peak memory used by this process (in bytes), or None if unknown"""
+    if not resource:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def get_active_clips(project_data, fps, start_frame, end_frame):
+    """Get the clips (and their effects) visible or audible between two export frames"""
+    clips = []
+    for clip in project_data.get("clips", []):
+        first_frame = round(clip.get("position", 0.0) * fps) + 1
+        last_frame = round((clip.get("position", 0.0) + clip.get("end", 0.0) - clip.get("start", 0.0)) * fps)
+        if first_frame > end_frame or last_frame < start_frame:
+            continue
+        clips.append({
+            "id": clip.get("id"),
+            "title": clip.get("title") or clip.get("reader", {}).get("path", ""),
+            "layer": clip.get("layer"),
+            "effects": [effect.get("class_name") or effect.get("type") for effect in clip.get("effects", [])],
+        })
+    return sorted(clips, key=lambda clip: (-len(clip["effects"]), clip["layer"] or 0))
+
+
+class ExportReport:
+    """ Collects the time spent rendering and encoding each frame of an export (render times can
+    be added from several threads), and the size of the export cache. """
+
+    def __init__(self, start_frame, end_frame):
+        self.start_frame = start_frame
+        self.render_times = [0.0] * (end_frame - start_frame + 1)
+        self.encode_times = [0.0] * (end_frame - start_frame + 1)
+        self.last_frame = start_frame - 1
+        self.cache_max_bytes = 0
+        self.cache_peak_bytes = 0
+        self.cache_peak_frames = 0
+
+    def add_render(self, frame, seconds):
+        self.render_times[frame - self.start_frame] = seconds
+
+    def add_encode(self, frame, seconds):
+        self.encode_times[frame - self.start_frame] = seconds
+        self.last_frame = frame
+
+    def sample_cache(self, cache_object):
+        """Track the largest size of the export cache"""
+        if not cache_object:
+            return
+        self.cache_max_bytes = cache_object.GetMaxBytes()
+        self.cache_peak_bytes = max(self.cache_peak_bytes, cache_object.GetBytes())
+        self.cache_peak_frames = max(self.cache_peak_frames, cache_object.Count())
+
+    def frame_times(self):
+        """Get a list of [frame, render seconds, encode seconds] (for each frame written)"""
+        return [[self.start_frame + index, self.render_times[index], self.encode_times[index]]
+                for index in range(self.last_frame - self.start_frame + 1)]
+
+    def cache_stats(self):
+        return {"max_bytes": self.cache_max_bytes,
+                "peak_bytes": self.cache_peak_bytes,
+                "peak_frames": self.cache_peak_frames}
+
+
+def build_report(renderer, frame_times, elapsed_seconds, cache_stats, peak_memory):
+    """Get the report of an export (as a dict), from the [frame, render, encode] times of each frame"""
+    video_settings = renderer.video_settings
+    fps = float(video_settings["fps"]["num"]) / float(video_settings["fps"]["den"])
+    frame_times = sorted(frame_times)
+
+    # Slowest frames
+    slowest_frames = []
+    for frame, render_seconds, encode_seconds in sorted(
+            frame_times, key=lambda times: times[1] + times[2], reverse=True)[:REPORT_SLOWEST_FRAMES]:
+        slowest_frames.append({
+            "frame": frame,
+            "seconds": render_seconds + encode_seconds,
+            "render_seconds": render_seconds,
+            "encode_seconds": encode_seconds,
+            "clips": get_active_clips(renderer.project_data, fps, frame, frame),
+        })
+
+    # Slowest ranges of frames (of REPORT_RANGE_SECONDS each)
+    range_frames = max(1, round(fps * REPORT_RANGE_SECONDS))
+    ranges = {}
+    for frame, render_seconds, encode_seconds in frame_times:
+        range_start = frame - (frame - video_settings["start_frame"]) % range_frames
+        ranges[range_start] = ranges.get(range_start, 0.0) + render_seconds + encode_seconds
+    slowest_ranges = []
+    for range_start, seconds in sorted(ranges.items(), key=lambda item: item[1], reverse=True)[:REPORT_SLOWEST_RANGES]:
+        range_end = min(range_start + range_frames - 1, frame_times[-1][0])
+        slowest_ranges.append({
+            "start_frame": range_start,
+            "end_frame": range_end,
+            "start_seconds": (range_start - 1) / fps,
+            "seconds": seconds,
+            "clips": get_active_clips(renderer.project_data, fps, range_start, range_end),
+        })
+
+    frames = len(frame_times)
+    return {
+        "version": REPORT_VERSION,
+        "file": renderer.export_file_path,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "video_settings": video_settings,
+        "audio_settings": renderer.audio_settings,
+        "processes": getattr(renderer, "processes", 1),
+        "pipeline_depth": renderer.pipeline_depth,
+        "frames": frames,
+        "elapsed_seconds": elapsed_seconds,
+        "fps": frames / elapsed_seconds if elapsed_seconds else 0.0,
+        "stages": renderer.stats,
+        "render_seconds": sum(times[1] for times in frame_times),
+        "encode_seconds": sum(times[2] for times in frame_times),
+        "peak_memory_bytes": peak_memory,
+        "cache": cache_stats,
+        "slowest_frames": slowest_frames,
+        "slowest_ranges": slowest_ranges,
+        "frame_times": frame_times,
+    }
+
+
+def get_report_summary(report):
+    """Get a short summary of a report (the time spent in each stage, the slowest ranges and the peak memory)"""
+    lines = ["%s frames at %.2f FPS: %.1f seconds rendering, %.1f seconds encoding" % (
+        report.get("frames"), report.get("fps"), report.get("render_seconds"), report.get("encode_seconds"))]
+    for slow_range in report.get("slowest_ranges", [])[:3]:
+        lines.append("Slow: frames %s-%s took %.1f seconds (%s)" % (
+            slow_range.get("start_frame"), slow_range.get("end_frame"), slow_range.get("seconds"),
+            ", ".join(clip["title"] for clip in slow_range.get("clips", [])[:3]) or "no clips"))
+    if report.get("peak_memory_bytes"):
+        lines.append("Peak memory: %.0f MB" % (report.get("peak_memory_bytes") / 1024 / 1024))
+    return lines
+
+
+def save_report(report, report_path):
+    """Write a report to a JSON file (and log its summary)"""
+    for line in get_report_summary(report):
+        log.info("Export report: %s" % line)
+    try:
+        with open(report_path, 'w', encoding='utf-8') as report_file:
+            json.dump(report, report_file)
+        log.info("Saved export report: %s" % report_path)
+    except OSError as ex:
+        log.warning("Failed to save export report %s: %s" % (report_path, ex))
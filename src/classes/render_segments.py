@@ -0,0 +1,394 @@
+"""
+ @file
+ @brief This file contains the segmented export renderer (which renders ranges of frames in parallel processes)
+ @author Jonathan Thomas <jonathan@openshot.org>
+
+ @section LICENSE
+
+ Copyright (c) 2008-2018 OpenShot Studios, LLC
+ (http://www.openshotstudios.com). This file is part of
+ OpenShot Video Editor (http://www.openshot.org), an open-source project
+ dedicated to delivering high quality video editing and animation solutions
+ to the world.
+
+ OpenShot Video Editor is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ OpenShot Video Editor is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with OpenShot Library.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+# A segmented export splits the frame range into segments (which start on a GOP boundary),
+# renders the video of each segment in a separate process (each with its own Timeline),
+# renders the audio of the whole range in one more process (so there are no gaps at the
+# segment boundaries), and then joins the segments and audio into the exported file with
+# ffmpeg (copying the encoded streams, without encoding them again).
+
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import tempfile
+import subprocess
+from threading import Thread
+
+from classes.logger import log
+from classes.render import ExportRenderer, create_export_timeline, get_launch_command
+from classes.render_report import build_report, get_peak_memory, get_report_path, save_report
+
+# Seconds of video in each group of pictures (so segments can be joined without encoding again)
+SEGMENT_GOP_SECONDS = 2
+
+# Number of segments per process (more, smaller segments keep every process busy until the end)
+SEGMENTS_PER_PROCESS = 2
+
+# Shortest segment (in GOPs), so short exports are not split into many tiny files
+MIN_SEGMENT_GOPS = 5
+
+# Prefix of the progress lines printed by segment processes
+PROGRESS_PREFIX = "segment-progress "
+
+
+def get_ffmpeg_path():
+    """Get the path of the ffmpeg program (used to join segments), or None if not installed"""
+    return shutil.which("ffmpeg")
+
+
+def get_gop_size(video_settings):
+    """Get the number of frames in each group of pictures"""
+    fps = float(video_settings["fps"]["num"]) / float(video_settings["fps"]["den"])
+    return max(1, int(round(fps * SEGMENT_GOP_SECONDS)))
+
+
+def split_segments(start_frame, end_frame, gop_size, count):
+    """Split a range of frames into (up to) count (start, end) segments, which start on a GOP boundary"""
+    total_gops = math.ceil((end_frame - start_frame + 1) / gop_size)
+    segment_gops = max(MIN_SEGMENT_GOPS, math.ceil(total_gops / max(1, count)))
+    segment_frames = segment_gops * gop_size
+    return [(first, min(end_frame, first + segment_frames - 1))
+            for first in range(start_frame, end_frame + 1, segment_frames)]
+
+
+def segmented_export_unsupported(export_file_path, video_settings, audio_settings):
+    """Get the reason an export can't be rendered in segments (or None if it can)"""
+    if not video_settings.get("has_video"):
+        return "audio only exports are rendered as one stream"
+    if "%" in os.path.basename(export_file_path):
+        return "image sequences are not joined"
+    if not get_ffmpeg_path():
+        return "ffmpeg was not found (needed to join segments)"
+    if not get_launch_command():
+        return "OpenShot can't be started in a separate process (needed to render segments)"
+    return None
+
+
+def create_renderer(project_data, export_file_path, video_settings, audio_settings,
+                    timeline_info=None, processes=1, pipeline_depth=0, report=False, smart_render=False,
+                    cache_limit_mb=0):
+    """Create a smart renderer (if requested), a segmented renderer (if more than 1 process was requested),
+    or a single process ExportRenderer, depending on what the export supports. Any of them saves a
+    performance report next to the export (if requested)."""
+    renderer = None
+    if smart_render:
+        from classes.smart_render import SmartExportRenderer, get_ffprobe_path
+        reason = segmented_export_unsupported(export_file_path, video_settings, audio_settings)
+        if not reason and not get_ffprobe_path():
+            reason = "ffprobe was not found (needed to find keyframes)"
+        if not reason:
+            renderer = SmartExportRenderer(project_data, export_file_path, video_settings, audio_settings,
+                                           timeline_info, processes, pipeline_depth)
+        else:
+            log.info("Smart render is not available (%s)" % reason)
+    if not renderer and processes > 1:
+        reason = segmented_export_unsupported(export_file_path, video_settings, audio_settings)
+        if not reason:
+            renderer = SegmentedExportRenderer(project_data, export_file_path, video_settings, audio_settings,
+                                               timeline_info, processes, pipeline_depth)
+        else:
+            log.info("Exporting in a single process (%s)" % reason)
+    if not renderer:
+        renderer = ExportRenderer(project_data, export_file_path, video_settings, audio_settings, timeline_info,
+                                  pipeline_depth)
+    if report:
+        renderer.report_path = get_report_path(export_file_path)
+    renderer.cache_limit_mb = cache_limit_mb
+    return renderer
+
+
+class SegmentProcess:
+    """ A process rendering one segment (or the audio) of a segmented export """
+
+    def __init__(self, spec_path, start_frame, end_frame):
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.frame = start_frame
+        self.process = subprocess.Popen(
+            get_launch_command() + ["--render-segment", spec_path],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True, bufsize=1)
+
+        # Read progress lines (without blocking the renderer)
+        self.reader = Thread(target=self.read_progress, daemon=True)
+        self.reader.start()
+
+    def read_progress(self):
+        for line in self.process.stdout:
+            if line.startswith(PROGRESS_PREFIX):
+                self.frame = int(line[len(PROGRESS_PREFIX):])
+
+    def frames_done(self):
+        if self.process.poll() == 0:
+            return self.end_frame - self.start_frame + 1
+        return self.frame - self.start_frame
+
+    def send(self, command):
+        """Send a command (pause, resume or cancel) to the process"""
+        try:
+            self.process.stdin.write(command + "\n")
+            self.process.stdin.flush()
+        except (OSError, ValueError):
+            # Process already finished
+            pass
+
+
+class SegmentedExportRenderer(ExportRenderer):
+    """ Writes a range of frames from project data to a file, by rendering segments of the video
+    in separate processes (and the audio in one more process), and joining them when all are done. """
+
+    def __init__(self, project_data, export_file_path, video_settings, audio_settings, timeline_info=None,
+                 processes=2, pipeline_depth=0):
+        super().__init__(project_data, export_file_path, video_settings, audio_settings, timeline_info,
+                         pipeline_depth)
+        self.processes = processes
+
+        # Seconds between checks of the segment processes
+        self.poll_interval = 0.25
+
+    def write_spec(self, folder, name, project_path, video_settings, audio_settings, out_path, report_path=None):
+        """Write the settings of one segment process (and return the path)"""
+        spec_path = os.path.join(folder, "%s.json" % name)
+        with open(spec_path, 'w', encoding='utf-8') as spec_file:
+            json.dump({"project": project_path,
+                       "out": out_path,
+                       "report_path": report_path,
+                       "video_settings": video_settings,
+                       "audio_settings": audio_settings,
+                       "timeline_info": self.timeline_info,
+                       "pipeline_depth": self.pipeline_depth,
+                       "cache_limit_mb": self.cache_limit_mb,
+                       # Segment processes (and the audio process) share the available memory
+                       "cache_shares": self.processes + 1}, spec_file)
+        return spec_path
+
+    def plan_segments(self, start_frame, end_frame, gop_size):
+        """Get the (first frame, last frame, copy) of each segment, where copy is None for rendered segments
+        (or the details needed by copy_segment, for segments copied from a source file)"""
+        segments = split_segments(start_frame, end_frame, gop_size, self.processes * SEGMENTS_PER_PROCESS)
+        return [(first, last, None) for first, last in segments]
+
+    def copy_segment(self, copy, segment_path):
+        """Write a segment without rendering it. Only renderers which plan copied segments (see
+        SmartExportRenderer) can copy them, since this renderer has no source to copy from."""
+        raise RuntimeError("Segment %s has no copy source: %s" % (segment_path, copy))
+
+    def render(self, progress_callback=None):
+        """Export all frames (calling progress_callback with the current frame and elapsed seconds),
+        and return the last frame written"""
+        if not self.video_settings.get("end_frame"):
+            # Export to the end of the timeline (if no end frame)
+            timeline, export_cache_object = create_export_timeline(
+                self.project_data, self.video_settings, self.audio_settings, self.timeline_info)
+            self.video_settings["end_frame"] = timeline.GetMaxFrame()
+            timeline.Close()
+            timeline.ClearAllCache()
+        start_frame = self.video_settings.get("start_frame")
+        end_frame = self.video_settings.get("end_frame")
+
+        gop_size = get_gop_size(self.video_settings)
+        segments = self.plan_segments(start_frame, end_frame, gop_size)
+        log.info("Exporting %s frames in %s segments (%s processes, GOP of %s frames)" % (
+            end_frame - start_frame + 1, len(segments), self.processes, gop_size))
+
+        # Segments are written next to the exported file (so joining them does not copy across disks)
+        export_folder = os.path.dirname(os.path.abspath(self.export_file_path))
+        ext = os.path.splitext(self.export_file_path)[1]
+        folder = tempfile.mkdtemp(prefix=".openshot-segments-", dir=export_folder)
+        running = []
+        try:
+            project_path = os.path.join(folder, "project.json")
+            with open(project_path, 'w', encoding='utf-8') as project_file:
+                json.dump(self.project_data, project_file)
+
+            # Audio of the whole range (rendered alongside the first segments)
+            audio_path = None
+            pending = []
+            if self.audio_settings.get("has_audio"):
+                audio_path = os.path.join(folder, "audio%s" % ext)
+                video_settings = dict(self.video_settings, has_video=False)
+                spec_path = self.write_spec(
+                    folder, "audio", project_path, video_settings, self.audio_settings, audio_path)
+                pending.append((spec_path, start_frame, end_frame, False))
+
+            # Video of each segment
+            segment_paths = []
+            report_paths = []
+            copied_frames = 0
+            for index, (first, last, copy) in enumerate(segments):
+                segment_path = os.path.join(folder, "segment-%04d%s" % (index, ext))
+                segment_paths.append(segment_path)
+                if copy:
+                    self.copy_segment(copy, segment_path)
+                    copied_frames += last - first + 1
+                    continue
+                video_settings = dict(self.video_settings, start_frame=first, end_frame=last, gop_size=gop_size)
+                audio_settings = dict(self.audio_settings, has_audio=False)
+                report_path = "%s.report.json" % segment_path if self.report_path else None
+                report_paths.append(report_path)
+                spec_path = self.write_spec(folder, "segment-%04d" % index, project_path,
+                                            video_settings, audio_settings, segment_path, report_path)
+                pending.append((spec_path, first, last, True))
+
+            segment_processes = []
+            start_time_export = time.time()
+            while pending or any(p.process.poll() is None for p in running):
+                # Start segments (the audio process does not count toward the limit)
+                while pending and sum(1 for p in segment_processes if p.process.poll() is None) < self.processes:
+                    spec_path, first, last, is_segment = pending.pop(0)
+                    segment_process = SegmentProcess(spec_path, first, last)
+                    running.append(segment_process)
+                    if is_segment:
+                        segment_processes.append(segment_process)
+
+                time.sleep(self.poll_interval)
+
+                # Pause (and resume) every process
+                if not self.resumed.is_set():
+                    for p in running:
+                        p.send("pause")
+                    self.wait_if_paused()
+                    for p in running:
+                        p.send("resume")
+
+                if self.cancelled:
+                    log.info("Export cancelled")
+                    break
+
+                failed = [p for p in running if p.process.poll() not in [None, 0]]
+                if failed:
+                    raise RuntimeError("Segment process failed (exit code %s)" % failed[0].process.returncode)
+
+                if progress_callback:
+                    frames_done = copied_frames + sum(p.frames_done() for p in segment_processes)
+                    progress_callback(min(end_frame, start_frame + frames_done),
+                                      time.time() - start_time_export - self.paused_seconds)
+
+            if self.cancelled:
+                return start_frame + copied_frames + sum(p.frames_done() for p in segment_processes)
+
+            self.join_segments(folder, segment_paths, audio_path)
+            if self.report_path:
+                self.save_report(report_paths, time.time() - start_time_export - self.paused_seconds)
+            if progress_callback:
+                progress_callback(end_frame, time.time() - start_time_export - self.paused_seconds)
+            return end_frame
+
+        finally:
+            # Stop any running processes (which close their files), and delete the segments
+            for p in running:
+                if p.process.poll() is None:
+                    p.send("cancel")
+            for p in running:
+                try:
+                    p.process.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    p.process.kill()
+                    p.process.wait()
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def save_report(self, report_paths, elapsed_seconds):
+        """Combine the reports of every rendered segment into the report of the export"""
+        frame_times = []
+        cache_stats = {}
+        peak_memory = get_peak_memory()
+        self.stats = {}
+        for report_path in report_paths:
+            try:
+                with open(report_path, 'r', encoding='utf-8') as report_file:
+                    segment_report = json.load(report_file)
+            except (OSError, ValueError) as ex:
+                log.warning("Failed to read segment report %s: %s" % (report_path, ex))
+                continue
+            frame_times.extend(segment_report.get("frame_times", []))
+            for key, value in segment_report.get("cache", {}).items():
+                cache_stats[key] = max(cache_stats.get(key, 0), value)
+            for key, value in segment_report.get("stages", {}).items():
+                self.stats[key] = self.stats.get(key, 0.0) + value
+            if segment_report.get("peak_memory_bytes"):
+                # Peak of the largest process (segment processes overlap, so the total may be higher)
+                peak_memory = max(peak_memory or 0, segment_report["peak_memory_bytes"])
+
+        self.report = build_report(self, frame_times, elapsed_seconds, cache_stats, peak_memory)
+        save_report(self.report, self.report_path)
+
+    def join_segments(self, folder, segment_paths, audio_path):
+        """Join the video segments (and audio) into the exported file, without encoding them again"""
+        list_path = os.path.join(folder, "segments.txt")
+        with open(list_path, 'w', encoding='utf-8') as list_file:
+            for segment_path in segment_paths:
+                list_file.write("file '%s'\n" % segment_path.replace("'", "'\\''"))
+
+        command = [get_ffmpeg_path(), "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", list_path]
+        if audio_path:
+            command.extend(["-i", audio_path, "-map", "0:v", "-map", "1:a"])
+        command.extend(["-c", "copy"])
+        if self.video_settings.get("vformat") in ["mp4", "mov"]:
+            command.extend(["-movflags", "+faststart"])
+        command.extend(["-f", self.video_settings.get("vformat"), self.export_file_path])
+
+        log.info("Joining %s segments: %s" % (len(segment_paths), self.export_file_path))
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if result.returncode != 0:
+            raise RuntimeError("Failed to join segments: %s" % result.stderr.strip())
+
+
+def render_segment(spec_path):
+    """Render one segment (in a segment process), and return the exit code. Progress is printed
+    to stdout, and pause, resume and cancel commands are read from stdin."""
+    with open(spec_path, 'r', encoding='utf-8') as spec_file:
+        spec = json.load(spec_file)
+    with open(spec["project"], 'r', encoding='utf-8') as project_file:
+        project_data = json.load(project_file)
+
+    renderer = ExportRenderer(project_data, spec["out"], spec["video_settings"], spec["audio_settings"],
+                              spec.get("timeline_info"), spec.get("pipeline_depth", 0))
+    renderer.report_path = spec.get("report_path")
+    renderer.cache_limit_mb = spec.get("cache_limit_mb", 0)
+    renderer.cache_shares = spec.get("cache_shares", 1)
+    renderer.progress_interval = 0.5
+
+    def read_commands():
+        for line in sys.stdin:
+            command = line.strip()
+            if command in ["pause", "resume", "cancel"]:
+                getattr(renderer, command)()
+        # Stop if the parent process goes away
+        renderer.cancel()
+
+    def print_progress(frame, seconds_elapsed):
+        print("%s%d" % (PROGRESS_PREFIX, frame), flush=True)
+
+    Thread(target=read_commands, daemon=True).start()
+    try:
+        renderer.render(print_progress)
+    except Exception as ex:
+        log.error("Failed to render segment %s: %s" % (spec["out"], ex))
+        return 1
+    return 2 if renderer.cancelled else 0
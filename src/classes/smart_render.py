@@ -0,0 +1,342 @@
+"""
+ @file
+ @brief This file contains the smart renderer (which copies untouched ranges of a clip, instead of encoding them again)
+ @author Jonathan Thomas <jonathan@openshot.org>
+
+ @section LICENSE
+
+ Copyright (c) 2008-2018 OpenShot Studios, LLC
+ (http://www.openshotstudios.com). This file is part of
+ OpenShot Video Editor (http://www.openshot.org), an open-source project
+ dedicated to delivering high quality video editing and animation solutions
+ to the world.
+
+ OpenShot Video Editor is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ OpenShot Video Editor is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with OpenShot Library.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+# A pass-through range is part of the timeline showing a single clip, unchanged: no effects,
+# every keyframe at its identity value, no other video (or transitions) at the same time, and a
+# source file with the same size, frame rate and codec (and codec parameters) as the export.
+# The encoded video of these ranges is copied from the source file (from one keyframe to another),
+# and everything else (including the frames before the first keyframe of a range) is rendered.
+# Audio is always rendered, and the joined video is decoded once, to check it.
+
+import os
+import json
+import shutil
+import subprocess
+import tempfile
+
+from classes.logger import log
+from classes.render import create_export_timeline, create_writer
+from classes.render_segments import SegmentedExportRenderer, get_ffmpeg_path, split_segments, SEGMENTS_PER_PROCESS
+
+# Video codec (as named by ffprobe) written by each encoder
+ENCODER_CODECS = {
+    "libx264": "h264", "h264_nvenc": "h264", "h264_vaapi": "h264", "h264_qsv": "h264",
+    "h264_videotoolbox": "h264", "libx265": "hevc", "hevc_nvenc": "hevc", "hevc_vaapi": "hevc",
+    "hevc_qsv": "hevc", "libvpx": "vp8", "libvpx-vp9": "vp9", "libaom-av1": "av1", "libsvtav1": "av1",
+    "mpeg4": "mpeg4", "mpeg2video": "mpeg2video", "dnxhd": "dnxhd", "prores_ks": "prores", "mjpeg": "mjpeg",
+}
+
+# Clip keyframes (and their values, when a clip's frames are not changed)
+IDENTITY_KEYFRAMES = {
+    "scale_x": 1.0, "scale_y": 1.0, "location_x": 0.0, "location_y": 0.0, "alpha": 1.0, "rotation": 0.0,
+    "shear_x": 0.0, "shear_y": 0.0, "crop_x": 0.0, "crop_y": 0.0, "crop_width": 1.0, "crop_height": 1.0,
+    "perspective_c1_x": -1.0, "perspective_c1_y": -1.0, "perspective_c2_x": -1.0, "perspective_c2_y": -1.0,
+    "perspective_c3_x": -1.0, "perspective_c3_y": -1.0, "perspective_c4_x": -1.0, "perspective_c4_y": -1.0,
+}
+
+# Clip keyframes which never change a clip's frames (audio is always rendered, and the origin only
+# matters when a clip is scaled or rotated)
+IGNORED_KEYFRAMES = ["volume", "channel_filter", "channel_mapping", "has_audio", "origin_x", "origin_y"]
+
+# Clip properties (and their values, when a clip's frames are not changed). The scale mode, gravity
+# and anchor don't matter, since the source and the export have the same size.
+IDENTITY_PROPERTIES = {"display": 0}
+
+# Stream properties which must match (between a source file and the encoder) to join copied video
+MATCHING_STREAM_KEYS = ["codec_name", "profile", "pix_fmt", "width", "height", "time_base", "extradata_hash"]
+
+# Seconds added to a keyframe time when seeking (so rounding never lands on the previous keyframe)
+SEEK_MARGIN = 0.001
+
+
+def get_ffprobe_path():
+    """Get the path of the ffprobe program (used to find keyframes), or None if not installed"""
+    return shutil.which("ffprobe")
+
+
+def run_ffprobe(arguments):
+    """Run ffprobe (and return its output, or None if it failed)"""
+    result = subprocess.run([get_ffprobe_path(), "-v", "error"] + arguments,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        log.warning("ffprobe failed: %s" % result.stderr.strip())
+        return None
+    return result.stdout
+
+
+def probe_video_stream(file_path):
+    """Get the properties of the first video stream of a file (or None)"""
+    output = run_ffprobe(["-select_streams", "v:0", "-show_data_hash", "CRC32", "-show_entries",
+                          "stream=%s:format=start_time" % ",".join(MATCHING_STREAM_KEYS), "-of", "json", file_path])
+    if not output:
+        return None
+    probe = json.loads(output)
+    if not probe.get("streams"):
+        return None
+    stream = probe["streams"][0]
+    stream["start_time"] = float(probe.get("format", {}).get("start_time") or 0.0)
+    return stream
+
+
+def get_keyframe_times(file_path, start_time=0.0):
+    """Get the time (in seconds from the start of the file) of every keyframe of the first video stream"""
+    output = run_ffprobe(["-select_streams", "v:0", "-show_entries", "packet=pts_time,flags",
+                          "-of", "csv=p=0", file_path])
+    times = []
+    for line in (output or "").splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags and pts_time not in ["", "N/A"]:
+            times.append(float(pts_time) - start_time)
+    return sorted(times)
+
+
+def is_identity_keyframe(keyframe, value):
+    """Check if a keyframe always has a value (or has no points, and uses the default)"""
+    return all(abs(point.get("co", {}).get("Y", value) - value) < 1e-6 for point in keyframe.get("Points", []))
+
+
+def is_keyframe(value):
+    """Check if a clip property is a keyframe"""
+    return isinstance(value, dict) and "Points" in value
+
+
+def is_video_hidden(clip, always=False):
+    """Check if the video of a clip is hidden (at any time, or always) by its source or its has_video keyframe"""
+    if not clip.get("reader", {}).get("has_video"):
+        return True
+    # has_video is 0 (hidden), 1 (shown) or -1 (shown if the source has video)
+    hidden = [round(point.get("co", {}).get("Y", -1)) == 0 for point in clip.get("has_video", {}).get("Points", [])]
+    return bool(hidden) and (all(hidden) if always else any(hidden))
+
+
+def get_clip_frames(clip, fps):
+    """Get the first and last timeline frames of a clip"""
+    first_frame = round(clip.get("position", 0.0) * fps) + 1
+    last_frame = round((clip.get("position", 0.0) + clip.get("end", 0.0) - clip.get("start", 0.0)) * fps)
+    return first_frame, last_frame
+
+
+def is_passthrough_clip(clip, video_settings):
+    """Check if a clip shows the frames of its source file unchanged (and the source matches the export)"""
+    reader = clip.get("reader", {})
+    if reader.get("type") != "FFmpegReader" or not reader.get("has_video") or reader.get("interlaced_frame"):
+        return False
+    if reader.get("width") != video_settings.get("width") or reader.get("height") != video_settings.get("height"):
+        return False
+    for key in ["fps", "pixel_ratio"]:
+        source = reader.get(key, {})
+        export = video_settings.get(key, {})
+        if source.get("num", 0) * export.get("den", 1) != export.get("num", 0) * source.get("den", 1):
+            return False
+    if ENCODER_CODECS.get(video_settings.get("vcodec")) != reader.get("vcodec"):
+        return False
+    if clip.get("effects") or clip.get("waveform") or clip.get("parentObjectId") or is_video_hidden(clip):
+        return False
+    if any(clip.get(key, value) != value for key, value in IDENTITY_PROPERTIES.items()):
+        return False
+
+    # Every keyframe must be known (and at its identity value)
+    for key, keyframe in clip.items():
+        if not is_keyframe(keyframe) or key in IGNORED_KEYFRAMES or key == "has_video":
+            continue
+        if key == "time":
+            # Any time mapping (speed, reverse or freeze) changes frames
+            if keyframe.get("Points"):
+                return False
+        elif key not in IDENTITY_KEYFRAMES or not is_identity_keyframe(keyframe, IDENTITY_KEYFRAMES[key]):
+            return False
+    return True
+
+
+def get_decode_errors(file_path):
+    """Decode the video of a file, and get the decoding errors (or an empty string)"""
+    result = subprocess.run([get_ffmpeg_path(), "-v", "error", "-i", file_path, "-map", "0:v:0", "-f", "null", "-"],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0 and not result.stderr.strip():
+        return "ffmpeg exit code %s" % result.returncode
+    return result.stderr.strip()
+
+
+def subtract_ranges(first, last, ranges):
+    """Get the parts of a range of frames which are not in any of ranges"""
+    parts = [(first, last)]
+    for other_first, other_last in ranges:
+        remaining = []
+        for part_first, part_last in parts:
+            if other_last < part_first or other_first > part_last:
+                remaining.append((part_first, part_last))
+                continue
+            if part_first < other_first:
+                remaining.append((part_first, other_first - 1))
+            if part_last > other_last:
+                remaining.append((other_last + 1, part_last))
+        parts = remaining
+    return parts
+
+
+def find_passthrough_ranges(project_data, video_settings):
+    """Get the (first frame, last frame, clip) of each pass-through range of the export"""
+    if project_data.get("effects"):
+        # Timeline effects change every frame
+        return []
+
+    fps = float(video_settings["fps"]["num"]) / float(video_settings["fps"]["den"])
+    start_frame = video_settings.get("start_frame")
+    end_frame = video_settings.get("end_frame")
+
+    video_clips = [clip for clip in project_data.get("clips", []) if not is_video_hidden(clip, always=True)]
+    transition_ranges = [
+        (round(transition.get("position", 0.0) * fps) + 1,
+         round((transition.get("position", 0.0) + transition.get("end", 0.0) - transition.get("start", 0.0)) * fps))
+        for transition in project_data.get("transitions", [])]
+
+    passthrough = []
+    for clip in video_clips:
+        if not is_passthrough_clip(clip, video_settings):
+            continue
+        first, last = get_clip_frames(clip, fps)
+        first, last = max(first, start_frame), min(last, end_frame)
+        if first > last:
+            continue
+        others = [get_clip_frames(other, fps) for other in video_clips if other is not clip]
+        for part_first, part_last in subtract_ranges(first, last, others + transition_ranges):
+            passthrough.append((part_first, part_last, clip))
+    return sorted(passthrough, key=lambda item: item[0])
+
+
+class SmartExportRenderer(SegmentedExportRenderer):
+    """ Writes a range of frames from project data to a file, copying the encoded video of pass-through
+    ranges from their source files, and rendering the rest in segments (see SegmentedExportRenderer). """
+
+    def __init__(self, project_data, export_file_path, video_settings, audio_settings, timeline_info=None,
+                 processes=1, pipeline_depth=0):
+        super().__init__(project_data, export_file_path, video_settings, audio_settings, timeline_info,
+                         max(1, processes), pipeline_depth)
+
+        # Properties of the video stream written by the encoder (see probe_encoder)
+        self.encoder_stream = None
+
+        # Copied ranges (see plan_segments)
+        self.copies = []
+
+    def probe_encoder(self):
+        """Encode one frame with the export settings, and get the properties of the encoded stream"""
+        video_settings = dict(self.video_settings, end_frame=self.video_settings.get("start_frame"))
+        audio_settings = dict(self.audio_settings, has_audio=False)
+        folder = tempfile.mkdtemp(prefix="openshot-probe-")
+        timeline, export_cache_object = create_export_timeline(
+            self.project_data, video_settings, audio_settings, self.timeline_info)
+        try:
+            probe_path = os.path.join(folder, "probe%s" % os.path.splitext(self.export_file_path)[1])
+            w = create_writer(probe_path, video_settings, audio_settings)
+            w.WriteFrame(timeline.GetFrame(video_settings.get("start_frame")))
+            w.Close()
+            return probe_video_stream(probe_path)
+        finally:
+            timeline.Close()
+            timeline.ClearAllCache()
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def copy_range(self, first, last, clip, fps):
+        """Get the (first frame, last frame, copy) of the part of a pass-through range which starts and
+        ends on a keyframe of the source file (or None, if there are not 2 keyframes in the range)"""
+        source_path = clip["reader"]["path"]
+        stream = probe_video_stream(source_path)
+        if not stream or self.encoder_stream is None:
+            return None
+        if any(stream.get(key) != self.encoder_stream.get(key) for key in MATCHING_STREAM_KEYS):
+            log.info("Rendering clip %s (source stream differs from the export: %s)" % (
+                clip.get("id"), {key: stream.get(key) for key in MATCHING_STREAM_KEYS}))
+            return None
+
+        # Timeline frame of each source keyframe (and the end of the source, which also ends a copy)
+        offset = clip.get("position", 0.0) - clip.get("start", 0.0)
+        boundaries = {round((keyframe_time + offset) * fps) + 1: keyframe_time
+                      for keyframe_time in get_keyframe_times(source_path, stream["start_time"])}
+        source_duration = clip["reader"].get("duration", 0.0)
+        if clip.get("end", 0.0) >= source_duration - 0.5 / fps:
+            boundaries.setdefault(round((source_duration + offset) * fps) + 1, None)
+
+        frames = sorted(frame for frame in boundaries if first <= frame <= last + 1)
+        if len(frames) < 2 or boundaries[frames[0]] is None:
+            return None
+        return frames[0], frames[-1] - 1, {
+            "path": source_path,
+            "start": boundaries[frames[0]],
+            "frames": frames[-1] - frames[0],
+        }
+
+    def plan_segments(self, start_frame, end_frame, gop_size):
+        """Get the segments to copy (pass-through ranges, from keyframe to keyframe) and render (the rest)"""
+        fps = float(self.video_settings["fps"]["num"]) / float(self.video_settings["fps"]["den"])
+        passthrough = find_passthrough_ranges(self.project_data, self.video_settings)
+        copies = []
+        if passthrough:
+            try:
+                self.encoder_stream = self.probe_encoder()
+            except Exception as ex:
+                log.warning("Failed to probe the export encoder (rendering all frames): %s" % ex)
+            for first, last, clip in passthrough:
+                copy_range = self.copy_range(first, last, clip, fps)
+                if copy_range:
+                    copies.append(copy_range)
+
+        # Render the frames between copied ranges
+        segments = []
+        next_frame = start_frame
+        for first, last, copy in copies + [(end_frame + 1, end_frame, None)]:
+            if first > next_frame:
+                segments.extend((segment_first, segment_last, None) for segment_first, segment_last in split_segments(
+                    next_frame, first - 1, gop_size, self.processes * SEGMENTS_PER_PROCESS))
+            if copy:
+                segments.append((first, last, copy))
+            next_frame = last + 1
+
+        self.copies = copies
+        copied_frames = sum(last - first + 1 for first, last, copy in copies)
+        log.info("Smart render: copying %s of %s frames (%s ranges)" % (
+            copied_frames, end_frame - start_frame + 1, len(copies)))
+        return segments
+
+    def copy_segment(self, copy, segment_path):
+        """Copy the encoded video of a pass-through range from its source file"""
+        command = [get_ffmpeg_path(), "-y", "-v", "error", "-ss", "%.6f" % (copy["start"] + SEEK_MARGIN),
+                   "-i", copy["path"], "-map", "0:v:0", "-frames:v", str(copy["frames"]), "-c", "copy", "-an",
+                   "-f", self.video_settings.get("vformat"), segment_path]
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if result.returncode != 0:
+            raise RuntimeError("Failed to copy video from %s: %s" % (copy["path"], result.stderr.strip()))
+
+    def join_segments(self, folder, segment_paths, audio_path):
+        """Join the copied and rendered segments, and check the joined video decodes without errors"""
+        super().join_segments(folder, segment_paths, audio_path)
+        if not self.copies:
+            return
+        errors = get_decode_errors(self.export_file_path)
+        if errors:
+            raise RuntimeError("The joined video does not decode (export again without smart render): %s" % (
+                errors.splitlines()[0]))
@@ -27,15 +27,27 @@
 
 import os
 import re
+import sys
+import json
+import select
 import openshot
 import socket
 import time
-from threading import Thread
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
+from itertools import count
+from queue import PriorityQueue, Empty
+from threading import Thread, Event, Lock, get_ident
+from urllib.parse import urlparse, parse_qs
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QImage, QImageWriter, QPainter, QColor, QTransform
 from classes import info
 from classes.query import File
 from classes.logger import log
+from classes.thumbnail_pack import ThumbnailPackStore, REGEX_PACKABLE
+from classes.thumbnail_shared import SharedThumbnailCache, media_fingerprint
 from http.server import BaseHTTPRequestHandler, HTTPServer
-from socketserver import ThreadingMixIn
 
 # Regex for parsing URLs: (examples)
 #  http://127.0.0.1:33723/thumbnails/9ATJTBQ71V/1/path/no-cache/
@@ -45,18 +57,41 @@ from socketserver import ThreadingMixIn
 #  http://127.0.0.1:33723/thumbnails/9ATJTBQ71V/1
 REGEX_THUMBNAIL_URL = re.compile(r"/thumbnails/(?P<file_id>.+?)/(?P<file_frame>\d+)/*(?P<only_path>path)?/*(?P<no_cache>no-cache)?")
 
+# Regex for parsing filmstrip URLs: (examples)
+#  http://127.0.0.1:33723/thumbnails/9ATJTBQ71V/strip/1-300/8/
+#  http://127.0.0.1:33723/thumbnails/9ATJTBQ71V/strip/1-300/8/json/
+REGEX_STRIP_URL = re.compile(r"/thumbnails/(?P<file_id>[^/]+)/strip/(?P<start>\d+)-(?P<end>\d+)/(?P<count>\d+)/*(?P<only_json>json)?")
 
-def GenerateThumbnail(file_path, thumb_path, thumbnail_frame, width, height, mask, overlay):
-    """Create thumbnail image, and check for rotate metadata (if any)"""
+# Maximum number of frames in a single filmstrip
+MAX_STRIP_FRAMES = 64
+
+# Queue priorities for thumbnail generation (lower values are generated first)
+PRIORITY_VISIBLE = 0
+PRIORITY_BACKGROUND = 10
+
+# Number of seconds a client may cache a thumbnail without checking for a new version
+THUMBNAIL_MAX_AGE = 3600
+
+# Connections handled at once by the HTTP thumbnail server (other connections wait their turn), and the
+# seconds an idle keep-alive connection is kept open (so it does not hold a thread for long)
+HTTP_SERVER_THREADS = 8
+HTTP_KEEP_ALIVE_TIMEOUT = 5
 
-    # Create a clip object and get the reader
-    clip = openshot.Clip(file_path)
-    reader = clip.Reader()
+# Size of a 1x thumbnail (larger scales are requested with ?scale=N, up to MAX_THUMBNAIL_SCALE)
+THUMBNAIL_WIDTH = 98
+THUMBNAIL_HEIGHT = 64
+MAX_THUMBNAIL_SCALE = 2
 
-    # Open reader
-    reader.Open()
+# Image formats which can be requested with ?format=NAME (if supported by Qt), and their content types
+THUMBNAIL_FORMATS = {
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "webp": "image/webp",
+}
 
-    # Get the 'rotate' metadata (if any)
+
+def GetRotation(reader, file_path):
+    """Get the 'rotate' metadata of an open reader (if any)"""
     rotate = 0.0
     try:
         if reader.info.metadata.count("rotate"):
@@ -66,26 +101,916 @@ def GenerateThumbnail(file_path, thumb_path, thumbnail_frame, width, height, mas
         log.warning("Could not parse rotation value {}: {}".format(rotate_data, ex))
     except Exception:
         log.warning("Error reading rotation metadata from {}".format(file_path), exc_info=1)
+    return rotate
+
+
+def GenerateThumbnail(file_path, thumb_path, thumbnail_frame, width, height, mask, overlay, reader_pool=None, stats=None,
+                      image_format="png"):
+    """Create thumbnail image, and check for rotate metadata (if any)"""
 
     # Create thumbnail folder (if needed)
     parent_path = os.path.dirname(thumb_path)
-    if not os.path.exists(parent_path):
-        os.mkdir(parent_path)
+    os.makedirs(parent_path, exist_ok=True)
+
+    # Save to a temporary file, and rename it when complete (so readers never see a partial image)
+    temp_path = "%s.%s.tmp" % (thumb_path, get_ident())
+    try:
+        if reader_pool:
+            # Borrow an open reader for this file (from the pool)
+            start_time = time.time()
+            pooled_reader = reader_pool.acquire(file_path)
+            try:
+                frame = pooled_reader.reader.GetFrame(thumbnail_frame)
+                decode_time = time.time()
+                frame.Thumbnail(
+                    temp_path, width, height, mask, overlay, "#000", False, image_format, 85, pooled_reader.rotate)
+                if stats:
+                    stats.add_generation(pooled_reader.codec, decode_time - start_time, time.time() - decode_time)
+            finally:
+                reader_pool.release(pooled_reader)
+        else:
+            # Create a clip object and get the reader
+            clip = openshot.Clip(file_path)
+            reader = clip.Reader()
+
+            # Open reader
+            reader.Open()
+
+            # Get the 'rotate' metadata (if any)
+            rotate = GetRotation(reader, file_path)
+
+            # Save thumbnail image and close readers
+            reader.GetFrame(thumbnail_frame).Thumbnail(
+                temp_path, width, height, mask, overlay, "#000", False, image_format, 85, rotate)
+            reader.Close()
+            clip.Close()
+
+        os.replace(temp_path, thumb_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def GetStripFrames(start_frame, end_frame, frame_count):
+    """Get a list of evenly spaced frame numbers from start_frame to end_frame (inclusive)"""
+    if frame_count <= 1 or end_frame <= start_frame:
+        return [start_frame] * max(1, frame_count)
+    step = (end_frame - start_frame) / (frame_count - 1)
+    return [round(start_frame + index * step) for index in range(frame_count)]
+
+
+def GetFrameImage(frame, width, height, rotate):
+    """Get the image of a libopenshot frame, rotated and scaled to fit width x height
+    (or None if the libopenshot bindings don't return frame images as a QImage)"""
+    image = frame.GetImage()
+    if not isinstance(image, QImage):
+        return None
+    if rotate:
+        image = image.transformed(QTransform().rotate(rotate), Qt.SmoothTransformation)
+    return image.scaled(width, height, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+
+def GenerateFilmstrip(file_path, strip_path, json_path, frames, width, height, reader_pool, stats=None,
+                      image_format="png"):
+    """Create a sprite image of several frames (side by side, decoded in one pass),
+    and a JSON file with the offset of each frame in the sprite"""
+
+    # Create thumbnail folder (if needed)
+    parent_path = os.path.dirname(strip_path)
+    os.makedirs(parent_path, exist_ok=True)
+
+    sprite = QImage(width * len(frames), height, QImage.Format_RGB32)
+    sprite.fill(QColor("#000"))
+    offsets = []
+
+    temp_path = "%s.%s.tmp" % (strip_path, get_ident())
+    try:
+        encode_start = time.time()
+        pooled_reader = reader_pool.acquire(file_path)
+        decode_seconds = time.time() - encode_start
+        painter = QPainter(sprite)
+        try:
+            for index, frame_number in enumerate(frames):
+                decode_start = time.time()
+                frame = pooled_reader.reader.GetFrame(frame_number)
+                decode_seconds += time.time() - decode_start
+                image = GetFrameImage(frame, width, height, pooled_reader.rotate)
+                if image is None:
+                    # Older libopenshot bindings (use an uncompressed thumbnail, only to draw it into the sprite)
+                    frame.Thumbnail(
+                        temp_path, width, height, "", "", "#000", False, "bmp", 100, pooled_reader.rotate)
+                    image = QImage(temp_path)
+                # Centered in its tile (like Frame.Thumbnail())
+                painter.drawImage(
+                    index * width + (width - image.width()) // 2, (height - image.height()) // 2, image)
+                offsets.append({"frame": frame_number, "x": index * width, "y": 0})
+        finally:
+            painter.end()
+            reader_pool.release(pooled_reader)
+
+        # Save offsets, and then the sprite (which marks the filmstrip as complete)
+        with open(temp_path, "w") as json_file:
+            json.dump({"width": width, "height": height, "frames": offsets}, json_file)
+        os.replace(temp_path, json_path)
+        if not sprite.save(temp_path, image_format, 85):
+            raise OSError("Failed to save filmstrip image: %s" % strip_path)
+        os.replace(temp_path, strip_path)
+        if stats:
+            stats.add_generation(pooled_reader.codec, decode_seconds, time.time() - encode_start - decode_seconds)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class PooledReader:
+    """ An open libopenshot reader (and its rotation), borrowed from a ReaderPool """
+
+    def __init__(self, file_path, generation):
+        self.file_path = file_path
+        self.generation = generation
+        self.last_used = time.time()
+
+        # Create a clip object and open the reader
+        self.clip = openshot.Clip(file_path)
+        self.reader = self.clip.Reader()
+        self.reader.Open()
+        self.rotate = GetRotation(self.reader, file_path)
+        self.codec = self.reader.info.vcodec or "unknown"
+
+    def close(self):
+        try:
+            self.reader.Close()
+            self.clip.Close()
+        except Exception:
+            log.warning("Error closing pooled reader for {}".format(self.file_path), exc_info=1)
+
+
+class ReaderPool:
+    """ LRU pool of open readers (keyed by file path), so repeated thumbnails of the same
+    file reuse a warm decoder. Each reader is only used by one thread at a time. """
+
+    def __init__(self, max_open=8, idle_timeout=30.0):
+        self.max_open = max_open
+        self.idle_timeout = idle_timeout
+        self.lock = Lock()
+        self.idle = []  # Idle readers (least recently used first)
+        self.open_count = 0
+        self.generations = {}  # Bumped by discard(), so borrowed readers are closed on release
+
+    def acquire(self, file_path):
+        """Borrow an open reader for a file (re-using an idle one, if possible)"""
+        with self.lock:
+            for index in range(len(self.idle) - 1, -1, -1):
+                if self.idle[index].file_path == file_path:
+                    return self.idle.pop(index)
+
+            # Make room for a new reader (by closing the least recently used idle readers)
+            self.open_count += 1
+            expired = []
+            while self.open_count > self.max_open and self.idle:
+                expired.append(self.idle.pop(0))
+                self.open_count -= 1
+            generation = self.generations.get(file_path, 0)
+
+        self.close_readers(expired)
+        try:
+            return PooledReader(file_path, generation)
+        except Exception:
+            with self.lock:
+                self.open_count -= 1
+            raise
+
+    def release(self, pooled_reader):
+        """Return a borrowed reader to the pool"""
+        with self.lock:
+            if pooled_reader.generation == self.generations.get(pooled_reader.file_path, 0):
+                pooled_reader.last_used = time.time()
+                self.idle.append(pooled_reader)
+                return
+            self.open_count -= 1
+
+        # File was discarded while borrowed
+        pooled_reader.close()
+
+    def discard(self, file_path):
+        """Close all readers for a file (i.e. the file has changed)"""
+        with self.lock:
+            self.generations[file_path] = self.generations.get(file_path, 0) + 1
+            expired = [r for r in self.idle if r.file_path == file_path]
+            self.idle = [r for r in self.idle if r.file_path != file_path]
+            self.open_count -= len(expired)
+        self.close_readers(expired)
+
+    def close_expired(self):
+        """Close all readers which have been idle longer than the idle timeout"""
+        oldest = time.time() - self.idle_timeout
+        with self.lock:
+            expired = [r for r in self.idle if r.last_used < oldest]
+            self.idle = [r for r in self.idle if r.last_used >= oldest]
+            self.open_count -= len(expired)
+        self.close_readers(expired)
+
+    def close_all(self):
+        """Close all idle readers"""
+        with self.lock:
+            expired = self.idle
+            self.idle = []
+            self.open_count -= len(expired)
+        self.close_readers(expired)
+
+    def close_readers(self, readers):
+        for pooled_reader in readers:
+            log.debug("Closing pooled reader for %s", pooled_reader.file_path)
+            pooled_reader.close()
+
+
+def stat_thumbnail(thumb_path):
+    """Get the os.stat() of a thumbnail file, or None if missing"""
+    try:
+        return os.stat(thumb_path)
+    except OSError:
+        return None
+
+
+class ThumbnailByteCache:
+    """ LRU cache of encoded thumbnail images (keyed by path), limited to a total number of bytes.
+    Entries are only returned while the file's modified time and size still match. """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, thumb_path, thumb_stat):
+        with self.lock:
+            entry = self.entries.get(thumb_path)
+            if not entry:
+                return None
+            if entry[0] != (thumb_stat.st_mtime_ns, thumb_stat.st_size):
+                # Thumbnail has changed on disk
+                self.remove(thumb_path)
+                return None
+            self.entries.move_to_end(thumb_path)
+            return entry[1]
+
+    def put(self, thumb_path, thumb_stat, content):
+        if len(content) > self.max_bytes:
+            return
+        with self.lock:
+            self.remove(thumb_path)
+            self.entries[thumb_path] = ((thumb_stat.st_mtime_ns, thumb_stat.st_size), content)
+            self.total_bytes += len(content)
+
+            # Remove least recently used thumbnails
+            while self.total_bytes > self.max_bytes:
+                _, (_, old_content) = self.entries.popitem(last=False)
+                self.total_bytes -= len(old_content)
+
+    def remove(self, thumb_path):
+        entry = self.entries.pop(thumb_path, None)
+        if entry:
+            self.total_bytes -= len(entry[1])
+
+
+class ThumbnailStats:
+    """ Counters and recent latencies (in seconds) of the thumbnail service, for sizing the worker pool """
+
+    def __init__(self, max_samples=1000):
+        self.lock = Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.samples = {}
+        self.max_samples = max_samples
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.max_samples)
+            self.samples[name].append(seconds)
+
+    def add_generation(self, codec, decode_seconds, encode_seconds):
+        """Record the decode (and per codec) and encode time of a generated thumbnail"""
+        self.count("generated")
+        self.add_time("decode", decode_seconds)
+        self.add_time("decode.%s" % codec, decode_seconds)
+        self.add_time("encode", encode_seconds)
+
+    @staticmethod
+    def percentiles(samples):
+        ordered = sorted(samples)
+        last = len(ordered) - 1
+        return {
+            "count": len(ordered),
+            "p50": round(ordered[round(last * 0.50)] * 1000.0, 2),
+            "p95": round(ordered[round(last * 0.95)] * 1000.0, 2),
+            "p99": round(ordered[round(last * 0.99)] * 1000.0, 2),
+        }
+
+    def snapshot(self):
+        """Get all counters, and the p50/p95/p99 latency (in milliseconds) of each timing"""
+        with self.lock:
+            counters = dict(self.counters)
+            samples = {name: list(values) for name, values in self.samples.items() if values}
+        return {
+            "uptime": round(time.time() - self.started, 1),
+            "counters": counters,
+            "latency_ms": {name: self.percentiles(values) for name, values in sorted(samples.items())},
+        }
+
+
+class ThumbnailJob:
+    """ A queued call (usually GenerateThumbnail), which can be waited on or cancelled """
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+        self.error = None
+        self.cancelled = False
+        self.running = False
+        self.priority = None
+        self.waiters = 0
+        self.done = Event()
+        self.callbacks = []
+        self.callbacks_lock = Lock()
+
+    def run(self):
+        """Run the job (unless it was cancelled while queued)"""
+        with self.callbacks_lock:
+            if self.running:
+                # Already run (this job was queued again with a higher priority)
+                return
+            self.running = True
+        try:
+            if not self.cancelled:
+                self.func(*self.args)
+        except Exception as ex:
+            self.error = ex
+        finally:
+            with self.callbacks_lock:
+                self.done.set()
+                callbacks, self.callbacks = self.callbacks, []
+            for callback in callbacks:
+                self.call(callback)
+
+    def add_done_callback(self, callback):
+        """Call a function (on the worker thread) when the job is done, or now if already done"""
+        with self.callbacks_lock:
+            if not self.done.is_set():
+                self.callbacks.append(callback)
+                return
+        self.call(callback)
+
+    def call(self, callback):
+        try:
+            callback()
+        except Exception:
+            log.warning("Error in thumbnail job callback", exc_info=1)
+
+    def cancel(self):
+        """Skip this job (if a worker has not started it yet)"""
+        self.cancelled = True
+
+
+class ThumbnailWorkerPool:
+    """ Fixed-size pool of worker threads, which run ThumbnailJobs in priority order
+    (lowest priority value first, and oldest first within the same priority). """
+
+    def __init__(self, size=None, idle_callback=None, idle_interval=5.0):
+        self.size = size or os.cpu_count() or 2
+        self.idle_callback = idle_callback
+        self.idle_interval = idle_interval
+        self.queue = PriorityQueue()
+        self.counter = count()
+        self.threads = []
+
+    def start(self):
+        for _ in range(self.size):
+            thread = Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        # Wake each worker with an empty job (sorted after any queued jobs)
+        for _ in self.threads:
+            self.queue.put((sys.maxsize, next(self.counter), None))
+        self.threads = []
+
+    def submit(self, priority, func, *args):
+        """Queue a call, and return the ThumbnailJob to wait on"""
+        job = ThumbnailJob(func, *args)
+        self.requeue(priority, job)
+        return job
+
+    def requeue(self, priority, job):
+        """Queue a job (again) with a new priority (the first worker to get it runs it)"""
+        job.priority = priority
+        self.queue.put((priority, next(self.counter), job))
+
+    def work(self):
+        while True:
+            try:
+                _, _, job = self.queue.get(timeout=self.idle_interval)
+            except Empty:
+                # Nothing to do, allow some housekeeping
+                if self.idle_callback:
+                    self.idle_callback()
+                continue
+            if job is None:
+                break
+            job.run()
+
+
+class ThumbnailRequest:
+    """ A parsed thumbnail URL: the file to send back (or its path), and how to generate it if missing """
+
+    def __init__(self, key, priority, output_path, content_type, func, *args):
+        self.key = key
+        self.priority = priority
+        self.output_path = output_path
+        self.content_type = content_type
+        self.only_path = False
+        self.no_cache = False
+        self.thumb_job = None
+        self.store = None
+        self.shared_cache = None
+        self.started = time.time()
+        self.func = func
+        self.args = args
+
+        # Name of the output in the pack store, and every (path, pack name, shared cache name) written by func
+        self.pack_name = os.path.basename(output_path)
+        self.generated_files = [(output_path, self.pack_name, None)]
+
+    def generate(self):
+        """Create the requested files (returns True if restored from the shared cache)"""
+        restored = False
+        shared_names = [shared_name for _, _, shared_name in self.generated_files if shared_name]
+        if not self.shared_cache or len(shared_names) != len(self.generated_files):
+            self.func(*self.args)
+        elif self.no_cache or not all(
+                self.shared_cache.restore(shared_name, path) for path, _, shared_name in self.generated_files):
+            # Not cached by any project yet (or the thumbnail has changed)
+            self.func(*self.args)
+            for path, _, shared_name in self.generated_files:
+                self.shared_cache.put(shared_name, path)
+        else:
+            restored = True
+
+        if self.store and not self.only_path:
+            # Move the new files into the pack store (file icons stay loose)
+            for path, name, _ in self.generated_files:
+                if REGEX_PACKABLE.match(name):
+                    self.store.add_file(name, path)
+        return restored
+
+
+class ThumbnailService:
+    """ This class locates, generates and caches thumbnails and filmstrips, and is shared by the
+    timeline's custom URL scheme handler, the HTTP thumbnail server and the files model. """
+
+    def __init__(self, use_pack_store=False, shared_cache_bytes=0):
+        self.reader_pool = ReaderPool()
+        self.byte_cache = ThumbnailByteCache()
+        self.thumb_paths = {}
+        self.in_flight = {}
+        self.in_flight_lock = Lock()
+        self.stats = ThumbnailStats()
+
+        # Requested formats are only used if Qt can write them (i.e. WebP needs the imageformats plugin)
+        supported = [bytes(name).decode("utf-8").lower() for name in QImageWriter.supportedImageFormats()]
+        self.image_formats = [name for name in THUMBNAIL_FORMATS if name in supported] or ["png"]
+        self.worker_pool = ThumbnailWorkerPool(idle_callback=self.reader_pool.close_expired)
+        self.worker_pool.start()
+
+        # Optional pack store (one per thumbnail folder, opened on first use)
+        self.use_pack_store = use_pack_store
+        self.store = None
+        self.store_lock = Lock()
+
+        # Optional cache of thumbnails shared by all projects (keyed by media fingerprint)
+        self.shared_cache = None
+        if shared_cache_bytes > 0:
+            self.shared_cache = SharedThumbnailCache(info.THUMBNAIL_CACHE_PATH, shared_cache_bytes)
+
+    def close(self):
+        log.info("Thumbnail service stats: %s", json.dumps(self.get_stats()))
+        self.worker_pool.stop()
+        self.reader_pool.close_all()
+        self.close_store()
+
+    def get_stats(self):
+        """Get the service counters, latencies and current queue/pool sizes (for the /stats endpoint)"""
+        stats = self.stats.snapshot()
+        with self.in_flight_lock:
+            in_flight = len(self.in_flight)
+        stats.update({
+            "workers": self.worker_pool.size,
+            "queue_depth": self.worker_pool.queue.qsize(),
+            "in_flight": in_flight,
+            "open_readers": self.reader_pool.open_count,
+            "memory_cache_bytes": self.byte_cache.total_bytes,
+            "shared_cache_bytes": self.shared_cache.total_bytes if self.shared_cache else 0,
+        })
+        return stats
+
+    def is_stats_path(self, url_path):
+        return url_path.rstrip("/") == "/stats"
+
+    def finish(self, request, content_length):
+        """Record a completed request"""
+        self.stats.count("requests")
+        self.stats.count("bytes_served", content_length)
+        self.stats.add_time("request", time.time() - request.started)
+
+    def get_store(self):
+        """Get the pack store for the current thumbnail folder (or None if disabled)"""
+        if not self.use_pack_store:
+            return None
+
+        with self.store_lock:
+            if self.store and self.store.folder != info.THUMBNAIL_PATH:
+                self.store.close()
+                self.store = None
+            if not self.store:
+                try:
+                    self.store = ThumbnailPackStore(info.THUMBNAIL_PATH)
+                except Exception as ex:
+                    log.warning("Failed to open thumbnail pack store in %s: %s", info.THUMBNAIL_PATH, ex)
+                    return None
+
+                # Move any loose thumbnails into the new store (in the background)
+                self.worker_pool.submit(PRIORITY_BACKGROUND, self.migrate_store, self.store)
+            return self.store
+
+    def close_store(self):
+        """Close the pack store (i.e. before the thumbnail folder is deleted)"""
+        with self.store_lock:
+            if self.store:
+                self.store.close()
+                self.store = None
+
+    def migrate_store(self, store):
+        try:
+            store.migrate()
+        except Exception as ex:
+            log.warning("Failed to migrate thumbnails to pack store: %s", ex)
+
+        # Loose paths may have moved into the store
+        self.thumb_paths.clear()
+
+    def parse_request(self, url_path, url_query=""):
+        """Parse a thumbnail URL path and query (or return None if invalid)"""
+
+        query = parse_qs(url_query)
+
+        # Get queue priority (optional ?priority=N query, lower values are generated first)
+        try:
+            priority = int(query.get("priority", [PRIORITY_VISIBLE])[0])
+        except ValueError:
+            priority = PRIORITY_VISIBLE
+
+        # Get image variant (optional ?format=NAME&scale=N query, PNG at 1x by default)
+        variant = self.get_variant(query)
+
+        # Filmstrip requests (checked first, since the thumbnail regex would also match them)
+        strip_output = REGEX_STRIP_URL.match(url_path)
+        if strip_output:
+            return self.filmstrip_request(strip_output, priority, variant)
+
+        url_output = REGEX_THUMBNAIL_URL.match(url_path)
+        if url_output and len(url_output.groups()) == 4:
+            # Path is expected to have 3 matched components (third is optional though)
+            #   /thumbnails/FILE-ID/FRAME-NUMBER/   or
+            #   /thumbnails/FILE-ID/FRAME-NUMBER/path/  or
+            #   /thumbnails/FILE-ID/FRAME-NUMBER/no-cache/  or
+            #   /thumbnails/FILE-ID/FRAME-NUMBER/path/no-cache/
+            return self.thumbnail_request(url_output, priority, variant)
+
+    def get_variant(self, query):
+        """Get the (format, width, height) of a thumbnail from the query (falling back to PNG at 1x)"""
+        image_format = query.get("format", ["png"])[0].lower().replace("jpeg", "jpg")
+        if image_format not in self.image_formats:
+            image_format = "png"
+        try:
+            scale = min(max(1, int(query.get("scale", [1])[0])), MAX_THUMBNAIL_SCALE)
+        except ValueError:
+            scale = 1
+        return image_format, THUMBNAIL_WIDTH * scale, THUMBNAIL_HEIGHT * scale
+
+    @staticmethod
+    def variant_suffix(variant):
+        """Filename suffix of a thumbnail variant (empty for 1x PNG, which uses the legacy filenames)"""
+        image_format, width, height = variant
+        if (image_format, width, height) == ("png", THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT):
+            return ""
+        return "-%sx%s" % (width, height)
+
+    def get_file(self, file_id):
+        """Look up a File object by ID (or return None)"""
+        try:
+            # Look up file data
+            file = File.get(id=file_id)
+
+            # Ensure file location is an absolute path
+            file.absolute_path()
+            return file
+        except AttributeError:
+            # Couldn't match file ID
+            log.debug("No ID match for thumbnail: %s", file_id)
+
+    def thumbnail_request(self, url_output, priority, variant):
+        """Single frame thumbnail (or its path)"""
+        mask_path = os.path.join(info.IMAGES_PATH, "mask.png")
+
+        # Get URL parts
+        file_id = url_output.group('file_id')
+        file_frame = int(url_output.group('file_frame'))
+
+        log.debug(
+            "Processing thumbnail request for %s frame %d",
+            file_id, file_frame)
+
+        file = self.get_file(file_id)
+        if not file:
+            return None
+        file_path = file.absolute_path()
+
+        # Determine if video overlay should be applied to thumbnail
+        overlay_path = ""
+        if file.data["media_type"] == "video":
+            overlay_path = os.path.join(info.IMAGES_PATH, "overlay.png")
+
+        # Locate thumbnail (legacy filenames are only probed once per file and frame)
+        image_format, width, height = variant
+        suffix = self.variant_suffix(variant)
+        if suffix:
+            thumb_path = os.path.join(info.THUMBNAIL_PATH, "%s-%s%s.%s" % (file_id, file_frame, suffix, image_format))
+        else:
+            thumb_path = self.resolve_thumb_path(file_id, file_frame)
+
+        request = ThumbnailRequest(
+            (file_id, file_frame, image_format, width, height),
+            priority,
+            thumb_path,
+            THUMBNAIL_FORMATS[image_format],
+            GenerateThumbnail,
+            file_path,
+            thumb_path,
+            file_frame,
+            width, height,
+            mask_path,
+            overlay_path,
+            self.reader_pool,
+            self.stats,
+            image_format)
+        request.only_path = bool(url_output.group('only_path'))
+        request.no_cache = bool(url_output.group('no_cache'))
+        request.store = self.get_store()
+        if file_frame != 1 and not suffix:
+            # Packed with the flat filename (even if generated in an older <file_id>/ folder)
+            request.pack_name = "%s-%s.png" % (file_id, file_frame)
+        fingerprint = self.shared_cache and media_fingerprint(file_path)
+        if fingerprint:
+            request.shared_cache = self.shared_cache
+        request.generated_files = [(
+            thumb_path,
+            request.pack_name,
+            fingerprint and "%s-%s-%sx%s.%s" % (fingerprint, file_frame, width, height, image_format))]
+        if request.no_cache:
+            # Re-open the file (since it has changed)
+            self.reader_pool.discard(file_path)
+            if request.store:
+                request.store.remove(request.pack_name)
+        return request
+
+    def filmstrip_request(self, url_output, priority, variant):
+        """Filmstrip sprite (several frames side by side), or the JSON offsets of its frames"""
+
+        # Get URL parts
+        file_id = url_output.group('file_id')
+        start_frame = max(1, int(url_output.group('start')))
+        end_frame = max(start_frame, int(url_output.group('end')))
+        frame_count = min(max(1, int(url_output.group('count'))), MAX_STRIP_FRAMES)
+
+        log.debug(
+            "Processing filmstrip request for %s frames %d-%d (%d frames)",
+            file_id, start_frame, end_frame, frame_count)
+
+        file = self.get_file(file_id)
+        if not file:
+            return None
+
+        # Filmstrips are cached next to the other thumbnails (as a flat file, like legacy thumbnails)
+        image_format, width, height = variant
+        strip_name = "%s-strip-%s-%s-%s%s" % (file_id, start_frame, end_frame, frame_count, self.variant_suffix(variant))
+        strip_path = os.path.join(info.THUMBNAIL_PATH, "%s.%s" % (strip_name, image_format))
+        json_path = os.path.join(info.THUMBNAIL_PATH, "%s.json" % strip_name)
+
+        output_path, content_type = strip_path, THUMBNAIL_FORMATS[image_format]
+        if url_output.group('only_json'):
+            output_path, content_type = json_path, 'application/json'
+
+        request = ThumbnailRequest(
+            (file_id, "strip", start_frame, end_frame, frame_count, image_format, width, height),
+            priority,
+            output_path,
+            content_type,
+            GenerateFilmstrip,
+            file.absolute_path(),
+            strip_path,
+            json_path,
+            GetStripFrames(start_frame, end_frame, frame_count),
+            width, height,
+            self.reader_pool,
+            self.stats,
+            image_format)
+        fingerprint = self.shared_cache and media_fingerprint(file.absolute_path())
+        if fingerprint:
+            request.shared_cache = self.shared_cache
+        shared_name = fingerprint and "%s-strip-%s-%s-%s-%sx%s" % (
+            fingerprint, start_frame, end_frame, frame_count, width, height)
+        request.generated_files = [
+            (strip_path, os.path.basename(strip_path), fingerprint and "%s.%s" % (shared_name, image_format)),
+            (json_path, os.path.basename(json_path), fingerprint and "%s.json" % shared_name)]
+        request.store = self.get_store()
+        return request
+
+    def resolve_thumb_path(self, file_id, file_frame):
+        """Get the path of a thumbnail, probing the legacy filenames only once per file and frame"""
+        key = (info.THUMBNAIL_PATH, file_id, file_frame)
+        thumb_path = self.thumb_paths.get(key)
+        if thumb_path:
+            return thumb_path
+
+        thumb_path = os.path.join(info.THUMBNAIL_PATH, file_id, "%s.png" % file_frame)
+        if not os.path.exists(thumb_path) and file_frame == 1:
+            # Try ID with no frame # (for backwards compatibility)
+            thumb_path = os.path.join(info.THUMBNAIL_PATH, "%s.png" % file_id)
+        if not os.path.exists(thumb_path) and file_frame != 1:
+            # Try with ID and frame # in filename (for backwards compatibility)
+            thumb_path = os.path.join(info.THUMBNAIL_PATH, "%s-%s.png" % (file_id, file_frame))
+
+        self.thumb_paths[key] = thumb_path
+        return thumb_path
+
+    def join(self, request):
+        """Queue a thumbnail (or join the in-flight job for the same key), and return the job to wait on"""
+        with self.in_flight_lock:
+            job = self.in_flight.get(request.key)
+            if not job:
+                job = self.worker_pool.submit(request.priority, self.generate, request, time.time())
+                self.in_flight[request.key] = job
+            elif request.priority < job.priority and not job.running:
+                # Needed sooner than first requested (i.e. a clip scrolled into view)
+                self.worker_pool.requeue(request.priority, job)
+            job.waiters += 1
+            return job
+
+    def generate(self, request, submitted):
+        self.stats.add_time("queue", time.time() - submitted)
+        if request.generate():
+            self.stats.count("shared_cache_hits")
+
+    def leave(self, request, job):
+        """Stop waiting on a thumbnail job (the last waiter cancels it, if not yet generated)"""
+        with self.in_flight_lock:
+            job.waiters -= 1
+            if job.waiters > 0:
+                return
+            if self.in_flight.get(request.key) is job:
+                del self.in_flight[request.key]
+            if not job.done.is_set():
+                job.cancel()
+        if job.error:
+            self.stats.count("errors")
+            log.warning("Failed to generate thumbnail %s: %s", request.key, job.error)
+
+    def stat(self, request):
+        """Get the version and size of a requested thumbnail (loose files first, then the pack store)"""
+        output_stat = stat_thumbnail(request.output_path)
+        if not output_stat and request.store:
+            output_stat = request.store.stat(request.pack_name)
+        return output_stat
+
+    def needs_generation(self, request):
+        if request.no_cache or not self.stat(request):
+            self.stats.count("disk_misses")
+            return True
+        self.stats.count("disk_hits")
+        return False
+
+    def read(self, request, output_stat=None):
+        """Get the response for a request (the image, or its path), or None if missing"""
+        if request.only_path:
+            # Callers which need a path get a loose copy of packed thumbnails
+            if not stat_thumbnail(request.output_path) and not (
+                    request.store and request.store.extract(request.pack_name, request.output_path)):
+                return None
+            return bytes(request.output_path, "utf-8")
+
+        output_stat = output_stat or self.stat(request)
+        if not output_stat:
+            return None
+        content = self.byte_cache.get(request.output_path, output_stat)
+        if content is not None:
+            self.stats.count("memory_hits")
+        else:
+            self.stats.count("memory_misses")
+            read_start = time.time()
+            if stat_thumbnail(request.output_path):
+                with open(request.output_path, 'rb') as output_file:
+                    content = output_file.read()
+            else:
+                content = request.store.read(request.pack_name)
+                if content is None:
+                    return None
+            self.stats.add_time("io", time.time() - read_start)
+            self.byte_cache.put(request.output_path, output_stat, content)
+        return content
 
-    # Save thumbnail image and close readers
-    reader.GetFrame(thumbnail_frame).Thumbnail(thumb_path, width, height, mask, overlay, "#000", False, "png", 85, rotate)
-    reader.Close()
-    clip.Close()
+    def thumbnail_path_request(self, file_id, thumbnail_frame, clear_cache=False, priority=PRIORITY_VISIBLE):
+        return self.parse_request(
+            "/thumbnails/%s/%s/path/%s" % (file_id, thumbnail_frame, "no-cache/" if clear_cache else ""),
+            "priority=%d" % priority)
 
+    def found_path(self, request):
+        return request.output_path if self.read(request) else ''
 
-class httpThumbnailServer(ThreadingMixIn, HTTPServer):
-    """ This class allows to handle requests in separated threads.
-        No further content needed, don't touch this. """
+    def get_thumbnail_path(self, file_id, thumbnail_frame, clear_cache=False):
+        """Get the path of a thumbnail (generating it first, if needed), or '' if not found"""
+        request = self.thumbnail_path_request(file_id, thumbnail_frame, clear_cache)
+        if not request:
+            return ''
+        if self.needs_generation(request):
+            job = self.join(request)
+            try:
+                job.done.wait()
+            finally:
+                self.leave(request, job)
+        return self.found_path(request)
+
+    def find_thumbnail_path(self, file_id, thumbnail_frame):
+        """Get the path of an existing thumbnail (without generating it), or None if not generated yet"""
+        request = self.thumbnail_path_request(file_id, thumbnail_frame)
+        if not request:
+            return ''
+        if self.needs_generation(request):
+            return None
+        return self.found_path(request)
+
+    def queue_thumbnail_path(self, file_id, thumbnail_frame, callback, priority=PRIORITY_BACKGROUND):
+        """Generate a thumbnail in the background, and then call callback(path) on a worker thread"""
+        request = self.thumbnail_path_request(file_id, thumbnail_frame, priority=priority)
+        if not request:
+            callback('')
+            return
+
+        job = self.join(request)
+
+        def done():
+            self.leave(request, job)
+            callback(self.found_path(request))
+
+        job.add_done_callback(done)
+
+
+class httpThumbnailServer(HTTPServer):
+    """ This class handles (keep-alive) connections on a bounded pool of threads, so scrolling
+    the timeline never starts a thread per connection. Thumbnail generation is limited to the
+    thumbnail service's pool of workers. """
+
+    def __init__(self, server_address, RequestHandlerClass, service, max_threads=HTTP_SERVER_THREADS):
+        super().__init__(server_address, RequestHandlerClass)
+        self.service = service
+        self.executor = ThreadPoolExecutor(max_workers=max_threads)
+
+    def process_request(self, request, client_address):
+        """Handle a connection on the next free thread of the pool"""
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
 
 
 class httpThumbnailServerThread(Thread):
     """ This class runs a HTTP thumbnail server inside a thread
-        so we don't block the main thread with handle_request()."""
+        so we don't block the main thread with handle_request().
+        Only needed by timelines which can't use the custom URL scheme (i.e. WebKit). """
 
     def find_free_port(self):
         """Find the first available socket port"""
@@ -105,22 +1030,27 @@ class httpThumbnailServerThread(Thread):
 
         # Start listening for HTTP requests (and check for shutdown every 0.5 seconds)
         self.server_address = ('127.0.0.1', self.find_free_port())
-        self.thumbServer = httpThumbnailServer(self.server_address, httpThumbnailHandler)
-        self.thumbServer.daemon_threads = True
+        self.thumbServer = httpThumbnailServer(self.server_address, httpThumbnailHandler, self.service)
         log.info(
             "Starting thumbnail server listening on port %d",
             self.server_address[1])
         self.thumbServer.serve_forever(0.5)
+        self.thumbServer.server_close()
 
-    def __init__(self):
+    def __init__(self, service):
         Thread.__init__(self)
         self.daemon = True
         self.server_address = None
+        self.service = service
 
 
 class httpThumbnailHandler(BaseHTTPRequestHandler):
     """ This class handles HTTP requests to the HTTP thumbnail server above."""
 
+    # Keep connections open between requests (requires a Content-Length on every response)
+    protocol_version = "HTTP/1.1"
+    timeout = HTTP_KEEP_ALIVE_TIMEOUT
+
     def log_message(self, msg_format, *args):
         """ Log message from HTTPServer """
         log.info(msg_format % args)
@@ -129,87 +1059,108 @@ class httpThumbnailHandler(BaseHTTPRequestHandler):
         """ Log error from HTTPServer """
         log.warning(msg_format % args)
 
+    def client_disconnected(self):
+        """ Check if the client closed the connection (i.e. no longer needs the response) """
+        try:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            return bool(readable) and not self.connection.recv(1, socket.MSG_PEEK)
+        except (OSError, ValueError):
+            return True
+
+    def wait_for_job(self, job):
+        """ Wait for a queued job, unless the client disconnects first """
+        while not job.done.wait(0.1):
+            if self.client_disconnected():
+                return False
+        return not job.cancelled
+
+    def is_not_modified(self, etag, modified):
+        """ Check the conditional request headers (if any) against the current thumbnail version """
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match:
+            return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                return int(modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def send_cache_headers(self, etag, modified):
+        """ Allow the client to cache thumbnails (updated thumbnails are requested with a new URL) """
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', formatdate(modified, usegmt=True))
+        self.send_header('Cache-Control', 'private, max-age=%d' % THUMBNAIL_MAX_AGE)
+
     def do_GET(self):
-        """ Process each GET request and return a value (image or file path)"""
-        mask_path = os.path.join(info.IMAGES_PATH, "mask.png")
+        """ Process each GET request and return a value (image, filmstrip or file path)"""
+        service = self.server.service
 
         # Parse URL
-        url_output = REGEX_THUMBNAIL_URL.match(self.path)
-        if url_output and len(url_output.groups()) == 4:
-            # Path is expected to have 3 matched components (third is optional though)
-            #   /thumbnails/FILE-ID/FRAME-NUMBER/   or
-            #   /thumbnails/FILE-ID/FRAME-NUMBER/path/  or
-            #   /thumbnails/FILE-ID/FRAME-NUMBER/no-cache/  or
-            #   /thumbnails/FILE-ID/FRAME-NUMBER/path/no-cache/
-            self.send_response_only(200)
-        else:
+        url = urlparse(self.path)
+        if service.is_stats_path(url.path):
+            self.send_stats()
+            return
+        request = service.parse_request(url.path, url.query)
+        if not request:
+            service.stats.count("not_found")
             self.send_error(404)
             return
 
-        # Get URL parts
-        file_id = url_output.group('file_id')
-        file_frame = int(url_output.group('file_frame'))
-        only_path = url_output.group('only_path')
-        no_cache = url_output.group('no_cache')
+        if service.needs_generation(request):
+            # Queue thumbnail, or join a matching request already in progress
+            # (and wait for a worker to create it)
+            job = service.join(request)
+            try:
+                generated = self.wait_for_job(job)
+            finally:
+                service.leave(request, job)
+            if not generated:
+                log.debug("Thumbnail request %s cancelled", request.key)
+                self.close_connection = True
+                return
 
-        log.debug(
-            "Processing thumbnail request for %s frame %d",
-            file_id, file_frame)
+        output_stat = service.stat(request)
+        if not output_stat:
+            service.stats.count("not_found")
+            self.send_error(404)
+            return
 
-        try:
-            # Look up file data
-            file = File.get(id=file_id)
+        # Skip the image if the client already has this version
+        etag = '"%x-%x"' % (output_stat.st_mtime_ns, output_stat.st_size)
+        if not request.only_path and self.is_not_modified(etag, output_stat.st_mtime):
+            self.send_response(304)
+            self.send_cache_headers(etag, output_stat.st_mtime)
+            self.end_headers()
+            service.stats.count("not_modified")
+            service.finish(request, 0)
+            return
 
-            # Ensure file location is an absolute path
-            file_path = file.absolute_path()
-        except AttributeError:
-            # Couldn't match file ID
-            log.debug("No ID match, returning 404")
+        # Send path or image back to client (from memory, if possible)
+        content = service.read(request, output_stat)
+        if content is None:
+            service.stats.count("not_found")
             self.send_error(404)
             return
-
-        # Send headers
-        if not only_path:
-            self.send_header('Content-type', 'image/png')
-        else:
+        self.send_response(200)
+        if request.only_path:
             self.send_header('Content-type', 'text/html; charset=utf-8')
+        else:
+            self.send_header('Content-type', request.content_type)
+            self.send_cache_headers(etag, output_stat.st_mtime)
+        self.send_header('Content-Length', str(len(content)))
         self.end_headers()
+        self.wfile.write(content)
+        service.finish(request, len(content))
 
-        # Locate thumbnail
-        thumb_path = os.path.join(info.THUMBNAIL_PATH, file_id, "%s.png" % file_frame)
-        if not os.path.exists(thumb_path) and file_frame == 1:
-            # Try ID with no frame # (for backwards compatibility)
-            thumb_path = os.path.join(info.THUMBNAIL_PATH, "%s.png" % file_id)
-        if not os.path.exists(thumb_path) and file_frame != 1:
-            # Try with ID and frame # in filename (for backwards compatibility)
-            thumb_path = os.path.join(info.THUMBNAIL_PATH, "%s-%s.png" % (file_id, file_frame))
-
-        if not os.path.exists(thumb_path) or no_cache:
-            # Generate thumbnail (since we can't find it)
-
-            # Determine if video overlay should be applied to thumbnail
-            overlay_path = ""
-            if file.data["media_type"] == "video":
-                overlay_path = os.path.join(info.IMAGES_PATH, "overlay.png")
-
-            # Create thumbnail image
-            GenerateThumbnail(
-                file_path,
-                thumb_path,
-                file_frame,
-                98, 64,
-                mask_path,
-                overlay_path)
-
-        # Send message back to client
-        if os.path.exists(thumb_path):
-            if not only_path:
-                self.wfile.write(open(thumb_path, 'rb').read())
-            else:
-                self.wfile.write(bytes(thumb_path, "utf-8"))
-
-        # Pause processing of request (since we don't currently use thread pooling, this allows
-        # the threads to be processed without choking the CPU as much
-        # TODO: Make HTTPServer work with a limited thread pool and remove this sleep() hack.
-        time.sleep(0.01)
-
+    def send_stats(self):
+        """Send the thumbnail service stats (as JSON)"""
+        content = json.dumps(self.server.service.get_stats(), indent=2).encode("utf-8")
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
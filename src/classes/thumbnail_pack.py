@@ -0,0 +1,163 @@
+"""
+ @file
+ @brief This file contains the thumbnail pack store (many thumbnails in a single SQLite file)
+ @author Jonathan Thomas <jonathan@openshot.org>
+
+ @section LICENSE
+
+ Copyright (c) 2008-2018 OpenShot Studios, LLC
+ (http://www.openshotstudios.com). This file is part of
+ OpenShot Video Editor (http://www.openshot.org), an open-source project
+ dedicated to delivering high quality video editing and animation solutions
+ to the world.
+
+ OpenShot Video Editor is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ OpenShot Video Editor is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with OpenShot Library.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+import os
+import re
+import sqlite3
+from collections import namedtuple
+from threading import Lock, get_ident
+
+from classes.logger import log
+
+# Filename of the pack store (inside the thumbnail folder)
+PACK_FILENAME = "thumbnails.db"
+
+# Loose thumbnails which can be moved into the pack store: (examples)
+#  9ATJTBQ71V-25.png
+#  9ATJTBQ71V-25-196x128.jpg
+#  9ATJTBQ71V-strip-1-300-8.png
+#  9ATJTBQ71V-strip-1-300-8.json
+# File icons (9ATJTBQ71V.png) stay loose, since projects reference them by path.
+REGEX_PACKABLE = re.compile(r"^[^-/\\]+-(\d+|strip-\d+-\d+-\d+)(-\d+x\d+)?\.(png|jpg|webp|json)$")
+
+# Same fields as the os.stat_result fields used for thumbnails
+PackStat = namedtuple("PackStat", ["st_mtime_ns", "st_size", "st_mtime"])
+
+
+def is_pack_file(filename):
+    """Check if a filename belongs to the pack store (including its temporary journal)"""
+    return filename == PACK_FILENAME or filename.startswith(PACK_FILENAME + "-")
+
+
+class ThumbnailPackStore:
+    """ Stores thumbnails (and filmstrip metadata) as rows of a single SQLite file,
+    keyed by their loose filename, instead of thousands of small files. """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, PACK_FILENAME)
+        self.lock = Lock()
+
+        os.makedirs(folder, exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS thumbnails ("
+                "name TEXT PRIMARY KEY, data BLOB NOT NULL, mtime_ns INTEGER NOT NULL)")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def stat(self, name):
+        """Get the version and size of a thumbnail (or None if missing)"""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT mtime_ns, length(data) FROM thumbnails WHERE name = ?", (name,)).fetchone()
+        if row:
+            return PackStat(row[0], row[1], row[0] / 1e9)
+
+    def read(self, name):
+        """Get the contents of a thumbnail (or None if missing)"""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT data FROM thumbnails WHERE name = ?", (name,)).fetchone()
+        if row:
+            return bytes(row[0])
+
+    def write(self, name, data, mtime_ns):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO thumbnails (name, data, mtime_ns) VALUES (?, ?, ?)",
+                (name, sqlite3.Binary(data), mtime_ns))
+
+    def remove(self, name):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM thumbnails WHERE name = ?", (name,))
+
+    def add_file(self, name, path):
+        """Move a loose thumbnail into the pack store"""
+        with open(path, 'rb') as loose_file:
+            data = loose_file.read()
+        self.write(name, data, os.stat(path).st_mtime_ns)
+        os.remove(path)
+
+    def extract(self, name, path):
+        """Copy a thumbnail out of the pack store into a loose file (for callers which need a path)"""
+        pack_stat = self.stat(name)
+        data = self.read(name)
+        if data is None:
+            return False
+
+        tmp_path = "%s.%s.tmp" % (path, get_ident())
+        try:
+            with open(tmp_path, 'wb') as loose_file:
+                loose_file.write(data)
+            os.utime(tmp_path, ns=(pack_stat.st_mtime_ns, pack_stat.st_mtime_ns))
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return True
+
+    def migrate(self):
+        """Move loose thumbnails (flat and <file_id>/<frame>.png folders) into the pack store"""
+        migrated = 0
+        for filename in os.listdir(self.folder):
+            path = os.path.join(self.folder, filename)
+            try:
+                if os.path.isdir(path):
+                    # Older per-file folders (stored with the equivalent flat filename, except file icons)
+                    for frame_filename in os.listdir(path):
+                        frame, ext = os.path.splitext(frame_filename)
+                        if frame.isdigit() and frame != "1" and ext == ".png":
+                            self.add_file("%s-%s.png" % (filename, frame), os.path.join(path, frame_filename))
+                            migrated += 1
+                    if not os.listdir(path):
+                        os.rmdir(path)
+                elif REGEX_PACKABLE.match(filename):
+                    self.add_file(filename, path)
+                    migrated += 1
+            except (OSError, sqlite3.Error) as ex:
+                log.warning("Failed to migrate thumbnail %s to pack store: %s", path, ex)
+
+        if migrated:
+            log.info("Migrated %d thumbnails to pack store: %s", migrated, self.path)
+
+    @staticmethod
+    def merge(source_path, target_path):
+        """Copy any thumbnails missing from one pack store file into another"""
+        connection = sqlite3.connect(target_path)
+        try:
+            with connection:
+                connection.execute("ATTACH DATABASE ? AS source", (source_path,))
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS thumbnails ("
+                    "name TEXT PRIMARY KEY, data BLOB NOT NULL, mtime_ns INTEGER NOT NULL)")
+                connection.execute("INSERT OR IGNORE INTO thumbnails SELECT * FROM source.thumbnails")
+        finally:
+            connection.close()
@@ -0,0 +1,146 @@
+"""
+ @file
+ @brief This file contains the shared (user-level) thumbnail cache, keyed by media content
+ @author Jonathan Thomas <jonathan@openshot.org>
+
+ @section LICENSE
+
+ Copyright (c) 2008-2018 OpenShot Studios, LLC
+ (http://www.openshotstudios.com). This file is part of
+ OpenShot Video Editor (http://www.openshot.org), an open-source project
+ dedicated to delivering high quality video editing and animation solutions
+ to the world.
+
+ OpenShot Video Editor is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ OpenShot Video Editor is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with OpenShot Library.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+import os
+import shutil
+import hashlib
+from collections import OrderedDict
+from threading import Lock, get_ident
+
+from classes.logger import log
+
+
+def media_fingerprint(file_path):
+    """Get a fingerprint of a media file (its path, size and modified time), or None if missing"""
+    try:
+        file_stat = os.stat(file_path)
+    except OSError:
+        return None
+    key = "%s\0%d\0%d" % (os.path.normcase(os.path.abspath(file_path)), file_stat.st_size, file_stat.st_mtime_ns)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+class SharedThumbnailCache:
+    """ LRU cache of generated thumbnails shared by all projects, so known media is not decoded again.
+    Entries are named by the media fingerprint (not the per-project file ID), and least recently
+    used entries are deleted once the cache grows over its size limit. """
+
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self.entries = None  # name: size (least recently used first), loaded on first use
+        self.total_bytes = 0
+
+    def entry_path(self, name):
+        # Spread entries over sub-folders (by the first 2 characters of the fingerprint)
+        return os.path.join(self.folder, name[:2], name)
+
+    def load(self):
+        """Scan the cache folder (oldest modified time first, since hits update the modified time)"""
+        found = []
+        if os.path.isdir(self.folder):
+            for folder_name in os.listdir(self.folder):
+                folder_path = os.path.join(self.folder, folder_name)
+                if not os.path.isdir(folder_path):
+                    continue
+                for name in os.listdir(folder_path):
+                    if name.endswith(".tmp"):
+                        continue
+                    try:
+                        entry_stat = os.stat(os.path.join(folder_path, name))
+                    except OSError:
+                        continue
+                    found.append((entry_stat.st_mtime, name, entry_stat.st_size))
+
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        for _, name, size in sorted(found):
+            self.entries[name] = size
+            self.total_bytes += size
+        log.debug("Loaded shared thumbnail cache: %d entries, %d bytes", len(self.entries), self.total_bytes)
+
+    def restore(self, name, path):
+        """Copy a cached thumbnail to path (returns False if not cached)"""
+        with self.lock:
+            if self.entries is None:
+                self.load()
+            if name not in self.entries:
+                return False
+            self.entries.move_to_end(name)
+
+        entry_path = self.entry_path(name)
+        tmp_path = "%s.%s.tmp" % (path, get_ident())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.copyfile(entry_path, tmp_path)
+            os.replace(tmp_path, path)
+            os.utime(entry_path)
+            return True
+        except OSError as ex:
+            log.debug("Failed to restore shared thumbnail %s: %s", name, ex)
+            self.forget(name)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+
+    def put(self, name, path):
+        """Add a copy of a generated thumbnail (and delete the least recently used, if over the limit)"""
+        entry_path = self.entry_path(name)
+        tmp_path = "%s.%s.tmp" % (entry_path, get_ident())
+        try:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, entry_path)
+            size = os.path.getsize(entry_path)
+        except OSError as ex:
+            log.warning("Failed to add shared thumbnail %s: %s", name, ex)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        expired = []
+        with self.lock:
+            if self.entries is None:
+                self.load()
+            self.total_bytes += size - self.entries.pop(name, 0)
+            self.entries[name] = size
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                expired_name, expired_size = self.entries.popitem(last=False)
+                self.total_bytes -= expired_size
+                expired.append(expired_name)
+
+        for expired_name in expired:
+            try:
+                os.remove(self.entry_path(expired_name))
+            except OSError:
+                pass
+
+    def forget(self, name):
+        with self.lock:
+            if self.entries and name in self.entries:
+                self.total_bytes -= self.entries.pop(name)
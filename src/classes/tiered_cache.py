@@ -0,0 +1,214 @@
+"""
+ @file
+ @brief This file contains the tiered (memory + disk) preview cache
+ @author Jonathan Thomas <jonathan@openshot.org>
+
+ @section LICENSE
+
+ Copyright (c) 2008-2018 OpenShot Studios, LLC
+ (http://www.openshotstudios.com). This file is part of
+ OpenShot Video Editor (http://www.openshot.org), an open-source project
+ dedicated to delivering high quality video editing and animation solutions
+ to the world.
+
+ OpenShot Video Editor is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ OpenShot Video Editor is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with OpenShot Library.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+import json
+
+from PyQt5.QtCore import QTimer
+import openshot  # Python module for libopenshot (required video editing module installed separately)
+
+from classes.app import get_app
+from classes.logger import log
+from classes.updates import UpdateInterface
+
+# Fraction of the memory budget which starts (and ends) a spill to the disk tier. The memory tier
+# evicts frames itself once full (and those never reach the disk tier), so spilling starts well
+# below the limit, leaving headroom for the frames added between two balance ticks.
+SPILL_HIGH_WATER = 0.6
+SPILL_LOW_WATER = 0.45
+
+# Number of seconds ahead of the playhead to promote from the disk tier
+PROMOTE_SECONDS = 2.0
+
+
+def merge_frame_ranges(ranges):
+    """Merge overlapping and adjacent (start, end) frame ranges into a sorted list"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def cached_frame_ranges(cache_object):
+    """Get a list of (start, end) frame ranges found in a libopenshot cache object"""
+    if not cache_object or cache_object.Count() <= 0:
+        return []
+
+    return merge_frame_ranges(
+        (int(frame_range["start"]), int(frame_range["end"]))
+        for frame_range in json.loads(cache_object.Json()).get("ranges", []))
+
+
+def cached_frame_numbers(cache_object):
+    """Get a list of all frame numbers found in a libopenshot cache object"""
+    frames = []
+    for start, end in cached_frame_ranges(cache_object):
+        frames.extend(range(start, end + 1))
+    return frames
+
+
+class TieredCache(UpdateInterface):
+    """ Preview cache with a fast memory tier (attached to the timeline), and a slower disk tier
+    which receives frames spilled from memory and promotes them back when the playhead nears them. """
+
+    def __init__(self, window, memory_limit, disk_path, image_format, image_quality, image_scale, disk_limit):
+        self.window = window
+        self.timeline = None
+        self.playhead = 1
+        self.memory_limit = memory_limit
+
+        # Bytes in the memory tier at the last balance tick (to measure how fast it grows)
+        self.last_memory_bytes = 0
+
+        # Memory tier (set on the timeline) and disk tier (managed here)
+        self.memory = openshot.CacheMemory(memory_limit)
+        self.disk = openshot.CacheDisk(disk_path, image_format, image_quality, image_scale, disk_limit)
+
+        # Frame numbers we have written to the disk tier
+        self.disk_frames = set()
+
+        # QTimer to move frames between tiers
+        self.balance_timer = QTimer()
+        self.balance_timer.setInterval(250)
+        self.balance_timer.timeout.connect(self.balance)
+
+        # Frames on disk are invalid once the project or preview size changes
+        get_app().updates.add_listener(self)
+        self.window.MaxSizeChanged.connect(self.clear_disk)
+
+    def attach(self, timeline):
+        """Set the memory tier on a timeline, and start balancing the tiers"""
+        self.timeline = timeline
+        self.timeline.SetCache(self.memory)
+        self.balance_timer.start()
+
+    def close(self):
+        """Stop balancing, disconnect all listeners, and clear both tiers"""
+        self.balance_timer.stop()
+        get_app().updates.remove_listener(self)
+        try:
+            self.window.MaxSizeChanged.disconnect(self.clear_disk)
+        except TypeError:
+            # Signal was already disconnected
+            pass
+        self.Clear()
+        self.timeline = None
+
+    def set_playhead(self, position_frames):
+        """Update the playhead position (used to decide which frames stay in memory)"""
+        self.playhead = position_frames
+
+    def frame_ranges(self):
+        """Get a list of (start, end) frame ranges cached in either tier"""
+        disk_ranges = merge_frame_ranges((number, number) for number in self.disk_frames)
+        return merge_frame_ranges(cached_frame_ranges(self.memory) + disk_ranges)
+
+    def changed(self, action):
+        """ This method is invoked by the UpdateManager each time a change happens (i.e UpdateInterface) """
+
+        # Ignore changes that don't affect libopenshot (same as TimelineSync)
+        if len(action.key) >= 1 and action.key[0].lower() in ["files", "history", "markers", "layers", "export_path", "import_path", "scale", "profile"]:
+            return
+
+        # The timeline only invalidates the memory tier, so drop everything on disk
+        self.clear_disk()
+
+    def Clear(self):
+        """Clear both cache tiers"""
+        self.memory.Clear()
+        self.clear_disk()
+
+    def clear_disk(self, *args):
+        """Clear the disk tier"""
+        self.disk.Clear()
+        self.disk_frames.clear()
+        self.window.CacheChanged.emit()
+
+    def balance(self):
+        """Spill frames far from the playhead to disk, and promote frames ahead of the playhead to memory"""
+        if not self.timeline:
+            return
+
+        try:
+            # Check the size of the memory tier first (listing its frames is slow)
+            memory_bytes = self.memory.GetBytes()
+            growth = max(0, memory_bytes - self.last_memory_bytes)
+            self.last_memory_bytes = memory_bytes
+            moved = 0
+            if memory_bytes > self.memory_limit * SPILL_HIGH_WATER or memory_bytes + growth * 2 > self.memory_limit:
+                # Over the high water mark (or would fill the memory tier before the next tick)
+                moved += self.spill(cached_frame_numbers(self.memory))
+                self.last_memory_bytes = self.memory.GetBytes()
+            if self.disk_frames:
+                moved += self.promote()
+            if moved:
+                self.window.CacheChanged.emit()
+        except Exception as ex:
+            log.warning("Failed to balance tiered cache: %s", ex)
+
+    def spill(self, memory_frames):
+        """Move frames from the memory tier to the disk tier (furthest behind the playhead first)"""
+        low_water = self.memory_limit * SPILL_LOW_WATER
+
+        # Frames behind the playhead are spilled before frames ahead of it
+        memory_frames.sort(key=lambda number: (number < self.playhead, abs(number - self.playhead)), reverse=True)
+
+        spilled = 0
+        for number in memory_frames:
+            if self.memory.GetBytes() <= low_water:
+                break
+            frame = self.memory.GetFrame(number)
+            if frame:
+                self.disk.Add(frame)
+                self.disk_frames.add(number)
+                spilled += 1
+            self.memory.Remove(number)
+
+        log.debug("Spilled %s frames from memory to disk cache", spilled)
+        return spilled
+
+    def promote(self):
+        """Copy frames just ahead of the playhead from the disk tier into the memory tier"""
+        high_water = self.memory_limit * SPILL_HIGH_WATER
+        promote_count = int(self.timeline.info.fps.ToFloat() * PROMOTE_SECONDS)
+
+        promoted = 0
+        for number in range(self.playhead, self.playhead + promote_count):
+            if number not in self.disk_frames or self.memory.GetFrame(number):
+                continue
+            if self.memory.GetBytes() > high_water:
+                break
+            frame = self.disk.GetFrame(number)
+            if not frame:
+                # Evicted by the disk tier's own size limit
+                self.disk_frames.discard(number)
+                continue
+            self.memory.Add(frame)
+            promoted += 1
+        return promoted
@@ -216,6 +216,12 @@ class UpdateManager:
         else:
             log.warning("Cannot add existing listener: {}".format(str(listener)))
 
+    def remove_listener(self, listener):
+        """ Remove a listener (which will no longer receive UpdateActions). """
+
+        if listener in self.updateListeners:
+            self.updateListeners.remove(listener)
+
     def add_watcher(self, watcher):
         """ Add a new watcher (which will invoke the updateStatusChanged() method
         each time a 'redo' or 'undo' action is available). """
@@ -25,73 +25,492 @@
  along with OpenShot Library.  If not, see <http://www.gnu.org/licenses/>.
  """
 
+import os
+import sys
+import json
+import base64
+import ctypes
 import platform
+import time
 import threading
+from array import array
 from copy import deepcopy
+from threading import Lock
 from classes import info
 from classes.app import get_app
 from classes.logger import log
+from classes.thumbnail import ThumbnailWorkerPool
+from classes.thumbnail_shared import media_fingerprint
 import openshot
 
+try:
+    # Optional: used to extract waveforms in bulk (not bundled with every build)
+    import numpy
+except ImportError:
+    numpy = None
+
 
 # Get settings
 s = get_app().get_settings()
 
+# Peaks per second (at full resolution), and number of (half resolution) levels in a peak pyramid
+PEAKS_PER_SECOND = 20
+PYRAMID_LEVELS = 10
+
+# Number of waveforms decoded at once, and seconds between partial results while decoding
+WAVEFORM_WORKERS = max(1, min(4, (os.cpu_count() or 2) // 2))
+WAVEFORM_PROGRESS_INTERVAL = 1.0
+
+# Version of the peak cache files (older files are ignored, and decoded again)
+PEAK_CACHE_VERSION = 1
+
+
+def get_frame_peaks(frame, channel_filter, sample_divisor, sample):
+    """Get the peak of every sample_divisor samples of a frame (starting at sample),
+    and the starting sample of the next frame"""
+    peaks = []
+    sample_count = frame.GetAudioSamplesCount()
+
+    # Loop through samples in frame (hopping through it to get X # of data points per second)
+    while sample < sample_count:
+        # Determine amount of range
+        magnitude_range = min(sample_divisor, sample_count - sample)
+
+        # Get audio data for this channel
+        peaks.append(frame.GetAudioSample(channel_filter, sample, magnitude_range))
+
+        # Jump to next sample needed
+        sample += sample_divisor
+
+    # Adjust starting sample for next frame
+    return peaks, max(0, sample - sample_count)
 
-def get_audio_data(clip_id, file_path, channel_filter, volume_keyframe):
-    """Get a Clip object form libopenshot, and grab audio data"""
-    clip = openshot.Clip(file_path)
-    clip.Open()
 
-    # Disable video stream (for speed improvement)
-    clip.Reader().info.has_video = False
+def get_frame_peaks_numpy(frame, channel_filter, sample_divisor, sample):
+    """Same as get_frame_peaks(), but copies each channel's sample buffer into a NumPy array
+    (instead of calling GetAudioSample() for every data point)"""
+    sample_count = frame.GetAudioSamplesCount()
+    starts = numpy.arange(sample, sample_count, sample_divisor)
+    if not len(starts):
+        return numpy.zeros(0, dtype=numpy.float32), max(0, sample - sample_count)
 
-    log.info("Clip loaded, start thread")
-    t = threading.Thread(target=get_waveform_thread, args=[clip, clip_id, file_path, channel_filter, volume_keyframe])
-    t.daemon = True
-    t.start()
+    # Absolute sample values (loudest channel, if all channels are selected). Same channels as
+    # GetAudioSample(), which uses every channel for any channel_filter below 1 (including 0).
+    channels = range(frame.GetAudioChannelsCount()) if channel_filter <= 0 else [channel_filter]
+    magnitudes = None
+    for channel in channels:
+        buffer = ctypes.cast(int(frame.GetAudioSamples(channel)), ctypes.POINTER(ctypes.c_float))
+        channel_magnitudes = numpy.abs(numpy.ctypeslib.as_array(buffer, shape=(sample_count,)))
+        magnitudes = channel_magnitudes if magnitudes is None else numpy.maximum(magnitudes, channel_magnitudes)
 
-def get_waveform_thread(clip, clip_id, file_path, channel_filter=-1, volume_keyframe=None):
-    """Get the audio data from a clip in a separate thread"""
-    audio_data = []
+    # Peak of each range (the last range ends with the frame)
+    return numpy.maximum.reduceat(magnitudes, starts), int(starts[-1]) + sample_divisor - sample_count
+
+
+def get_file_peaks(clip, channel_filter, progress_callback=None):
+    """Decode the audio of a clip, and get its peaks (without any volume applied). The progress_callback
+    is called with the peaks of each frame decoded so far, and can return False to stop (returns None)."""
     sample_rate = clip.Reader().info.sample_rate
 
     # How many samples per second do we need (to approximate the waveform)
-    samples_per_second = 20
-    sample_divisor = round(sample_rate / samples_per_second)
+    sample_divisor = round(sample_rate / PEAKS_PER_SECOND)
     log.info("Getting waveform for sample rate: %s" % sample_rate)
 
+    frame_peaks = []
+    get_peaks = get_frame_peaks_numpy if numpy else get_frame_peaks
+
     sample = 0
     for frame_number in range(1, clip.Reader().info.video_length):
         # Get frame object
         frame = clip.Reader().GetFrame(frame_number)
 
-        # Get volume for this frame
-        volume = 1.0
-        if volume_keyframe:
-            volume = volume_keyframe.GetValue(frame_number)
-
-        # Loop through samples in frame (hopping through it to get X # of data points per second)
-        while True:
-            # Determine amount of range
-            magnitude_range = sample_divisor
-            if sample + magnitude_range > frame.GetAudioSamplesCount():
-                magnitude_range = frame.GetAudioSamplesCount() - sample
-
-            # Get audio data for this channel
-            if sample < frame.GetAudioSamplesCount():
-                audio_data.append(frame.GetAudioSample(channel_filter, sample, magnitude_range) * volume)
+        try:
+            peaks, next_sample = get_peaks(frame, channel_filter, sample_divisor, sample)
+        except (TypeError, ValueError):
+            # Sample buffers can't be accessed from Python (with this libopenshot build)
+            log.warning("Unable to read audio samples in bulk, falling back to GetAudioSample()", exc_info=1)
+            get_peaks = get_frame_peaks
+            peaks, next_sample = get_peaks(frame, channel_filter, sample_divisor, sample)
+        sample = next_sample
+        frame_peaks.append(peaks)
+
+        if progress_callback and not progress_callback(frame_peaks):
+            return None
+
+    return join_peaks(frame_peaks)
+
+
+def join_peaks(frame_peaks):
+    """Join the peaks of each frame into a single list (or NumPy array)"""
+    if numpy:
+        return numpy.concatenate([numpy.asarray(peaks, dtype=numpy.float32) for peaks in frame_peaks]) \
+            if frame_peaks else numpy.zeros(0, dtype=numpy.float32)
+    return [peak for peaks in frame_peaks for peak in peaks]
+
+
+def reduce_peaks(max_values, avg_values):
+    """Halve the resolution of a pyramid level (max and average of each pair of buckets)"""
+    if numpy:
+        max_values = numpy.asarray(max_values, dtype=numpy.float32)
+        avg_values = numpy.asarray(avg_values, dtype=numpy.float32)
+        starts = numpy.arange(0, len(max_values), 2)
+        counts = numpy.minimum(2, len(avg_values) - starts)
+        return numpy.maximum.reduceat(max_values, starts), numpy.add.reduceat(avg_values, starts) / counts
+
+    reduced_max = []
+    reduced_avg = []
+    for index in range(0, len(max_values), 2):
+        pair_max = max_values[index:index + 2]
+        pair_avg = avg_values[index:index + 2]
+        reduced_max.append(max(pair_max))
+        reduced_avg.append(sum(pair_avg) / len(pair_avg))
+    return reduced_max, reduced_avg
+
+
+def reduce_buckets(values, bucket_size):
+    """Get the max and average of every bucket_size values (len(values) must be a multiple of bucket_size)"""
+    if bucket_size == 1:
+        return values, values
+    if numpy:
+        buckets = numpy.asarray(values, dtype=numpy.float32).reshape(-1, bucket_size)
+        return buckets.max(axis=1), buckets.mean(axis=1)
+    buckets = [values[index:index + bucket_size] for index in range(0, len(values), bucket_size)]
+    return [max(bucket) for bucket in buckets], [sum(bucket) / bucket_size for bucket in buckets]
+
+
+def get_level_index(levels, pixels_per_second, block_width=2):
+    """Get the lowest resolution level which still has a peak for every block_width pixels
+    (levels is a list of peaks per second, from the highest resolution)"""
+    index = 0
+    while index + 1 < len(levels) and levels[index + 1] >= pixels_per_second / block_width:
+        index += 1
+    return index
+
+
+def apply_volume(peaks, start, fps, volume_keyframe):
+    """Multiply peaks (from the full resolution peak number start) by a clip's volume at each frame"""
+    if not volume_keyframe or volume_keyframe.GetCount() <= 1:
+        return scale_peaks(peaks, volume_keyframe.GetValue(1) if volume_keyframe else 1.0)
+    if not len(peaks):
+        return peaks
+
+    # Volume of each frame (once per frame), and the frame of each peak
+    first_frame = int(start * fps / PEAKS_PER_SECOND) + 1
+    last_frame = int((start + len(peaks) - 1) * fps / PEAKS_PER_SECOND) + 1
+    frame_volumes = [volume_keyframe.GetValue(frame_number) for frame_number in range(first_frame, last_frame + 1)]
+    if numpy:
+        peak_frames = (numpy.arange(start, start + len(peaks)) * fps / PEAKS_PER_SECOND).astype(numpy.int64) + 1
+        volumes = numpy.asarray(frame_volumes, dtype=numpy.float32)[peak_frames - first_frame]
+        return numpy.asarray(peaks, dtype=numpy.float32) * volumes
+    return [peak * frame_volumes[int(index * fps / PEAKS_PER_SECOND) + 1 - first_frame]
+            for index, peak in enumerate(peaks, start)]
+
+
+def read_floats(peak_file, count, byteorder):
+    """Read float32 values from a peak cache file"""
+    values = array("f")
+    values.fromfile(peak_file, count)
+    if byteorder != sys.byteorder:
+        values.byteswap()
+    return values
+
+
+def scale_peaks(values, volume):
+    """Multiply peaks by a constant volume"""
+    if volume == 1.0:
+        return values
+    if numpy:
+        return numpy.asarray(values, dtype=numpy.float32) * volume
+    return [value * volume for value in values]
+
+
+def write_floats(peak_file, values):
+    """Write float32 values (in native byte order) to a peak cache file"""
+    if numpy:
+        numpy.asarray(values, dtype=numpy.float32).tofile(peak_file)
+    else:
+        array("f", values).tofile(peak_file)
+
+
+def get_peak_scale(values):
+    """Get the int16 unit of a list of peaks (the loudest peak, or full scale if quieter)"""
+    loudest = float(numpy.max(values)) if numpy and len(values) else max(values, default=0.0)
+    return max(1.0, float(loudest)) / 32767
+
+
+def encode_peaks(values, peak_scale):
+    """Quantize peaks to little-endian int16 (units of peak_scale), as a base64 string for the timeline"""
+    if numpy:
+        quantized = numpy.clip(numpy.rint(numpy.asarray(values, dtype=numpy.float32) / peak_scale), 0, 32767)
+        data = quantized.astype("<i2").tobytes()
+    else:
+        quantized = array("h", (min(32767, max(0, round(value / peak_scale))) for value in values))
+        if sys.byteorder != "little":
+            quantized.byteswap()
+        data = quantized.tobytes()
+    return base64.b64encode(data).decode("ascii")
+
+
+class PeakPyramid:
+    """ Waveform peaks of a media file at several resolutions (PEAKS_PER_SECOND, then half as many
+    per level), with the max and average peak of each bucket. Only the level which matches the
+    timeline zoom is sent to the timeline, so long clips don't send every peak when zoomed out. """
+
+    def __init__(self, fps, levels):
+        self.fps = fps
+        self.levels = levels  # [(peaks per second, max values, average values)]
+
+    @classmethod
+    def from_peaks(cls, peaks, fps):
+        """Build all levels from the full resolution peaks"""
+        rate = PEAKS_PER_SECOND
+        max_values = avg_values = peaks
+        levels = [(rate, max_values, avg_values)]
+        while len(levels) < PYRAMID_LEVELS and len(max_values) > 1:
+            rate /= 2
+            max_values, avg_values = reduce_peaks(max_values, avg_values)
+            levels.append((rate, max_values, avg_values))
+        return cls(fps, levels)
+
+    @classmethod
+    def load(cls, path):
+        """Read a pyramid from a peak cache file (or None if missing or not readable)"""
+        try:
+            with open(path, 'rb') as peak_file:
+                header = json.loads(peak_file.readline().decode("utf-8"))
+                if header.get("version") != PEAK_CACHE_VERSION:
+                    return None
+                levels = []
+                for index, (rate, count) in enumerate(header["levels"]):
+                    max_values = read_floats(peak_file, count, header["byteorder"])
+                    # Full resolution buckets hold a single peak (so the average is the max)
+                    avg_values = read_floats(peak_file, count, header["byteorder"]) if index else max_values
+                    levels.append((rate, max_values, avg_values))
+            return cls(header["fps"], levels)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, EOFError) as ex:
+            log.warning("Failed to read waveform peak cache %s: %s", path, ex)
+            return None
+
+    def save(self, path):
+        header = {
+            "version": PEAK_CACHE_VERSION,
+            "fps": self.fps,
+            "byteorder": sys.byteorder,
+            "levels": [[rate, len(max_values)] for rate, max_values, _ in self.levels],
+        }
+        tmp_path = "%s.%s.tmp" % (path, threading.get_ident())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as peak_file:
+                peak_file.write(json.dumps(header).encode("utf-8") + b"\n")
+                for index, (_, max_values, avg_values) in enumerate(self.levels):
+                    write_floats(peak_file, max_values)
+                    if index:
+                        write_floats(peak_file, avg_values)
+            os.replace(tmp_path, path)
+        except OSError as ex:
+            log.warning("Failed to write waveform peak cache %s: %s", path, ex)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def with_volume(self, volume_keyframe):
+        """Get a copy of this pyramid with a clip's volume curve applied"""
+        if not volume_keyframe or volume_keyframe.GetCount() <= 1:
+            # Constant volume: scale every level as-is
+            volume = volume_keyframe.GetValue(1) if volume_keyframe else 1.0
+            return PeakPyramid(self.fps, [(rate, scale_peaks(max_values, volume), scale_peaks(avg_values, volume))
+                                          for rate, max_values, avg_values in self.levels])
+
+        # Volume curve: apply each frame's volume at full resolution, and rebuild the other levels
+        return PeakPyramid.from_peaks(apply_volume(self.levels[0][1], 0, self.fps, volume_keyframe), self.fps)
+
+    def level_index(self, pixels_per_second):
+        """Get the level to draw at a timeline zoom"""
+        return get_level_index([rate for rate, _, _ in self.levels], pixels_per_second)
+
+    def encode_level(self, index):
+        """Get a level as a dict for the timeline (with base64 int16 peaks)"""
+        rate, max_values, avg_values = self.levels[index]
+        peak_scale = get_peak_scale(max_values)
+        level = {"rate": rate, "scale": peak_scale, "max": encode_peaks(max_values, peak_scale)}
+        if index:
+            level["avg"] = encode_peaks(avg_values, peak_scale)
+        return level
+
+
+class PeakStream:
+    """ Reduces the peaks of a waveform which is still decoding (sent in chunks) to a single level,
+    keeping any peaks which don't fill a whole bucket of that level for the next chunk """
+
+    def __init__(self, index):
+        self.rate = PEAKS_PER_SECOND / 2 ** index
+        self.bucket_size = 2 ** index
+        self.pending = []
+        self.buckets = 0
+
+    def add(self, peaks):
+        """Get the buckets completed by peaks (as a dict for the timeline, with base64 int16 peaks), or None"""
+        values = join_peaks([self.pending, peaks])
+        complete = len(values) - len(values) % self.bucket_size
+        self.pending = values[complete:]
+        if not complete:
+            return None
+        max_values, avg_values = reduce_buckets(values[:complete], self.bucket_size)
+        peak_scale = get_peak_scale(max_values)
+        chunk = {"rate": self.rate, "start": self.buckets, "scale": peak_scale,
+                 "max": encode_peaks(max_values, peak_scale)}
+        if self.bucket_size > 1:
+            chunk["avg"] = encode_peaks(avg_values, peak_scale)
+        self.buckets += len(max_values)
+        return chunk
+
+
+def get_peak_cache_path(file_path, channel_filter):
+    """Get the peak cache file of a media file and channel (or None if the file is missing)"""
+    fingerprint = media_fingerprint(file_path)
+    if not fingerprint:
+        return None
+    channel = "all" if channel_filter <= 0 else channel_filter
+    return os.path.join(info.WAVEFORM_CACHE_PATH, fingerprint[:2], "%s-%s.peaks" % (fingerprint, channel))
+
+
+class WaveformJob:
+    """ Waveform of one file and channel, shared by every clip which shows it """
+
+    def __init__(self, key, file_path, channel_filter):
+        self.key = key
+        self.file_path = file_path
+        self.channel_filter = channel_filter
+        self.clips = {}  # clip_id: volume keyframe
+        self.cancelled = False
+        self.pool_job = None
+        self.fps = None
+        self.last_progress = 0.0
+        self.sent = {}  # clip_id: (frames, peaks) already sent while decoding
+
+    def run(self, scheduler):
+        """Load (or decode) the waveform, emitting partial results while decoding"""
+        pyramid = None
+        try:
+            cache_path = get_peak_cache_path(self.file_path, self.channel_filter)
+            pyramid = PeakPyramid.load(cache_path) if cache_path else None
+            if pyramid:
+                log.info("Waveform loaded from peak cache: %s" % cache_path)
             else:
-                # Adjust starting sample for next frame
-                sample = max(0, sample - frame.GetAudioSamplesCount())
-                break # We are done with this frame
+                pyramid = self.decode()
+                if pyramid and cache_path:
+                    pyramid.save(cache_path)
+        except Exception as ex:
+            log.warning("Failed to get waveform for %s: %s", self.file_path, ex)
+
+        # Cancelled jobs emit nothing (their clips were already released)
+        clips = scheduler.finish(self)
+        if self.cancelled:
+            log.info("Waveform job cancelled: %s" % self.file_path)
+            return
+        for clip_id, volume_keyframe in clips.items():
+            clip_pyramid = pyramid.with_volume(volume_keyframe) if pyramid else None
+            get_app().window.WaveformReady.emit(clip_id, clip_pyramid, True)
+
+    def decode(self):
+        clip = openshot.Clip(self.file_path)
+        clip.Open()
+
+        # Disable video stream (for speed improvement)
+        clip.Reader().info.has_video = False
+
+        self.fps = clip.Reader().info.fps.ToFloat()
+        self.last_progress = time.time()
+        peaks = get_file_peaks(clip, self.channel_filter, self.progress)
+
+        # Close reader
+        clip.Close()
+
+        if peaks is None:
+            return None
+        return PeakPyramid.from_peaks(peaks, self.fps)
+
+    def progress(self, frame_peaks):
+        """Emit the full resolution peaks decoded since the last call (every WAVEFORM_PROGRESS_INTERVAL
+        seconds), or stop if cancelled. Clips which joined this job get every peak decoded so far."""
+        if self.cancelled:
+            return False
+        if time.time() - self.last_progress >= WAVEFORM_PROGRESS_INTERVAL:
+            for clip_id, volume_keyframe in list(self.clips.items()):
+                sent_frames, sent_peaks = self.sent.get(clip_id, (0, 0))
+                peaks = join_peaks(frame_peaks[sent_frames:])
+                self.sent[clip_id] = (len(frame_peaks), sent_peaks + len(peaks))
+                if len(peaks):
+                    peaks = apply_volume(peaks, sent_peaks, self.fps, volume_keyframe)
+                    get_app().window.WaveformReady.emit(clip_id, peaks, False)
+            self.last_progress = time.time()
+        return True
+
+
+class WaveformScheduler:
+    """ Runs waveform jobs on a bounded pool of worker threads. Clips showing the same file and channel
+    share a job, and a job is cancelled once all of its clips are hidden or deleted. """
+
+    def __init__(self, size=WAVEFORM_WORKERS):
+        self.lock = Lock()
+        self.jobs = {}  # (file path, channel): WaveformJob
+        self.clip_jobs = {}  # clip_id: WaveformJob
+        self.pool = ThumbnailWorkerPool(size)
+        self.pool.start()
+
+    def request(self, clip_id, file_path, channel_filter, volume_keyframe):
+        """Queue the waveform of a clip (WaveformReady is emitted with partial, then complete, results)"""
+        # Copy the volume curve (the timeline clip can be deleted while the job runs)
+        volume = openshot.Keyframe()
+        volume.SetJson(volume_keyframe.Json())
+
+        key = (file_path, channel_filter)
+        with self.lock:
+            self.release(clip_id)
+            job = self.jobs.get(key)
+            if not job:
+                job = WaveformJob(key, file_path, channel_filter)
+                self.jobs[key] = job
+                job.pool_job = self.pool.submit(0, job.run, self)
+            else:
+                log.info("Waveform job already queued for %s" % file_path)
+            job.clips[clip_id] = volume
+            self.clip_jobs[clip_id] = job
+
+    def cancel(self, clip_id):
+        """Stop sending results to a clip (and cancel its job, if no other clips are waiting on it)"""
+        with self.lock:
+            self.release(clip_id)
+
+    def cancel_all(self):
+        with self.lock:
+            for clip_id in list(self.clip_jobs):
+                self.release(clip_id)
 
-            # Jump to next sample needed
-            sample += sample_divisor
+    def release(self, clip_id):
+        # Caller must hold self.lock
+        job = self.clip_jobs.pop(clip_id, None)
+        if not job:
+            return
+        job.clips.pop(clip_id, None)
+        job.sent.pop(clip_id, None)
+        if not job.clips:
+            job.cancelled = True
+            job.pool_job.cancel()
+            self.jobs.pop(job.key, None)
 
-    # Close reader
-    clip.Close()
+    def finish(self, job):
+        """Remove a job (so new requests start a new one), and get the clips still waiting on it"""
+        with self.lock:
+            if self.jobs.get(job.key) is job:
+                del self.jobs[job.key]
+            for clip_id in job.clips:
+                if self.clip_jobs.get(clip_id) is job:
+                    del self.clip_jobs[clip_id]
+            return dict(job.clips)
 
-    # Emit signal when done
-    log.info("get_waveform_thread completed")
-    get_app().window.WaveformReady.emit(clip_id, audio_data)
+    def close(self):
+        self.cancel_all()
+        self.pool.stop()
@@ -79,6 +79,16 @@ except ImportError:
     sys.path.append(openshot_qt.OPENSHOT_PATH)
     from classes import info
 
+try:
+    # Custom URL schemes must be registered before creating a QApplication (Qt 5.12+)
+    from PyQt5.QtWebEngineCore import QWebEngineUrlScheme
+    thumbnail_scheme = QWebEngineUrlScheme(info.THUMBNAIL_SCHEME.encode("utf-8"))
+    thumbnail_scheme.setSyntax(QWebEngineUrlScheme.Syntax.Path)
+    thumbnail_scheme.setFlags(QWebEngineUrlScheme.SecureScheme | QWebEngineUrlScheme.LocalAccessAllowed)
+    QWebEngineUrlScheme.registerScheme(thumbnail_scheme)
+except (ImportError, AttributeError):
+    pass
+
 # Global holder for QApplication instance
 app = None
 
@@ -121,6 +131,60 @@ def main():
         '--debug-console', action='store_true',
         help='Debugging output (console only)')
     parser.add_argument('-V', '--version', action='store_true')
+    render_group = parser.add_argument_group('headless rendering')
+    render_group.add_argument(
+        '--render', metavar='PROJECT', action='store',
+        help='Render a project file without the user interface '
+             '(requires --preset and --out)')
+    render_group.add_argument(
+        '--preset', action='store',
+        help='Export preset title or file name (i.e. "MP4 (h.264)")')
+    render_group.add_argument(
+        '--profile', action='store',
+        help="Profile description or file name "
+             "(default: the preset's profile, or the project's)")
+    render_group.add_argument(
+        '--quality', action='store', choices=['Low', 'Med', 'High'], default='High',
+        help='Preset quality')
+    render_group.add_argument(
+        '--export-type', action='store', choices=['video-audio', 'video', 'audio'],
+        default='video-audio', help='Streams to export')
+    render_group.add_argument(
+        '--start-frame', type=int, default=1,
+        help='First frame to export')
+    render_group.add_argument(
+        '--end-frame', type=int, default=None,
+        help='Last frame to export (default: end of timeline)')
+    render_group.add_argument(
+        '--out', action='store',
+        help='Path of the exported file')
+    render_group.add_argument(
+        '--render-queue', metavar='QUEUE', action='store',
+        help='Render every job of a render queue file (JSON)')
+    render_group.add_argument(
+        '--render-jobs', type=int, default=None,
+        help='Number of queued jobs to render at once (overrides the queue file)')
+    render_group.add_argument(
+        '--processes', type=int, default=None,
+        help='Number of processes rendering segments of the video at once (default: 1)')
+    render_group.add_argument(
+        '--pipeline-depth', type=int, default=None,
+        help='Number of frames rendered ahead of the encoder (default: 0, render and encode in turn)')
+    render_group.add_argument(
+        '--report', action='store_true',
+        help='Save a performance report (JSON) next to the exported file')
+    render_group.add_argument(
+        '--smart-render', action='store_true',
+        help='Copy the video of unchanged clips (instead of encoding it again), where possible')
+    render_group.add_argument(
+        '--cache-limit-mb', type=int, default=None,
+        help='Size of the export cache (default: sized from the resolution and available memory)')
+    render_group.add_argument(
+        '--outputs', metavar='JSON', action='store',
+        help='Render several outputs in one pass, instead of --preset and --out: a JSON list of '
+             '{"preset", "profile", "quality", "export_type", "out"}')
+    render_group.add_argument(
+        '--render-segment', metavar='SPEC', action='store', help=argparse.SUPPRESS)
     parser.add_argument(
         'remain', nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
 
@@ -170,6 +234,11 @@ def main():
             print("Unsupported language '{}'! (See --list-languages)".format(args.lang))
             sys.exit(-1)
 
+    # Headless render (without the main window or WebEngine)
+    if args.render or args.render_queue or args.render_segment:
+        from classes import render_queue
+        sys.exit(render_queue.main(args))
+
     # Normal startup, print module path and lauch application
     print("Loaded modules from: %s" % info.PATH)
 
@@ -0,0 +1,148 @@
+"""
+ @file
+ @brief This file contains unit tests for the preview cache helpers
+ @author Jonathan Thomas <jonathan@openshot.org>
+
+ @section LICENSE
+
+ Copyright (c) 2008-2018 OpenShot Studios, LLC
+ (http://www.openshotstudios.com). This file is part of
+ OpenShot Video Editor (http://www.openshot.org), an open-source project
+ dedicated to delivering high quality video editing and animation solutions
+ to the world.
+
+ OpenShot Video Editor is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ OpenShot Video Editor is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with OpenShot Library.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+import sys
+import os
+import json
+
+import unittest
+
+# Import parent folder (so it can find other imports)
+PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+if PATH not in sys.path:
+    sys.path.append(PATH)
+
+from classes.tiered_cache import TieredCache, merge_frame_ranges, cached_frame_ranges, SPILL_LOW_WATER
+
+
+class FakeCache:
+    """ Stand-in for a libopenshot cache object (frame numbers and their sizes) """
+
+    def __init__(self, frames=None):
+        self.frames = dict(frames or {})
+        self.json_calls = 0
+
+    def Count(self):
+        return len(self.frames)
+
+    def GetBytes(self):
+        return sum(self.frames.values())
+
+    def Json(self):
+        self.json_calls += 1
+        ranges = [{"start": str(start), "end": str(end)}
+                  for start, end in merge_frame_ranges((number, number) for number in self.frames)]
+        return json.dumps({"ranges": ranges})
+
+    def GetFrame(self, number):
+        return number if number in self.frames else None
+
+    def Add(self, number):
+        self.frames[number] = 10
+
+    def Remove(self, number):
+        self.frames.pop(number, None)
+
+
+class FakeWindow:
+    class CacheChanged:
+        emitted = 0
+
+        @classmethod
+        def emit(cls):
+            cls.emitted += 1
+
+
+class FakeTimeline:
+    class info:
+        class fps:
+            @staticmethod
+            def ToFloat():
+                return 10.0
+
+
+class TieredCacheTests(unittest.TestCase):
+    """ Unit test class for the tiered (memory + disk) preview cache """
+
+    def create_cache(self, memory_frames, memory_limit=100):
+        cache = TieredCache.__new__(TieredCache)
+        cache.window = FakeWindow()
+        cache.timeline = FakeTimeline()
+        cache.playhead = 1
+        cache.memory_limit = memory_limit
+        cache.last_memory_bytes = 0
+        cache.memory = FakeCache(memory_frames)
+        cache.disk = FakeCache()
+        cache.disk_frames = set()
+        return cache
+
+    def test_merge_frame_ranges(self):
+        self.assertEqual(merge_frame_ranges([(5, 6), (1, 2), (3, 4), (10, 12), (11, 11)]), [(1, 6), (10, 12)])
+        self.assertEqual(merge_frame_ranges([]), [])
+
+    def test_cached_frame_ranges(self):
+        self.assertEqual(cached_frame_ranges(FakeCache({1: 1, 2: 1, 3: 1, 8: 1})), [(1, 3), (8, 8)])
+        self.assertEqual(cached_frame_ranges(FakeCache()), [])
+        self.assertEqual(cached_frame_ranges(None), [])
+
+    def test_balance_below_high_water(self):
+        cache = self.create_cache({number: 10 for number in range(1, 4)})
+        cache.balance()
+        # Nothing to spill or promote, so the frames of the memory tier are never listed
+        self.assertEqual(cache.memory.json_calls, 0)
+        self.assertEqual(cache.disk_frames, set())
+
+    def test_balance_spills_far_frames(self):
+        cache = self.create_cache({number: 10 for number in range(1, 8)})
+        cache.playhead = 5
+        cache.balance()
+        self.assertLessEqual(cache.memory.GetBytes(), cache.memory_limit * SPILL_LOW_WATER)
+        # Frames behind the playhead are spilled first
+        self.assertEqual(cache.disk_frames, {1, 2, 3})
+        self.assertIn(5, cache.memory.frames)
+
+    def test_balance_spills_fast_growth(self):
+        cache = self.create_cache({1: 10, 2: 10})
+        cache.balance()
+        self.assertEqual(cache.disk_frames, set())
+
+        # Growing this fast would fill the memory tier before the next tick
+        cache.memory.frames.update({number: 10 for number in range(3, 6)})
+        cache.balance()
+        self.assertTrue(cache.disk_frames)
+
+    def test_balance_promotes_frames(self):
+        cache = self.create_cache({})
+        cache.disk = FakeCache({5: 10, 6: 10, 40: 10})
+        cache.disk_frames = {5, 6, 40}
+        cache.playhead = 4
+        cache.balance()
+        self.assertEqual(sorted(cache.memory.frames), [5, 6])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+"""
+ @file
+ @brief This file compares the export speed of the single process and segmented (multi-process) renderers
+ @author Jonathan Thomas <jonathan@openshot.org>
+
+ @section LICENSE
+
+ Copyright (c) 2008-2018 OpenShot Studios, LLC
+ (http://www.openshotstudios.com). This file is part of
+ OpenShot Video Editor (http://www.openshot.org), an open-source project
+ dedicated to delivering high quality video editing and animation solutions
+ to the world.
+
+ OpenShot Video Editor is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ OpenShot Video Editor is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with OpenShot Library.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+# Usage (exports the same range of a reference project with each number of processes):
+#   python3 src/tests/export_benchmark.py reference.osp --preset "MP4 (h.264)" --end-frame 600 --processes 1 2 4
+# Without a project, a reference project is generated (a test pattern and tone, with a picture-in-picture
+# of the same video on a second track), which needs ffmpeg. A single process is always measured first,
+# and the speedup of each number of processes is relative to it.
+
+import sys
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+# Import parent folder (so it can find other imports)
+PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+if PATH not in sys.path:
+    sys.path.append(PATH)
+
+import openshot
+
+from classes import info, render_queue
+from classes.render import find_preset
+from classes.render_segments import get_ffmpeg_path
+
+# Frame rate and size of the generated reference project
+REFERENCE_FPS = 30
+REFERENCE_SIZE = (1280, 720)
+
+
+def set_keyframe(clip_data, key, value):
+    """Set a (constant) keyframe of a clip"""
+    clip_data[key] = {"Points": [{"co": {"X": 1.0, "Y": value}, "interpolation": 1}]}
+
+
+def create_reference_project(folder, seconds):
+    """Generate a reference video (with ffmpeg), and save a project using it on 2 tracks. Returns the
+    path of the project, or None if ffmpeg was not found."""
+    ffmpeg_path = get_ffmpeg_path()
+    if not ffmpeg_path:
+        return None
+    video_path = os.path.join(folder, "reference.mp4")
+    subprocess.check_call([
+        ffmpeg_path, "-v", "error", "-y",
+        "-f", "lavfi", "-i", "testsrc2=size=%sx%s:rate=%s" % (REFERENCE_SIZE + (REFERENCE_FPS,)),
+        "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=48000",
+        "-t", str(seconds), "-c:v", "libx264", "-g", str(REFERENCE_FPS), "-pix_fmt", "yuv420p",
+        "-c:a", "aac", video_path])
+
+    # Same project data the Import Files dialog (and the timeline) would create
+    with open(os.path.join(info.PATH, "settings", "_default.project"), 'r', encoding='utf-8') as project_file:
+        project_data = json.load(project_file)
+    clip = openshot.Clip(video_path)
+    file_data = json.loads(clip.Reader().Json())
+    file_data.update({"id": "REFFILE1", "media_type": "video"})
+    project_data.update({"fps": {"num": REFERENCE_FPS, "den": 1}, "width": REFERENCE_SIZE[0],
+                         "height": REFERENCE_SIZE[1], "profile": "HD 720p 30 fps", "duration": seconds,
+                         "files": [file_data]})
+    for clip_id, layer in [("REFCLIP1", 1000000), ("REFCLIP2", 2000000)]:
+        clip_data = json.loads(clip.Json())
+        clip_data.update({"id": clip_id, "file_id": file_data["id"], "title": "reference.mp4", "layer": layer,
+                          "position": 0.0})
+        project_data["clips"].append(clip_data)
+
+    # Picture-in-picture (scaled, moved and faded), so frames are composited
+    clip_data = project_data["clips"][1]
+    set_keyframe(clip_data, "scale_x", 0.4)
+    set_keyframe(clip_data, "scale_y", 0.4)
+    set_keyframe(clip_data, "location_x", 0.25)
+    set_keyframe(clip_data, "alpha", 0.8)
+    set_keyframe(clip_data, "volume", 0.0)
+
+    project_path = os.path.join(folder, "reference.osp")
+    with open(project_path, 'w', encoding='utf-8') as project_file:
+        json.dump(project_data, project_file)
+    return project_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare export speed with different numbers of processes")
+    parser.add_argument('project', nargs='?', help='Reference project file (generated if not set)')
+    parser.add_argument('--preset', default='MP4 (h.264)', help='Export preset title or file name')
+    parser.add_argument('--profile', default=None, help='Profile description or file name')
+    parser.add_argument('--quality', default='High', choices=['Low', 'Med', 'High'])
+    parser.add_argument('--start-frame', type=int, default=1)
+    parser.add_argument('--end-frame', type=int, default=600)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--repeat', type=int, default=1, help='Exports per number of processes (fastest is kept)')
+    args = parser.parse_args()
+
+    app = render_queue.init_headless()  # noqa: F841
+    preset = find_preset(args.preset)
+    if not preset:
+        print("Export preset not found: %s" % args.preset)
+        return 1
+    frames = args.end_frame - args.start_frame + 1
+    folder = tempfile.mkdtemp(prefix="openshot-benchmark-")
+
+    # A single process is the baseline (so it is always measured first)
+    process_counts = [1] + sorted(set(processes for processes in args.processes if processes > 1))
+    results = []
+    try:
+        project_path = args.project and os.path.abspath(args.project)
+        if not project_path:
+            project_path = create_reference_project(folder, args.end_frame // REFERENCE_FPS + 1)
+            if not project_path:
+                print("ffmpeg was not found (needed to generate a reference project)")
+                return 1
+        for processes in process_counts:
+            best = None
+            for _ in range(args.repeat):
+                job = {"project": project_path,
+                       "preset": args.preset,
+                       "profile": args.profile,
+                       "quality": args.quality,
+                       "start_frame": args.start_frame,
+                       "end_frame": args.end_frame,
+                       "out": os.path.join(folder, "benchmark-%s.%s" % (processes, preset["videoformat"])),
+                       "processes": processes}
+                start_time = time.time()
+                if not render_queue.render_job(job, progress=False):
+                    print("Export failed with %s processes" % processes)
+                    return 1
+                seconds = time.time() - start_time
+                best = seconds if best is None else min(best, seconds)
+            results.append((processes, best))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    print("%-10s %10s %10s %10s" % ("Processes", "Seconds", "FPS", "Speedup"))
+    baseline = dict(results)[1]
+    for processes, seconds in results:
+        print("%-10d %10.2f %10.2f %9.2fx" % (processes, seconds, frames / seconds, baseline / seconds))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
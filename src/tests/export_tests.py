@@ -0,0 +1,338 @@
+"""
+ @file
+ @brief This file contains unit tests for the export helpers (render queue, segments and reports)
+ @author Jonathan Thomas <jonathan@openshot.org>
+
+ @section LICENSE
+
+ Copyright (c) 2008-2018 OpenShot Studios, LLC
+ (http://www.openshotstudios.com). This file is part of
+ OpenShot Video Editor (http://www.openshot.org), an open-source project
+ dedicated to delivering high quality video editing and animation solutions
+ to the world.
+
+ OpenShot Video Editor is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ OpenShot Video Editor is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with OpenShot Library.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+import sys
+import os
+import json
+import tempfile
+from types import SimpleNamespace
+
+import unittest
+from unittest import mock
+
+# Import parent folder (so it can find other imports)
+PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+if PATH not in sys.path:
+    sys.path.append(PATH)
+
+from classes import render
+from classes.render_queue import job_command, load_queue
+from classes.render_report import build_report, get_report_summary
+from classes.render_segments import MIN_SEGMENT_GOPS, segmented_export_unsupported, split_segments
+from classes.smart_render import SmartExportRenderer, find_passthrough_ranges, is_passthrough_clip, subtract_ranges
+
+
+class ExportSettingsTests(unittest.TestCase):
+    """ Unit test class for export settings """
+
+    def test_convert_to_bytes(self):
+        self.assertEqual(render.convert_to_bytes("5 Mb/s"), "5000000")
+        self.assertEqual(render.convert_to_bytes("192 kb/s"), "192000")
+        self.assertEqual(render.convert_to_bytes("23 crf"), "23")
+        # Quality values are limited to the range of each option
+        self.assertEqual(render.convert_to_bytes("80 crf"), "63")
+        self.assertEqual(render.convert_to_bytes("300 qp"), "255")
+        self.assertEqual(render.convert_to_bytes(""), "0")
+
+    def test_get_quality_option(self):
+        self.assertEqual(render.get_quality_option("23 crf"), "crf")
+        self.assertEqual(render.get_quality_option("20 cqp"), "cqp")
+        self.assertIsNone(render.get_quality_option("5 Mb/s"))
+
+
+class ExportCacheTests(unittest.TestCase):
+    """ Unit test class for the size of export caches """
+
+    video_settings = {"width": 1920, "height": 1080, "fps": {"num": 25, "den": 1}}
+    audio_settings = {"sample_rate": 48000, "channels": 2}
+
+    def test_get_frame_bytes(self):
+        # RGBA image, and 1920 float samples of each channel
+        self.assertEqual(render.get_frame_bytes(self.video_settings, self.audio_settings),
+                         1920 * 1080 * 4 + 1920 * 2 * 4)
+
+    def test_get_export_cache_bytes(self):
+        frame_bytes = render.get_frame_bytes(self.video_settings, self.audio_settings)
+        with mock.patch("classes.render.get_available_memory", return_value=None):
+            cache_bytes, reason = render.get_export_cache_bytes(self.video_settings, self.audio_settings, 4)
+            self.assertEqual(cache_bytes, frame_bytes * (4 + render.EXPORT_CACHE_FRAMES))
+
+            # The preferences override the size
+            self.assertEqual(render.get_export_cache_bytes(
+                self.video_settings, self.audio_settings, 4, limit_mb=64), (64 * 1024 * 1024, "preferences"))
+
+        # Limited to a share of the available memory (but always 2 frames)
+        available = frame_bytes * 8 / render.EXPORT_CACHE_MEMORY_FRACTION
+        with mock.patch("classes.render.get_available_memory", return_value=available):
+            cache_bytes, reason = render.get_export_cache_bytes(self.video_settings, self.audio_settings, 16)
+            self.assertEqual(cache_bytes, frame_bytes * 8)
+            cache_bytes, reason = render.get_export_cache_bytes(
+                self.video_settings, self.audio_settings, 16, shares=8)
+            self.assertEqual(cache_bytes, frame_bytes * 2)
+
+
+class MultiExportTests(unittest.TestCase):
+    """ Unit test class for multi-output (single pass) exports """
+
+    def create_output(self, path, width, height, fps, has_video=True, has_audio=True, sample_rate=48000):
+        video_settings = {"has_video": has_video, "width": width, "height": height, "fps": {"num": fps, "den": 1},
+                          "pixel_ratio": {"num": 1, "den": 1}, "start_frame": 1, "end_frame": 100}
+        audio_settings = {"has_audio": has_audio, "sample_rate": sample_rate, "channels": 2}
+        return {"export_file_path": path, "video_settings": video_settings, "audio_settings": audio_settings}
+
+    def test_outputs(self):
+        outputs = [self.create_output("/tmp/out-720p.mp4", 1280, 720, 30, sample_rate=44100),
+                   self.create_output("/tmp/out-1080p.mp4", 1920, 1080, 30),
+                   # Audio only outputs use the frame rate of the project
+                   self.create_output("/tmp/out.mp3", 1280, 720, 24, has_video=False)]
+        renderer = render.MultiExportRenderer({}, outputs)
+        self.assertEqual(renderer.export_file_path, "/tmp/out-1080p.mp4")
+        self.assertEqual(renderer.video_settings["width"], 1920)
+        self.assertEqual(renderer.audio_settings["sample_rate"], 48000)
+
+        # Outputs with video need the same frame rate
+        outputs.append(self.create_output("/tmp/out-25.mp4", 1280, 720, 25))
+        with self.assertRaises(ValueError):
+            render.MultiExportRenderer({}, outputs)
+
+
+class FakeTimeline:
+    """ Stand-in for a libopenshot timeline (frames are their numbers), which fails at one frame """
+
+    def __init__(self, failed_frame=None):
+        self.failed_frame = failed_frame
+        self.rendered = []
+
+    def GetFrame(self, number):
+        if number == self.failed_frame:
+            raise RuntimeError("Failed to render frame %s" % number)
+        self.rendered.append(number)
+        return number
+
+
+class FramePipelineTests(unittest.TestCase):
+    """ Unit test class for the export pipeline (frames rendered ahead of the writer) """
+
+    def test_frames_in_order(self):
+        pipeline = render.FramePipeline(FakeTimeline(), 1, 50, depth=4)
+        try:
+            self.assertEqual([pipeline.get(number) for number in range(1, 51)], list(range(1, 51)))
+        finally:
+            pipeline.close()
+
+    def test_error(self):
+        timeline = FakeTimeline(failed_frame=3)
+        pipeline = render.FramePipeline(timeline, 1, 50, depth=8)
+        try:
+            # Every render thread stops at the first error
+            for thread in pipeline.threads:
+                thread.join(5.0)
+                self.assertFalse(thread.is_alive())
+            self.assertLessEqual(len(timeline.rendered), 8)
+
+            # The error is raised by the writer (even for frames rendered before it)
+            with self.assertRaises(RuntimeError):
+                pipeline.get(1)
+        finally:
+            pipeline.close()
+
+
+class RenderQueueTests(unittest.TestCase):
+    """ Unit test class for render queue files """
+
+    def test_load_queue(self):
+        with tempfile.TemporaryDirectory() as folder:
+            queue_path = os.path.join(folder, "queue.json")
+            with open(queue_path, 'w', encoding='utf-8') as queue_file:
+                json.dump({"concurrency": 2, "jobs": [
+                    {"project": "intro.osp", "preset": "MP4 (h.264)", "out": "intro.mp4"},
+                    {"project": "/projects/outro.osp", "outputs": [
+                        {"preset": "MP4 (h.264)", "out": "outro.mp4"}, {"preset": "MP3 (audio only)"}]}
+                ]}, queue_file)
+
+            concurrency, jobs = load_queue(queue_path)
+            self.assertEqual(concurrency, 2)
+            # Relative paths are relative to the queue file
+            self.assertEqual(jobs[0]["project"], os.path.join(folder, "intro.osp"))
+            self.assertEqual(jobs[0]["out"], os.path.join(folder, "intro.mp4"))
+            self.assertEqual(jobs[1]["project"], "/projects/outro.osp")
+            self.assertEqual(jobs[1]["outputs"][0]["out"], os.path.join(folder, "outro.mp4"))
+            self.assertNotIn("out", jobs[1]["outputs"][1])
+
+    def test_job_command(self):
+        job = {"project": "intro.osp", "out": "intro.mp4", "end_frame": 300, "report": True,
+               "smart_render": False, "outputs": [{"preset": "webm"}]}
+        command = job_command(job)
+        self.assertEqual(command[:2], [sys.executable, os.path.join(render.info.PATH, "launch.py")])
+        self.assertEqual(command[2:], ["--render", "intro.osp", "--end-frame", "300", "--out", "intro.mp4",
+                                       "--report", "--outputs", json.dumps([{"preset": "webm"}])])
+
+    def test_launch_command_frozen(self):
+        with tempfile.TemporaryDirectory() as folder:
+            executable = os.path.join(folder, "openshot-qt.exe")
+            with mock.patch.object(sys, "frozen", True, create=True), \
+                    mock.patch.object(sys, "executable", executable):
+                # Frozen builds start the executable itself (there is no launch.py)
+                self.assertEqual(render.get_launch_command(), [executable])
+
+                # The console launcher is preferred (if there is one)
+                cli_executable = os.path.join(folder, "openshot-qt-cli.exe")
+                open(cli_executable, 'w').close()
+                self.assertEqual(render.get_launch_command(), [cli_executable])
+
+
+class SegmentTests(unittest.TestCase):
+    """ Unit test class for segmented (multi-process) exports """
+
+    def test_split_segments(self):
+        gop_size = 10
+        segment_frames = MIN_SEGMENT_GOPS * gop_size
+        segments = split_segments(1, segment_frames * 4, gop_size, 4)
+        self.assertEqual(len(segments), 4)
+        # Segments cover the whole range (without gaps), and start on a GOP boundary
+        self.assertEqual(segments[0][0], 1)
+        self.assertEqual(segments[-1][1], segment_frames * 4)
+        for (first, last), (next_first, _) in zip(segments, segments[1:]):
+            self.assertEqual(next_first, last + 1)
+            self.assertEqual((next_first - 1) % gop_size, 0)
+
+        # Short ranges are not split into segments shorter than MIN_SEGMENT_GOPS
+        self.assertEqual(split_segments(5, 5 + segment_frames - 1, gop_size, 4), [(5, 4 + segment_frames)])
+        self.assertEqual(split_segments(1, 1, gop_size, 4), [(1, 1)])
+
+    def test_segmented_export_unsupported(self):
+        video_settings = {"has_video": True}
+        with mock.patch("classes.render_segments.get_ffmpeg_path", return_value="/usr/bin/ffmpeg"), \
+                mock.patch("classes.render_segments.get_launch_command", return_value=["openshot-qt"]):
+            self.assertIsNone(segmented_export_unsupported("/tmp/out.mp4", video_settings, {}))
+            self.assertTrue(segmented_export_unsupported("/tmp/out.mp4", {"has_video": False}, {}))
+            self.assertTrue(segmented_export_unsupported("/tmp/out-%05d.png", video_settings, {}))
+        with mock.patch("classes.render_segments.get_ffmpeg_path", return_value="/usr/bin/ffmpeg"), \
+                mock.patch("classes.render_segments.get_launch_command", return_value=None):
+            self.assertTrue(segmented_export_unsupported("/tmp/out.mp4", video_settings, {}))
+
+
+class ReportTests(unittest.TestCase):
+    """ Unit test class for export performance reports """
+
+    def create_renderer(self):
+        project_data = {"clips": [
+            {"id": "C1", "title": "intro.mp4", "layer": 1, "position": 0.0, "start": 0.0, "end": 1.0},
+            {"id": "C2", "title": "title.svg", "layer": 2, "position": 1.0, "start": 0.0, "end": 1.0,
+             "effects": [{"class_name": "Blur"}]},
+        ]}
+        video_settings = {"fps": {"num": 10, "den": 1}, "start_frame": 1, "end_frame": 20}
+        return SimpleNamespace(project_data=project_data, video_settings=video_settings, audio_settings={},
+                               export_file_path="/tmp/out.mp4", pipeline_depth=0, stats={})
+
+    def test_build_report(self):
+        # Frames of the second second (with the blurred title) are the slowest
+        frame_times = [[frame, 0.5 if frame > 10 else 0.1, 0.05] for frame in range(1, 21)]
+        report = build_report(self.create_renderer(), frame_times, 4.0, {}, 1024 * 1024)
+        self.assertEqual(report["frames"], 20)
+        self.assertAlmostEqual(report["fps"], 5.0)
+        self.assertAlmostEqual(report["render_seconds"], 6.0)
+        self.assertAlmostEqual(report["encode_seconds"], 1.0)
+        self.assertEqual(report["slowest_frames"][0]["clips"][0]["id"], "C2")
+        slowest_range = report["slowest_ranges"][0]
+        self.assertEqual((slowest_range["start_frame"], slowest_range["end_frame"]), (11, 20))
+        self.assertEqual([clip["id"] for clip in slowest_range["clips"]], ["C2"])
+
+        summary = get_report_summary(report)
+        self.assertIn("title.svg", summary[1])
+        self.assertEqual(summary[-1], "Peak memory: 1 MB")
+
+
+class SmartRenderTests(unittest.TestCase):
+    """ Unit test class for finding the pass-through ranges of a smart render """
+
+    video_settings = {"width": 1920, "height": 1080, "fps": {"num": 30, "den": 1}, "pixel_ratio": {"num": 1, "den": 1},
+                      "vcodec": "libx264", "start_frame": 1, "end_frame": 300}
+
+    def create_clip(self, clip_id, position, duration, layer=1000000, **properties):
+        clip = {"id": clip_id, "layer": layer, "position": position, "start": 0.0, "end": duration,
+                "display": 0, "scale_x": {"Points": [{"co": {"X": 1.0, "Y": 1.0}, "interpolation": 1}]},
+                "volume": {"Points": [{"co": {"X": 1.0, "Y": 0.5}, "interpolation": 1}]},
+                "has_video": {"Points": [{"co": {"X": 1.0, "Y": -1.0}, "interpolation": 1}]},
+                "time": {"Points": []},
+                "reader": {"type": "FFmpegReader", "has_video": True, "width": 1920, "height": 1080,
+                           "fps": {"num": 30, "den": 1}, "pixel_ratio": {"num": 1, "den": 1}, "vcodec": "h264",
+                           "duration": 60.0}}
+        clip.update(properties)
+        return clip
+
+    def test_subtract_ranges(self):
+        self.assertEqual(subtract_ranges(1, 100, []), [(1, 100)])
+        self.assertEqual(subtract_ranges(1, 100, [(20, 30), (50, 120)]), [(1, 19), (31, 49)])
+        self.assertEqual(subtract_ranges(1, 100, [(1, 100)]), [])
+
+    def test_is_passthrough_clip(self):
+        hidden = {"Points": [{"co": {"X": 1.0, "Y": 0.0}, "interpolation": 1}]}
+        cropped = {"Points": [{"co": {"X": 1.0, "Y": 0.5}, "interpolation": 1}]}
+        self.assertTrue(is_passthrough_clip(self.create_clip("C1", 0.0, 5.0), self.video_settings))
+        # Video hidden (i.e. Split Audio), shown as a waveform, or with frames changed by any keyframe
+        self.assertFalse(is_passthrough_clip(self.create_clip("C1", 0.0, 5.0, has_video=hidden), self.video_settings))
+        self.assertFalse(is_passthrough_clip(self.create_clip("C1", 0.0, 5.0, display=1), self.video_settings))
+        self.assertFalse(is_passthrough_clip(self.create_clip("C1", 0.0, 5.0, crop_width=cropped), self.video_settings))
+        self.assertFalse(is_passthrough_clip(self.create_clip("C1", 0.0, 5.0, unknown=cropped), self.video_settings))
+        self.assertFalse(is_passthrough_clip(self.create_clip("C1", 0.0, 5.0, time=cropped), self.video_settings))
+        self.assertFalse(is_passthrough_clip(self.create_clip("C1", 0.0, 5.0, effects=[{"type": "Blur"}]),
+                                             self.video_settings))
+
+    def test_find_passthrough_ranges(self):
+        hidden = {"Points": [{"co": {"X": 1.0, "Y": 0.0}, "interpolation": 1}]}
+        project_data = {"clips": [
+            self.create_clip("C1", 0.0, 5.0),
+            # A title over part of the first clip
+            self.create_clip("C2", 2.0, 1.0, layer=2000000, reader={"type": "QtImageReader", "has_video": True}),
+            # The audio of a clip (its video is hidden, so it does not cover the first clip)
+            self.create_clip("C3", 0.0, 10.0, layer=3000000, has_video=hidden),
+        ]}
+        ranges = [(first, last, clip["id"]) for first, last, clip in
+                  find_passthrough_ranges(project_data, self.video_settings)]
+        self.assertEqual(ranges, [(1, 60, "C1"), (91, 150, "C1")])
+
+        # Timeline effects change every frame
+        project_data["effects"] = [{"type": "Blur"}]
+        self.assertEqual(find_passthrough_ranges(project_data, self.video_settings), [])
+
+    def test_copy_segment(self):
+        renderer = SmartExportRenderer({}, "/tmp/out.mp4", dict(self.video_settings, vformat="mp4"), {})
+        copy = {"path": "/media/intro.mp4", "start": 2.0, "frames": 60}
+        with mock.patch("classes.smart_render.get_ffmpeg_path", return_value="/opt/openshot/ffmpeg"), \
+                mock.patch("classes.smart_render.subprocess.run",
+                           return_value=SimpleNamespace(returncode=0, stderr="")) as run:
+            renderer.copy_segment(copy, "/tmp/segment-0001.mp4")
+        command = run.call_args[0][0]
+        # The same ffmpeg as the rest of the export (i.e. bundled with frozen builds)
+        self.assertEqual(command[0], "/opt/openshot/ffmpeg")
+        self.assertEqual(command[-1], "/tmp/segment-0001.mp4")
+        self.assertEqual(command[command.index("-frames:v") + 1], "60")
+
+
+if __name__ == '__main__':
+    unittest.main()
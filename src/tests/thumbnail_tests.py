@@ -0,0 +1,189 @@
+"""
+ @file
+ @brief This file contains unit tests for the thumbnail service helpers
+ @author Jonathan Thomas <jonathan@openshot.org>
+
+ @section LICENSE
+
+ Copyright (c) 2008-2018 OpenShot Studios, LLC
+ (http://www.openshotstudios.com). This file is part of
+ OpenShot Video Editor (http://www.openshot.org), an open-source project
+ dedicated to delivering high quality video editing and animation solutions
+ to the world.
+
+ OpenShot Video Editor is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ OpenShot Video Editor is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with OpenShot Library.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+import sys
+import os
+import socket
+import time
+from threading import Lock, Thread
+from collections import namedtuple
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler
+
+import unittest
+
+# Import parent folder (so it can find other imports)
+PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+if PATH not in sys.path:
+    sys.path.append(PATH)
+
+from classes.thumbnail import (
+    ThumbnailWorkerPool, ThumbnailByteCache, httpThumbnailHandler, httpThumbnailServer, PRIORITY_VISIBLE,
+    PRIORITY_BACKGROUND)
+
+# The parts of os.stat() used by the thumbnail byte cache
+FakeStat = namedtuple("FakeStat", ["st_mtime_ns", "st_size"])
+
+
+class ThumbnailWorkerPoolTests(unittest.TestCase):
+    """ Unit test class for the thumbnail worker pool """
+
+    def run_queued(self, pool):
+        """Run every queued job (in queue order, on this thread)"""
+        while not pool.queue.empty():
+            _, _, job = pool.queue.get()
+            job.run()
+
+    def test_priority_order(self):
+        pool = ThumbnailWorkerPool(size=1)
+        calls = []
+        pool.submit(PRIORITY_BACKGROUND, calls.append, "background")
+        pool.submit(PRIORITY_VISIBLE, calls.append, "visible 1")
+        pool.submit(PRIORITY_VISIBLE, calls.append, "visible 2")
+        self.run_queued(pool)
+        self.assertEqual(calls, ["visible 1", "visible 2", "background"])
+
+    def test_requeue(self):
+        pool = ThumbnailWorkerPool(size=1)
+        calls = []
+        pool.submit(PRIORITY_VISIBLE, calls.append, "visible")
+        job = pool.submit(PRIORITY_BACKGROUND, calls.append, "scrolled into view")
+        pool.requeue(PRIORITY_VISIBLE - 1, job)
+        self.assertEqual(job.priority, PRIORITY_VISIBLE - 1)
+        self.run_queued(pool)
+        # Queued twice, but only run once (at the new priority)
+        self.assertEqual(calls, ["scrolled into view", "visible"])
+        self.assertTrue(job.done.is_set())
+
+    def test_cancel(self):
+        pool = ThumbnailWorkerPool(size=1)
+        calls = []
+        job = pool.submit(PRIORITY_VISIBLE, calls.append, "cancelled")
+        job.cancel()
+        self.run_queued(pool)
+        self.assertEqual(calls, [])
+        self.assertTrue(job.done.is_set())
+
+
+class ThumbnailByteCacheTests(unittest.TestCase):
+    """ Unit test class for the in-memory thumbnail byte cache """
+
+    def test_get_put(self):
+        cache = ThumbnailByteCache(max_bytes=100)
+        cache.put("a.png", FakeStat(1, 10), b"a" * 10)
+        self.assertEqual(cache.get("a.png", FakeStat(1, 10)), b"a" * 10)
+        self.assertIsNone(cache.get("b.png", FakeStat(1, 10)))
+
+    def test_changed_file(self):
+        cache = ThumbnailByteCache(max_bytes=100)
+        cache.put("a.png", FakeStat(1, 10), b"a" * 10)
+        # Modified on disk, so the cached bytes are dropped
+        self.assertIsNone(cache.get("a.png", FakeStat(2, 10)))
+        self.assertEqual(cache.total_bytes, 0)
+
+    def test_least_recently_used(self):
+        cache = ThumbnailByteCache(max_bytes=30)
+        for name in ["a", "b", "c"]:
+            cache.put(name, FakeStat(1, 10), name.encode() * 10)
+        cache.get("a", FakeStat(1, 10))
+        cache.put("d", FakeStat(1, 10), b"d" * 10)
+        self.assertEqual(list(cache.entries), ["c", "a", "d"])
+        self.assertEqual(cache.total_bytes, 30)
+
+        # Too large to cache at all
+        cache.put("e", FakeStat(1, 40), b"e" * 40)
+        self.assertNotIn("e", cache.entries)
+        self.assertEqual(cache.total_bytes, 30)
+
+
+class ConditionalRequestTests(unittest.TestCase):
+    """ Unit test class for conditional GET requests (ETag and Last-Modified) """
+
+    def create_handler(self, headers):
+        handler = httpThumbnailHandler.__new__(httpThumbnailHandler)
+        handler.headers = headers
+        return handler
+
+    def test_etag(self):
+        etag = '"5-a"'
+        self.assertTrue(self.create_handler({"If-None-Match": etag}).is_not_modified(etag, 100))
+        self.assertTrue(self.create_handler({"If-None-Match": '"1-1", %s' % etag}).is_not_modified(etag, 100))
+        self.assertTrue(self.create_handler({"If-None-Match": "*"}).is_not_modified(etag, 100))
+        self.assertFalse(self.create_handler({"If-None-Match": '"6-a"'}).is_not_modified(etag, 100))
+
+    def test_modified_since(self):
+        since = formatdate(1000, usegmt=True)
+        self.assertTrue(self.create_handler({"If-Modified-Since": since}).is_not_modified('"1"', 1000.5))
+        self.assertFalse(self.create_handler({"If-Modified-Since": since}).is_not_modified('"1"', 1001))
+        self.assertFalse(self.create_handler({"If-Modified-Since": "not a date"}).is_not_modified('"1"', 1000))
+        self.assertFalse(self.create_handler({}).is_not_modified('"1"', 1000))
+
+        # The ETag wins over the modified date
+        headers = {"If-None-Match": '"2"', "If-Modified-Since": since}
+        self.assertFalse(self.create_handler(headers).is_not_modified('"1"', 1000))
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    """ Request handler which counts the connections handled at once """
+    lock = Lock()
+    running = 0
+    most_running = 0
+    handled = 0
+
+    def handle(self):
+        with self.lock:
+            SlowHandler.running += 1
+            SlowHandler.most_running = max(SlowHandler.most_running, SlowHandler.running)
+        time.sleep(0.05)
+        with self.lock:
+            SlowHandler.running -= 1
+            SlowHandler.handled += 1
+
+
+class ThumbnailServerTests(unittest.TestCase):
+    """ Unit test class for the HTTP thumbnail server """
+
+    def test_bounded_threads(self):
+        server = httpThumbnailServer(("127.0.0.1", 0), SlowHandler, None, max_threads=2)
+        server_thread = Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+        server_thread.start()
+        try:
+            connections = [socket.create_connection(server.server_address) for _ in range(10)]
+            deadline = time.time() + 5.0
+            while SlowHandler.handled < len(connections):
+                self.assertLess(time.time(), deadline)
+                time.sleep(0.05)
+            for connection in connections:
+                connection.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(SlowHandler.most_running, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
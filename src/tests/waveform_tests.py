@@ -0,0 +1,321 @@
+"""
+ @file
+ @brief This file contains unit tests for the audio waveform helpers
+ @author Jonathan Thomas <jonathan@openshot.org>
+
+ @section LICENSE
+
+ Copyright (c) 2008-2018 OpenShot Studios, LLC
+ (http://www.openshotstudios.com). This file is part of
+ OpenShot Video Editor (http://www.openshot.org), an open-source project
+ dedicated to delivering high quality video editing and animation solutions
+ to the world.
+
+ OpenShot Video Editor is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ OpenShot Video Editor is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with OpenShot Library.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+import sys
+import os
+import base64
+import ctypes
+import struct
+
+import unittest
+from unittest import mock
+
+try:
+    # QtWebEngineWidgets must be loaded prior to creating a QApplication (the main window uses it)
+    # But on systems with only WebKit, this will fail (and we ignore the failure)
+    from PyQt5 import QtWebEngineWidgets
+    WebEngineView = QtWebEngineWidgets.QWebEngineView
+except ImportError:
+    pass
+
+# Import parent folder (so it can find other imports)
+PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+if PATH not in sys.path:
+    sys.path.append(PATH)
+
+from classes.app import OpenShotApp
+from classes import info
+
+app = None
+
+
+class FakeFrame:
+    """ Stand-in for a libopenshot frame (with the same GetAudioSample() channel rules) """
+
+    def __init__(self, channels):
+        self.channels = channels
+        self.buffers = [(ctypes.c_float * len(samples))(*samples) for samples in channels]
+
+    def GetAudioSamplesCount(self):
+        return len(self.channels[0])
+
+    def GetAudioChannelsCount(self):
+        return len(self.channels)
+
+    def GetAudioSamples(self, channel):
+        return ctypes.addressof(self.buffers[channel])
+
+    def GetAudioSample(self, channel, sample, magnitude_range):
+        # Largest magnitude in the range (of one channel, or of every channel if channel < 1)
+        channels = [self.channels[channel]] if channel > 0 else self.channels
+        return max(abs(value) for samples in channels for value in samples[sample:sample + magnitude_range])
+
+
+class WaveformTests(unittest.TestCase):
+    """ Unit test class for waveform peaks """
+
+    @classmethod
+    def setUpClass(cls):
+        from classes import waveform
+        cls.waveform = waveform
+
+    def setUp(self):
+        self.numpy = self.waveform.numpy
+
+    def tearDown(self):
+        self.waveform.numpy = self.numpy
+
+    def get_peaks(self, get_frame_peaks, frames, channel_filter, sample_divisor):
+        """Get the peaks of several frames (carrying the next starting sample between frames)"""
+        peaks = []
+        sample = 0
+        for frame in frames:
+            frame_peaks, sample = get_frame_peaks(frame, channel_filter, sample_divisor, sample)
+            peaks.extend(float(peak) for peak in frame_peaks)
+        return peaks
+
+    def test_numpy_peaks(self):
+        if not self.numpy:
+            self.skipTest("NumPy is not installed")
+        frames = [
+            FakeFrame([[0.1, -0.5, 0.2, 0.3, -0.1, 0.0, 0.4], [0.0, 0.2, -0.9, 0.1, 0.05, 0.6, 0.0]]),
+            FakeFrame([[-0.2, 0.1, 0.0], [0.3, -0.7, 0.1]]),
+            FakeFrame([[0.8], [-0.1]]),
+            FakeFrame([[0.25, 0.5, -0.75, 0.0, 0.1], [0.0, 0.0, 0.0, 0.9, 0.0]]),
+        ]
+        for channel_filter in [-1, 0, 1]:
+            for sample_divisor in [1, 2, 3, 5]:
+                expected = self.get_peaks(self.waveform.get_frame_peaks, frames, channel_filter, sample_divisor)
+                peaks = self.get_peaks(self.waveform.get_frame_peaks_numpy, frames, channel_filter, sample_divisor)
+                self.assertEqual(len(peaks), len(expected), (channel_filter, sample_divisor))
+                for peak, expected_peak in zip(peaks, expected):
+                    self.assertAlmostEqual(peak, expected_peak, places=6)
+
+    def test_apply_volume(self):
+        class FakeKeyframe:
+            """ Stand-in for a libopenshot keyframe (a volume changing every frame) """
+            calls = 0
+
+            @staticmethod
+            def GetCount():
+                return 2
+
+            @classmethod
+            def GetValue(cls, frame_number):
+                cls.calls += 1
+                return frame_number / 10
+
+        fps = 30.0
+        peaks = [0.5] * 100
+        start = 37
+        peak_frames = [int(index * fps / self.waveform.PEAKS_PER_SECOND) + 1
+                       for index in range(start, start + len(peaks))]
+        expected = [0.5 * frame_number / 10 for frame_number in peak_frames]
+        for numpy in [self.numpy, None]:
+            self.waveform.numpy = numpy
+            FakeKeyframe.calls = 0
+            volume_peaks = self.waveform.apply_volume(peaks, start, fps, FakeKeyframe)
+            self.assertEqual(len(volume_peaks), len(expected))
+            for peak, expected_peak in zip(volume_peaks, expected):
+                self.assertAlmostEqual(float(peak), expected_peak, places=6)
+            # The volume is read once per frame (not once per peak)
+            self.assertEqual(FakeKeyframe.calls, peak_frames[-1] - peak_frames[0] + 1)
+            self.assertEqual(len(self.waveform.apply_volume([], start, fps, FakeKeyframe)), 0)
+
+    def test_pyramid(self):
+        for numpy in [self.numpy, None]:
+            self.waveform.numpy = numpy
+            peaks = self.waveform.join_peaks([[0.1, 0.5], [0.2, 0.4, 0.3]])
+            pyramid = self.waveform.PeakPyramid.from_peaks(peaks, 30.0)
+            rates = [rate for rate, _, _ in pyramid.levels]
+            self.assertEqual(rates, [self.waveform.PEAKS_PER_SECOND / 2 ** level for level in range(4)])
+            _, max_values, avg_values = pyramid.levels[1]
+            self.assertEqual([round(float(value), 6) for value in max_values], [0.5, 0.4, 0.3])
+            self.assertEqual([round(float(value), 6) for value in avg_values], [0.3, 0.3, 0.3])
+            _, max_values, avg_values = pyramid.levels[-1]
+            self.assertEqual([round(float(value), 6) for value in max_values], [0.5])
+            self.assertEqual([round(float(value), 6) for value in avg_values], [0.3])
+
+    def test_pyramid_cache(self):
+        pyramid = self.waveform.PeakPyramid.from_peaks(self.waveform.join_peaks([[0.25, 0.5, 1.0]]), 24.0)
+        path = os.path.join(info.USER_PATH, "waveform-test.peaks")
+        try:
+            pyramid.save(path)
+            loaded = self.waveform.PeakPyramid.load(path)
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+        self.assertEqual(loaded.fps, 24.0)
+        self.assertEqual(len(loaded.levels), len(pyramid.levels))
+        for (rate, max_values, avg_values), (loaded_rate, loaded_max, loaded_avg) in zip(pyramid.levels, loaded.levels):
+            self.assertEqual(rate, loaded_rate)
+            self.assertEqual(list(map(float, max_values)), list(loaded_max))
+            self.assertEqual(list(map(float, avg_values)), list(loaded_avg))
+
+    def test_level_index(self):
+        pyramid = self.waveform.PeakPyramid.from_peaks(self.waveform.join_peaks([[0.5] * 64]), 30.0)
+        rates = [rate for rate, _, _ in pyramid.levels]
+        # Lowest resolution with a peak for every 2 pixels
+        self.assertEqual(rates[pyramid.level_index(40.0)], 20.0)
+        self.assertEqual(rates[pyramid.level_index(10.0)], 5.0)
+        self.assertEqual(rates[pyramid.level_index(9.0)], 5.0)
+        self.assertEqual(pyramid.level_index(0.001), len(rates) - 1)
+        self.assertEqual(pyramid.level_index(1000.0), 0)
+
+        level = pyramid.encode_level(2)
+        self.assertEqual(level["rate"], 5.0)
+        self.assertEqual(sorted(level), ["avg", "max", "rate", "scale"])
+        self.assertNotIn("avg", pyramid.encode_level(0))
+
+    def test_waveform_resent(self):
+        from windows.views.webview import TimelineWebView
+
+        class FakeTimelineView:
+            """ Stand-in for the timeline web view (recording the JavaScript it runs) """
+            Waveform_Ready = TimelineWebView.Waveform_Ready
+            send_waveform_level = TimelineWebView.send_waveform_level
+
+            def __init__(self):
+                self.waveform_pending = {"C1", "C2"}
+                self.waveform_cache = {}
+                self.waveform_levels = {}
+                self.waveform_streams = {}
+                self.redraw_audio_timer = mock.Mock()
+                self.scripts = []
+
+            def run_js(self, code):
+                self.scripts.append(code)
+
+            def get_pixels_per_second(self):
+                return 100 / 15.0
+
+        view = FakeTimelineView()
+        pyramid = self.waveform.PeakPyramid.from_peaks(self.waveform.join_peaks([[0.5] * 64]), 30.0)
+        view.Waveform_Ready("C1", pyramid, True)
+        self.assertEqual(len([code for code in view.scripts if ".setAudioData('C1'" in code]), 1)
+
+        # Requesting the waveform again (i.e. after a volume change) sends the new waveform at the same level
+        view.waveform_pending.add("C1")
+        louder = self.waveform.PeakPyramid.from_peaks(self.waveform.join_peaks([[1.0] * 64]), 30.0)
+        view.Waveform_Ready("C1", louder, True)
+        sent = [code for code in view.scripts if ".setAudioData('C1'" in code]
+        self.assertEqual(len(sent), 2)
+        self.assertNotEqual(sent[0], sent[1])
+
+    def decode_peaks(self, encoded, peak_scale):
+        """Decode base64 int16 peaks (like decodePeaks() in the timeline)"""
+        data = base64.b64decode(encoded)
+        return [value * peak_scale for value in struct.unpack("<%dh" % (len(data) // 2), data)]
+
+    def test_peak_stream(self):
+        peaks = [0.1, 0.9, 0.3, 0.2, 0.5, 0.4, 0.8, 0.6, 0.7, 0.0, 0.25]
+        pyramid = self.waveform.PeakPyramid.from_peaks(self.waveform.join_peaks([peaks]), 30.0)
+        for numpy in [self.numpy, None]:
+            self.waveform.numpy = numpy
+            for index in range(3):
+                rate, expected_max, expected_avg = pyramid.levels[index]
+                stream = self.waveform.PeakStream(index)
+                max_values = []
+                avg_values = []
+                for chunk_peaks in [peaks[:3], peaks[3:4], peaks[4:9], peaks[9:]]:
+                    chunk = stream.add(self.waveform.join_peaks([chunk_peaks]))
+                    if not chunk:
+                        continue
+                    self.assertEqual(chunk["rate"], rate)
+                    self.assertEqual(chunk["start"], len(max_values))
+                    max_values.extend(self.decode_peaks(chunk["max"], chunk["scale"]))
+                    avg_values.extend(self.decode_peaks(chunk.get("avg", chunk["max"]), chunk["scale"]))
+
+                # Only whole buckets are sent (the rest is sent with the complete pyramid)
+                self.assertEqual(len(max_values), len(peaks) // 2 ** index)
+                for value, expected in zip(max_values, expected_max):
+                    self.assertAlmostEqual(value, float(expected), places=4)
+                for value, expected in zip(avg_values, expected_avg):
+                    self.assertAlmostEqual(value, float(expected), places=4)
+
+    def test_progress(self):
+        emitted = []
+
+        class FakeApp:
+            class window:
+                class WaveformReady:
+                    @staticmethod
+                    def emit(clip_id, peaks, complete):
+                        emitted.append((clip_id, [round(float(peak), 6) for peak in peaks], complete))
+
+        get_app = self.waveform.get_app
+        self.waveform.get_app = lambda: FakeApp
+        try:
+            job = self.waveform.WaveformJob(("file", -1), "file", -1)
+            job.fps = 30.0
+            job.clips["clip 1"] = None
+            frame_peaks = [[0.1, 0.2]]
+            self.assertTrue(job.progress(frame_peaks))
+
+            # Only the peaks decoded since the last call (and everything so far for a new clip)
+            frame_peaks.extend([[0.3], [0.4, 0.5]])
+            job.clips["clip 2"] = None
+            job.last_progress = 0.0
+            self.assertTrue(job.progress(frame_peaks))
+
+            # Nothing new
+            job.last_progress = 0.0
+            self.assertTrue(job.progress(frame_peaks))
+
+            job.cancelled = True
+            self.assertFalse(job.progress(frame_peaks))
+        finally:
+            self.waveform.get_app = get_app
+
+        self.assertEqual(emitted, [
+            ("clip 1", [0.1, 0.2], False),
+            ("clip 1", [0.3, 0.4, 0.5], False),
+            ("clip 2", [0.1, 0.2, 0.3, 0.4, 0.5], False),
+        ])
+
+    def test_encode_peaks(self):
+        for numpy in [self.numpy, None]:
+            self.waveform.numpy = numpy
+            self.assertEqual(self.waveform.encode_peaks([0.0, 0.5, 1.0, 2.0], 1.0 / 32767), "AAAAQP9//38=")
+
+
+def main():
+    global app
+    info.LOG_LEVEL_CONSOLE = "ERROR"
+    try:
+        app = OpenShotApp(sys.argv, mode="unittest")
+    except Exception:
+        import logging
+        log = logging.getLogger(".")
+        log.error("Failed to instantiate OpenShotApp", exc_info=1)
+        sys.exit()
+    unittest.main()
+    app.exec_()
+
+
+if __name__ == '__main__':
+    main()
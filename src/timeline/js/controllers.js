@@ -69,6 +69,11 @@ App.controller("TimelineCtrl", function ($scope) {
   $scope.track_label = "Track %s";
   $scope.enable_sorting = true;
   $scope.ThumbServer = "http://127.0.0.1/";
+  $scope.thumb_strips = {};
+  // Clips which have been on screen (their thumbnails keep the visible priority)
+  $scope.thumb_visible_clips = {};
+  // Thumbnail scale for this display (HiDPI screens get 2x images)
+  $scope.thumb_scale = (window.devicePixelRatio || 1) > 1 ? 2 : 1;
 
   // Method to set if Qt is detected (which clears demo data
   // and updates the document_is_ready variable in openshot-qt)
@@ -317,15 +322,14 @@ App.controller("TimelineCtrl", function ($scope) {
   $scope.updateThumbnail = function (clip_id) {
     // Find matching clip, update thumbnail to same path (to force reload)
     var clip_selector = $("#clip_" + clip_id + " .thumb");
-    var existing_thumb_path = clip_selector.attr("src");
-    var thumb_url_parts = existing_thumb_path.split("?");
-    if (thumb_url_parts.length > 1) {
-      // Trim off any previous cache buster
-      existing_thumb_path = thumb_url_parts[0];
+    // Trim off any previous cache buster (but keep the other query parameters)
+    var existing_thumb_path = clip_selector.attr("src").replace(/[?&]v=[^&]*/, "");
+    if (existing_thumb_path.indexOf("?") === -1 && existing_thumb_path.indexOf("&") !== -1) {
+      existing_thumb_path = existing_thumb_path.replace("&", "?");
     }
 
     // Append cache buster, since QtWebEngine seems to aggressively cache images
-    existing_thumb_path += "?" + Math.random();
+    existing_thumb_path += (existing_thumb_path.indexOf("?") === -1 ? "?" : "&") + "v=" + Math.random();
 
     timeline.qt_log("DEBUG", existing_thumb_path);
     clip_selector.attr("src", existing_thumb_path);
@@ -338,7 +342,7 @@ App.controller("TimelineCtrl", function ($scope) {
       if ($scope.project.clips[clip_index].id === clip_id) {
         // Set audio data
         $scope.$apply(function () {
-          $scope.project.clips[clip_index].audio_data = audio_data;
+          $scope.project.clips[clip_index].audio_data = decodeAudioLevels(audio_data);
           $scope.project.clips[clip_index].show_audio = true;
         });
         timeline.qt_log("DEBUG", "Audio data successful set on clip JSON");
@@ -350,6 +354,25 @@ App.controller("TimelineCtrl", function ($scope) {
     }
   };
 
+  // Append the peaks of a waveform which is still decoding (chunk.start is the index of its first peak)
+  $scope.appendAudioData = function (clip_id, chunk) {
+    var clip = findElement($scope.project.clips, "id", clip_id);
+    if (!clip) {
+      return;
+    }
+    var level = clip.audio_data && clip.audio_data[0];
+    if (chunk.start === 0 || !level || level.rate !== chunk.rate || !Array.isArray(level.max)) {
+      // Partial levels hold plain numbers (already scaled), since each chunk has its own scale
+      level = {rate: chunk.rate, scale: 1.0, max: [], avg: []};
+    }
+    appendPeaks(level.max, chunk.start, decodePeaks(chunk.max), chunk.scale);
+    appendPeaks(level.avg, chunk.start, decodePeaks(chunk.avg || chunk.max), chunk.scale);
+    $scope.$apply(function () {
+      clip.audio_data = [level];
+      clip.show_audio = true;
+    });
+  };
+
   // Hide the audio waveform for a clip
   $scope.hideAudioData = function (clip_id) {
     // Find matching clip
@@ -460,6 +483,40 @@ App.controller("TimelineCtrl", function ($scope) {
     // Push new clip onto stack
     $scope.project.progress = cache_json;
 
+    // Draw cached ranges
+    $scope.drawCache();
+  };
+
+  // Apply added and removed cached ranges ([start, end] frame pairs)
+  $scope.renderCacheDelta = function (added, removed, reset) {
+    if (reset || !$scope.project.progress || !$scope.project.progress.ranges) {
+      $scope.project.progress = {ranges: []};
+    }
+
+    // Remove ranges which are no longer cached
+    var removed_keys = {};
+    for (var r = 0; r < removed.length; r++) {
+      removed_keys[removed[r][0] + ":" + removed[r][1]] = true;
+    }
+    var ranges = $scope.project.progress.ranges.filter(function (range) {
+      return !removed_keys[range.start + ":" + range.end];
+    });
+
+    // Add newly cached ranges
+    for (var a = 0; a < added.length; a++) {
+      ranges.push({start: added[a][0], end: added[a][1]});
+    }
+    ranges.sort(function (first, second) {
+      return first.start - second.start;
+    });
+    $scope.project.progress.ranges = ranges;
+
+    // Draw cached ranges
+    $scope.drawCache();
+  };
+
+  // Draw cached ranges on the progress canvas
+  $scope.drawCache = function () {
     //clear the canvas first
     var ruler = $("#progress");
     var ctx = ruler[0].getContext("2d");
@@ -467,7 +524,7 @@ App.controller("TimelineCtrl", function ($scope) {
 
     // Determine fps & and get cached ranges
     var fps = $scope.project.fps.num / $scope.project.fps.den;
-    var progress = $scope.project.progress.ranges;
+    var progress = $scope.project.progress.ranges || [];
 
     // Loop through each cached range of frames, and draw rect
     for (var p = 0; p < progress.length; p++) {
@@ -480,7 +537,7 @@ App.controller("TimelineCtrl", function ($scope) {
       var stop_pixel = $scope.canvasMaxWidth(stop_second * $scope.pixelsPerSecond);
       var rect_length = stop_pixel - start_pixel;
       if (rect_length < 1) {
-        break;
+        continue;
       }
       //get the element and draw the rects
       ctx.beginPath();
@@ -643,7 +700,71 @@ App.controller("TimelineCtrl", function ($scope) {
       return "../images/AudioThumbnail.svg";
     }
     var file_fps = clip["reader"]["fps"]["num"] / clip["reader"]["fps"]["den"];
-    return $scope.ThumbServer + clip.file_id + "/" + ((file_fps * clip.start) + 1) + "/";
+    // PNG (for the rounded mask), at the display scale
+    return $scope.ThumbServer + clip.file_id + "/" + ((file_fps * clip.start) + 1) + "/?scale=" + $scope.thumb_scale +
+      "&priority=" + $scope.getThumbPriority(clip);
+  };
+
+  // Queue priority of a clip's thumbnails: clips on screen (or which have been) are generated first,
+  // and scrolling an off-screen clip into view requests it again (which raises its queued priority)
+  // Values match PRIORITY_VISIBLE and PRIORITY_BACKGROUND in classes/thumbnail.py
+  $scope.getThumbPriority = function (clip) {
+    if ($scope.thumb_visible_clips[clip.id]) {
+      return 0;
+    }
+    var scrolling_tracks = document.getElementById("scrolling_tracks");
+    var view_left = scrolling_tracks ? scrolling_tracks.scrollLeft : 0;
+    var view_right = view_left + (scrolling_tracks ? scrolling_tracks.clientWidth : $scope.min_width);
+    var clip_left = clip.position * $scope.pixelsPerSecond;
+    var clip_right = clip_left + (clip.end - clip.start) * $scope.pixelsPerSecond;
+    if (clip_right < view_left || clip_left > view_right) {
+      return 10;
+    }
+    $scope.thumb_visible_clips[clip.id] = true;
+    return 0;
+  };
+
+  // Format the filmstrip tiles: http://127.0.0.1:8081/thumbnails/FILE-ID/strip/START-END/COUNT/
+  // Each tile shows the center of one frame in the sprite (empty if the clip is too narrow for a strip)
+  $scope.getThumbStrip = function (clip) {
+    var tile_width = 58;  // 98x64 sprite frames, displayed 38px high
+    var max_tiles = 64;
+    var clip_width = (clip.end - clip.start) * $scope.pixelsPerSecond;
+    var needed_tiles = Math.ceil(clip_width / tile_width);
+    if (!$scope.Qt || !clip["reader"]["has_video"] || clip["reader"]["has_single_image"] || needed_tiles < 2) {
+      return [];
+    }
+
+    // Round up to a power of 2 (so zooming only requests a new strip occasionally)
+    var count = Math.min(max_tiles, Math.pow(2, Math.ceil(Math.log(needed_tiles) / Math.LN2)));
+    var file_fps = clip["reader"]["fps"]["num"] / clip["reader"]["fps"]["den"];
+    var start_frame = Math.round(file_fps * clip.start) + 1;
+    var end_frame = Math.max(start_frame, Math.round(file_fps * clip.end));
+
+    // Re-use the same tiles until something changes (required by ng-repeat)
+    var priority = $scope.getThumbPriority(clip);
+    var key = [clip.file_id, start_frame, end_frame, count, Math.round(clip_width), priority].join(":");
+    var cached_strip = $scope.thumb_strips[clip.id];
+    if (cached_strip && cached_strip.key === key) {
+      return cached_strip.tiles;
+    }
+
+    // JPEG (photographic frames encode faster and smaller), at the display scale
+    var url = $scope.ThumbServer + clip.file_id + "/strip/" + start_frame + "-" + end_frame + "/" + count +
+      "/?format=jpg&scale=" + $scope.thumb_scale + "&priority=" + priority;
+    var display_width = Math.min(tile_width, clip_width / count);
+    var tiles = [];
+    for (var tile_index = 0; tile_index < count; tile_index++) {
+      tiles.push({
+        url: url,
+        left: tile_index * clip_width / count,
+        width: display_width,
+        offset: -(tile_index * tile_width + (tile_width - display_width) / 2),
+        size: count * tile_width
+      });
+    }
+    $scope.thumb_strips[clip.id] = {key: key, tiles: tiles};
+    return tiles;
   };
 
   // Select transition in scope
@@ -52,17 +52,59 @@ function getTrackContainerHeight() {
   return $("#track-container").height() - track_margin;
 }
 
+// Decode a base64 string of little-endian int16 peaks (sent by Python) into an Int16Array
+function decodePeaks(encoded) {
+  var bytes = atob(encoded);
+  var buffer = new ArrayBuffer(bytes.length);
+  var view = new DataView(buffer);
+  for (var i = 0; i < bytes.length; i++) {
+    view.setUint8(i, bytes.charCodeAt(i));
+  }
+  var peaks = new Int16Array(bytes.length / 2);
+  for (var j = 0; j < peaks.length; j++) {
+    peaks[j] = view.getInt16(j * 2, true);
+  }
+  return peaks;
+}
+
+// Copy decoded int16 peaks (in units of peak_scale) into a list of peaks, starting at index start
+function appendPeaks(values, start, peaks, peak_scale) {
+  for (var i = 0; i < peaks.length; i++) {
+    values[start + i] = peaks[i] * peak_scale;
+  }
+}
+
+// Decode the peaks of each waveform level (if not already decoded)
+function decodeAudioLevels(audio_data) {
+  for (var i = 0; i < audio_data.length; i++) {
+    var level = audio_data[i];
+    if (typeof level.max === "string") {
+      level.max = decodePeaks(level.max);
+    }
+    if (typeof level.avg === "string") {
+      level.avg = decodePeaks(level.avg);
+    }
+  }
+  return audio_data;
+}
+
 // Draw the audio wave on a clip
 function drawAudio(scope, clip_id) {
   //get the clip in the scope
   var clip = findElement(scope.project.clips, "id", clip_id);
 
-  if (clip.show_audio) {
+  if (clip.show_audio && clip.audio_data && clip.audio_data.length > 0) {
     var element = $("#clip_" + clip_id);
+    var block_width = 2; // 2 pixel wide blocks as smallest size
+
+    // The level of the waveform which matches the zoom (sent again by Python when the zoom changes)
+    var level = clip.audio_data[0];
+    var max_data = level.max;
+    var avg_data = level.avg || level.max;
+    var peak_scale = level.scale || 1.0;
 
     // Determine start and stop samples
-    var samples_per_second = 20;
-    var block_width = 2; // 2 pixel wide blocks as smallest size
+    var samples_per_second = level.rate;
     var start_sample = Math.round(clip.start * samples_per_second);
     var end_sample = clip.end * samples_per_second;
 
@@ -113,16 +155,18 @@ function drawAudio(scope, clip_id) {
       // Just go as far as we can, then cut off the remaining waveform
       final_sample = (usable_width * sample_divisor) - 1;
     }
+    // Partial waveforms (still decoding) end early
+    final_sample = Math.min(final_sample, max_data.length);
 
     // Go through all of the (reduced) samples
     // And whenever enough are "collected", draw a block
     for (var i = start_sample; i < final_sample; i++) {
       // Flip negative values up
-      sample = Math.abs(clip.audio_data[i]);
+      sample = Math.abs(max_data[i]) * peak_scale;
       // X-Position of *next* sample
       var x = Math.floor((i + 1 - start_sample) / sample_divisor);
 
-      avg += sample;
+      avg += Math.abs(avg_data[i]) * peak_scale;
       avg_cnt++;
       max = Math.max(max, sample);
 
@@ -24,10 +24,9 @@
  You should have received a copy of the GNU General Public License
  along with OpenShot Library.  If not, see <http://www.gnu.org/licenses/>.
  """
+import copy
 import functools
-import locale
 import os
-import time
 import tempfile
 import math
 
@@ -41,9 +40,9 @@ except ImportError:
 
 from xml.parsers.expat import ExpatError
 
-from PyQt5.QtCore import Qt, QCoreApplication, QTimer, QSize, pyqtSignal, pyqtSlot
+from PyQt5.QtCore import Qt, QObject, QThread, QTimer, QSize, pyqtSignal, pyqtSlot
 from PyQt5.QtWidgets import (
-    QMessageBox, QDialog, QFileDialog, QDialogButtonBox, QPushButton
+    QMessageBox, QDialog, QFileDialog, QDialogButtonBox, QPushButton, QLabel
 )
 from PyQt5.QtGui import QIcon
 
@@ -54,9 +53,17 @@ from classes.logger import log
 from classes.app import get_app
 from classes.metrics import track_metric_screen, track_metric_error
 from classes.query import File
+from classes.render import (
+    PRESET_QUALITIES, convert_to_bytes, get_preset_paths, get_profiles,
+    get_quality_option, load_preset, resolve_audio_codec
+)
+from classes.render_segments import create_renderer
 
 import json
 
+# Milliseconds to wait for a cancelled export to stop (before closing the dialog once it stops)
+EXPORT_CANCEL_WAIT_MS = 2000
+
 
 class Export(QDialog):
     """ Export Dialog """
@@ -88,12 +95,31 @@ class Export(QDialog):
         self.cancel_button = QPushButton(_('Cancel'))
         self.export_button = QPushButton(_('Export Video'))
         self.close_button = QPushButton(_('Done'))
+        self.pause_button = QPushButton(_('Pause'))
         self.buttonBox.addButton(self.close_button, QDialogButtonBox.RejectRole)
+        self.buttonBox.addButton(self.pause_button, QDialogButtonBox.ActionRole)
         self.buttonBox.addButton(self.export_button, QDialogButtonBox.AcceptRole)
         self.buttonBox.addButton(self.cancel_button, QDialogButtonBox.RejectRole)
         self.close_button.setVisible(False)
+        self.pause_button.setVisible(False)
+        self.pause_button.clicked.connect(self.pauseClicked)
         self.exporting = False
 
+        # Summary of the performance report (below the buttons, once an export is done)
+        self.lblReport = QLabel()
+        self.lblReport.setWordWrap(True)
+        self.lblReport.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        self.lblReport.setVisible(False)
+        self.gridLayout.addWidget(self.lblReport, 4, 0)
+
+        # Export worker (and its thread), while exporting
+        self.renderer = None
+        self.worker = None
+        self.background = None
+
+        # Cancelled, and waiting for the export to stop before closing
+        self.closing = False
+
         # Pause playback (to prevent crash since we are fixing to change the timeline's max size)
         get_app().window.actionPlay_trigger(None, force="pause")
 
@@ -197,23 +223,8 @@ class Export(QDialog):
 
         # ********* Advanced Profile List **********
         # Loop through profiles
-        self.profile_names = []
-        self.profile_paths = {}
-        for profile_folder in [info.USER_PROFILES_PATH, info.PROFILES_PATH]:
-            for file in os.listdir(profile_folder):
-                profile_path = os.path.join(profile_folder, file)
-                try:
-                    # Load Profile
-                    profile = openshot.Profile(profile_path)
-
-                    # Add description of Profile to list
-                    profile_name = "%s (%sx%s)" % (profile.info.description, profile.info.width, profile.info.height)
-                    self.profile_names.append(profile_name)
-                    self.profile_paths[profile_name] = profile_path
-
-                except RuntimeError as e:
-                    # This exception occurs when there's a problem parsing the Profile file - display a message and continue
-                    log.error("Failed to parse file '%s' as a profile: %s" % (profile_path, e))
+        self.profile_paths = get_profiles()
+        self.profile_names = list(self.profile_paths)
 
         # Sort list
         self.profile_names.sort()
@@ -458,86 +469,48 @@ class Export(QDialog):
             self.cboSimpleQuality.clear()
 
             # parse the xml to return suggested profiles
-            profile_index = 0
             all_profiles = False
-            for preset_folder in [info.EXPORT_PRESETS_PATH, info.USER_PRESETS_PATH]:
-                for file in os.listdir(preset_folder):
-                    preset_path = os.path.join(preset_folder, file)
-                    try:
-                        xmldoc = xml.parse(preset_path)
-                        title = xmldoc.getElementsByTagName("title")
-                        if _(title[0].childNodes[0].data) == selected_target:
-                            profiles = xmldoc.getElementsByTagName("projectprofile")
-
-                            # get the basic profile
-                            all_profiles = False
-                            if profiles:
-                                # if profiles are defined, show them
-                                for profile in profiles:
-                                    profiles_list.append(_(profile.childNodes[0].data))
-                            else:
-                                # show all profiles
-                                all_profiles = True
-                                for profile_name in self.profile_names:
-                                    profiles_list.append(profile_name)
-
-                            # get the video bit rate(s)
-                            videobitrate = xmldoc.getElementsByTagName("videobitrate")
-                            for rate in videobitrate:
-                                v_l = rate.attributes["low"].value
-                                v_m = rate.attributes["med"].value
-                                v_h = rate.attributes["high"].value
-                                self.vbr = {_("Low"): v_l, _("Med"): v_m, _("High"): v_h}
-
-                            # get the audio bit rates
-                            audiobitrate = xmldoc.getElementsByTagName("audiobitrate")
-                            for audiorate in audiobitrate:
-                                a_l = audiorate.attributes["low"].value
-                                a_m = audiorate.attributes["med"].value
-                                a_h = audiorate.attributes["high"].value
-                                self.abr = {_("Low"): a_l, _("Med"): a_m, _("High"): a_h}
-
-                            # get the remaining values
-                            vf = xmldoc.getElementsByTagName("videoformat")
-                            self.txtVideoFormat.setText(vf[0].childNodes[0].data)
-                            vc = xmldoc.getElementsByTagName("videocodec")
-                            self.txtVideoCodec.setText(vc[0].childNodes[0].data)
-                            sr = xmldoc.getElementsByTagName("samplerate")
-                            self.txtSampleRate.setValue(int(sr[0].childNodes[0].data))
-                            c = xmldoc.getElementsByTagName("audiochannels")
-                            self.txtChannels.setValue(int(c[0].childNodes[0].data))
-                            c = xmldoc.getElementsByTagName("audiochannellayout")
-
-                            # check for compatible audio codec
-                            ac = xmldoc.getElementsByTagName("audiocodec")
-                            audio_codec_name = ac[0].childNodes[0].data
-                            if audio_codec_name == "aac":
-                                # Determine which version of AAC encoder is available
-                                if openshot.FFmpegWriter.IsValidCodec("libfaac"):
-                                    self.txtAudioCodec.setText("libfaac")
-                                elif openshot.FFmpegWriter.IsValidCodec("libvo_aacenc"):
-                                    self.txtAudioCodec.setText("libvo_aacenc")
-                                elif openshot.FFmpegWriter.IsValidCodec("aac"):
-                                    self.txtAudioCodec.setText("aac")
-                                else:
-                                    # fallback audio codec
-                                    self.txtAudioCodec.setText("ac3")
-                            else:
-                                # fallback audio codec
-
-                                self.txtAudioCodec.setText(audio_codec_name)
-
-                            for layout_index, layout in enumerate(self.channel_layout_choices):
-                                if layout == int(c[0].childNodes[0].data):
-                                    self.cboChannelLayout.setCurrentIndex(layout_index)
-                                    break
-
-                        # Free up DOM memory
-                        xmldoc.unlink()
-
-                    except ExpatError as e:
-                        # This indicates an invalid Preset file - display an error and continue
-                        log.error("Failed to parse file '%s' as a preset: %s" % (preset_path, e))
+            v_l = v_m = v_h = a_l = a_m = a_h = ""
+            for preset_path in get_preset_paths():
+                try:
+                    preset = load_preset(preset_path)
+                except (ExpatError, ValueError) as e:
+                    # This indicates an invalid Preset file - display an error and continue
+                    log.error("Failed to parse file '%s' as a preset: %s" % (preset_path, e))
+                    continue
+
+                if _(preset["title"]) == selected_target:
+                    # get the basic profile
+                    all_profiles = False
+                    if preset["projectprofiles"]:
+                        # if profiles are defined, show them
+                        for profile in preset["projectprofiles"]:
+                            profiles_list.append(_(profile))
+                    else:
+                        # show all profiles
+                        all_profiles = True
+                        for profile_name in self.profile_names:
+                            profiles_list.append(profile_name)
+
+                    # get the video and audio bit rate(s)
+                    v_l, v_m, v_h = [preset["videobitrate"][quality] for quality in PRESET_QUALITIES]
+                    self.vbr = {_("Low"): v_l, _("Med"): v_m, _("High"): v_h}
+                    a_l, a_m, a_h = [preset["audiobitrate"][quality] for quality in PRESET_QUALITIES]
+                    self.abr = {_("Low"): a_l, _("Med"): a_m, _("High"): a_h}
+
+                    # get the remaining values
+                    self.txtVideoFormat.setText(preset["videoformat"])
+                    self.txtVideoCodec.setText(preset["videocodec"])
+                    self.txtSampleRate.setValue(preset["samplerate"])
+                    self.txtChannels.setValue(preset["audiochannels"])
+
+                    # check for compatible audio codec
+                    self.txtAudioCodec.setText(resolve_audio_codec(preset["audiocodec"]))
+
+                    for layout_index, layout in enumerate(self.channel_layout_choices):
+                        if layout == preset["audiochannellayout"]:
+                            self.cboChannelLayout.setCurrentIndex(layout_index)
+                            break
 
             # init the profiles combo
             for item in sorted(profiles_list):
@@ -604,50 +577,7 @@ class Export(QDialog):
             self.txtExportFolder.setText(file_path)
 
     def convert_to_bytes(self, BitRateString):
-        bit_rate_bytes = 0
-
-        # split the string into pieces
-        s = BitRateString.lower().split(" ")
-        measurement = "kb"
-
-        try:
-            # Get Bit Rate
-            if len(s) >= 2:
-                raw_number_string = s[0]
-                raw_measurement = s[1]
-
-                # convert string number to float (based on locale settings)
-                raw_number = locale.atof(raw_number_string)
-
-                if "kb" in raw_measurement:
-                    # Kbit to bytes
-                    bit_rate_bytes = raw_number * 1000.0
-
-                elif "mb" in raw_measurement:
-                    # Mbit to bytes
-                    bit_rate_bytes = raw_number * 1000.0 * 1000.0
-
-                elif ("crf" in raw_measurement) or ("cqp" in raw_measurement):
-                    # Just a number
-                    if raw_number > 63:
-                        raw_number = 63
-                    if raw_number < 0:
-                        raw_number = 0
-                    bit_rate_bytes = raw_number
-
-                elif "qp" in raw_measurement:
-                    # Just a number
-                    if raw_number > 255:
-                        raw_number = 255
-                    if raw_number < 0:
-                        raw_number = 0
-                    bit_rate_bytes = raw_number
-
-        except:
-            log.warning('Failed to convert bitrate string to bytes: %s' % BitRateString)
-
-        # return the bit rate in bytes
-        return str(int(bit_rate_bytes))
+        return convert_to_bytes(BitRateString)
 
     def disableControls(self):
         """Disable all controls"""
@@ -669,25 +599,48 @@ class Export(QDialog):
         self.export_button.setEnabled(True)
         self.btnBrowse.setEnabled(True)
 
+    def titlestring(self, sec, fps, mess):
+        """Build the export window title"""
+        _ = get_app()._tr
+        formatstr = "%(hours)d:%(minutes)02d:%(seconds)02d " + mess + " (%(fps)5.2f FPS)"
+        title_mes = _(formatstr) % {
+            'hours': sec / 3600,
+            'minutes': (sec / 60) % 60,
+            'seconds': sec % 60,
+            'fps': fps}
+        return title_mes
+
+    def reportSummary(self, report):
+        """Build a summary of an export performance report"""
+        _ = get_app()._tr
+        lines = [_("Rendering: %(render).1f seconds, encoding: %(encode).1f seconds") % {
+            "render": report.get("render_seconds"), "encode": report.get("encode_seconds")}]
+        for slow_range in report.get("slowest_ranges", [])[:3]:
+            clips = ", ".join(
+                "%s (%s)" % (clip["title"], ", ".join(clip["effects"])) if clip["effects"] else clip["title"]
+                for clip in slow_range.get("clips", [])[:3])
+            lines.append(_("Slow: frames %(start)s-%(end)s took %(seconds).1f seconds: %(clips)s") % {
+                "start": slow_range.get("start_frame"), "end": slow_range.get("end_frame"),
+                "seconds": slow_range.get("seconds"), "clips": clips or _("No clips")})
+        if report.get("peak_memory_bytes"):
+            lines.append(_("Peak memory: %.0f MB") % (report.get("peak_memory_bytes") / 1024 / 1024))
+        lines.append(_("Report saved: %s") % self.renderer.report_path)
+        return "\n".join(lines)
+
     def accept(self):
         """ Start exporting video """
 
-        # Build the export window title
-        def titlestring(sec, fps, mess):
-            formatstr = "%(hours)d:%(minutes)02d:%(seconds)02d " + mess + " (%(fps)5.2f FPS)"
-            title_mes = _(formatstr) % {
-                'hours': sec / 3600,
-                'minutes': (sec / 60) % 60,
-                'seconds': sec % 60,
-                'fps': fps}
-            return title_mes
-
         # get translations
         _ = get_app()._tr
 
         # Init some variables
-        seconds_run = 0
-        fps_encode = 0
+        self.seconds_run = 0
+        self.fps_encode = 0
+        self.max_frame = 0
+        self.title_message = ""
+        self.last_displayed_exported_portion = 0.0
+        # Precision of the progress bar
+        self.format_of_progress_string = "%4.1f%% "
 
         # Init progress bar
         self.progressExportVideo.setMinimum(self.txtStartFrame.value())
@@ -764,20 +717,23 @@ class Export(QDialog):
 
         # Init export settings
         interlacedIndex = self.cboInterlaced.currentIndex()
-        video_settings = {  "vformat": self.txtVideoFormat.text(),
+        video_settings = {  "has_video": export_type in [_("Video & Audio"), _("Video Only"), _("Image Sequence")],
+                            "vformat": self.txtVideoFormat.text(),
                             "vcodec": self.txtVideoCodec.text(),
                             "fps": { "num" : self.txtFrameRateNum.value(), "den": self.txtFrameRateDen.value()},
                             "width": self.txtWidth.value(),
                             "height": self.txtHeight.value(),
                             "pixel_ratio": {"num": self.txtPixelRatioNum.value(), "den": self.txtPixelRatioDen.value()},
                             "video_bitrate": int(self.convert_to_bytes(self.txtVideoBitRate.text())),
+                            "quality_option": get_quality_option(self.txtVideoBitRate.text()),
                             "start_frame": self.txtStartFrame.value(),
                             "end_frame": self.txtEndFrame.value(),
                             "interlace": interlacedIndex in [1, 2],
                             "topfirst": interlacedIndex == 1
                           }
 
-        audio_settings = {"acodec": self.txtAudioCodec.text(),
+        audio_settings = {"has_audio": export_type in [_("Video & Audio"), _("Audio Only")],
+                          "acodec": self.txtAudioCodec.text(),
                           "sample_rate": self.txtSampleRate.value(),
                           "channels": self.txtChannels.value(),
                           "channel_layout": self.cboChannelLayout.currentData(),
@@ -798,164 +754,112 @@ class Export(QDialog):
         # Mark project file as unsaved
         get_app().project.has_unsaved_changes = True
 
-        # Set MaxSize (so we don't have any downsampling)
-        self.timeline.SetMaxSize(video_settings.get("width"), video_settings.get("height"))
-
-        # Set lossless cache settings (temporarily)
-        export_cache_object = openshot.CacheMemory(500)
-        self.timeline.SetCache(export_cache_object)
-
         # Rescale all keyframes (if needed)
         if self.export_fps_factor != 1.0:
             # Get a copy of rescaled project data (this does not modify the active project)
-            rescaled_app_data = get_app().project.rescale_keyframes(self.export_fps_factor)
+            project_data = get_app().project.rescale_keyframes(self.export_fps_factor)
+        else:
+            # Get a copy of the project data (so the export is not affected by later edits)
+            project_data = copy.deepcopy(get_app().project._data)
 
-            # Load the "export" Timeline reader with the JSON from the real timeline
-            self.timeline.SetJson(json.dumps(rescaled_app_data))
+        # Copy properties of the project timeline
+        project_timeline = get_app().window.timeline_sync.timeline
+        timeline_info = {
+            "has_audio": project_timeline.info.has_audio,
+            "has_video": project_timeline.info.has_video,
+            "video_length": project_timeline.info.video_length,
+            "duration": project_timeline.info.duration,
+        }
+
+        self.export_file_path = export_file_path
+        self.video_settings = video_settings
+        self.audio_settings = audio_settings
+
+        # Background Worker Thread (which owns its own "export" Timeline, or runs the segment processes)
+        export_processes = int(self.s.get("export_processes") or 1)
+        pipeline_depth = int(self.s.get("export_pipeline_depth") or 0)
+        self.renderer = create_renderer(project_data, export_file_path, video_settings, audio_settings,
+                                        timeline_info, export_processes, pipeline_depth,
+                                        bool(self.s.get("export_report")),
+                                        bool(self.s.get("export_smart_render")),
+                                        int(self.s.get("export-cache-limit-mb") or 0))
+        self.lblReport.setVisible(False)
+        self.background = QThread(self)
+        self.background.setObjectName("openshot_export")
+        self.worker = ExportWorker(self.renderer)  # no parent!
+        self.worker.moveToThread(self.background)
+
+        # Hook up signals to/from Background Worker
+        self.background.started.connect(self.worker.Render)
+        self.worker.progress.connect(self.exportProgress)
+        self.worker.finished.connect(self.exportFinished)
+        self.worker.finished.connect(self.background.quit, Qt.DirectConnection)
+        self.background.finished.connect(self.worker.deleteLater)
+
+        # Show pause button
+        self.pause_button.setText(_("Pause"))
+        self.pause_button.setVisible(True)
 
-            # Re-update the timeline FPS again (since the timeline just got clobbered)
-            self.updateFrameRate()
+        # Notify window of export started
+        self.ExportStarted.emit(export_file_path, video_settings.get("start_frame"), video_settings.get("end_frame"))
 
-        # Apply mappers to timeline readers
-        self.timeline.ApplyMapperToClips()
+        # Run worker in background thread
+        self.background.start()
 
-        # Create FFmpegWriter
-        try:
-            w = openshot.FFmpegWriter(export_file_path)
-
-            # Set video options
-            if export_type in [_("Video & Audio"), _("Video Only"), _("Image Sequence")]:
-                w.SetVideoOptions(True,
-                                  video_settings.get("vcodec"),
-                                  openshot.Fraction(video_settings.get("fps").get("num"),
-                                                    video_settings.get("fps").get("den")),
-                                  video_settings.get("width"),
-                                  video_settings.get("height"),
-                                  openshot.Fraction(video_settings.get("pixel_ratio").get("num"),
-                                                    video_settings.get("pixel_ratio").get("den")),
-                                  video_settings.get("interlace"),
-                                  video_settings.get("topfirst"),
-                                  video_settings.get("video_bitrate"))
-
-            # Set audio options
-            if export_type in [_("Video & Audio"), _("Audio Only")]:
-                w.SetAudioOptions(True,
-                                  audio_settings.get("acodec"),
-                                  audio_settings.get("sample_rate"),
-                                  audio_settings.get("channels"),
-                                  audio_settings.get("channel_layout"),
-                                  audio_settings.get("audio_bitrate"))
-
-            # Prepare the streams
-            w.PrepareStreams()
-
-            # These extra options should be set in an extra method
-            # No feedback is given to the user
-            # TODO: Tell user if option is not available
-            if export_type in [_("Audio Only")]:
-                # Muxing options for mp4/mov
-                w.SetOption(openshot.AUDIO_STREAM, "muxing_preset", "mp4_faststart")
-            else:
-                # Muxing options for mp4/mov
-                w.SetOption(openshot.VIDEO_STREAM, "muxing_preset", "mp4_faststart")
-                # Set the quality in case crf, cqp or qp was selected
-                if "crf" in self.txtVideoBitRate.text():
-                    w.SetOption(openshot.VIDEO_STREAM, "crf", str(int(video_settings.get("video_bitrate"))) )
-                elif "cqp" in self.txtVideoBitRate.text():
-                    w.SetOption(openshot.VIDEO_STREAM, "cqp", str(int(video_settings.get("video_bitrate"))) )
-                elif "qp" in self.txtVideoBitRate.text():
-                    w.SetOption(openshot.VIDEO_STREAM, "qp", str(int(video_settings.get("video_bitrate"))) )
-
-
-            # Open the writer
-            w.Open()
-
-            # Notify window of export started
-            title_message = ""
-            self.ExportStarted.emit(export_file_path, video_settings.get("start_frame"), video_settings.get("end_frame"))
-
-            progressstep = max(1 , round(( video_settings.get("end_frame") - video_settings.get("start_frame") ) / 1000))
-            start_time_export = time.time()
-            start_frame_export = video_settings.get("start_frame")
-            end_frame_export = video_settings.get("end_frame")
-            last_exported_time = time.time()
-            last_displayed_exported_portion = 0.0
-            current_exported_portion = 0.0
+    @pyqtSlot(int, float)
+    def exportProgress(self, frame, seconds_elapsed):
+        """Update the progress bar and title (with remaining time) while exporting"""
+        _ = get_app()._tr
+        start_frame_export = self.video_settings.get("start_frame")
+        end_frame_export = self.video_settings.get("end_frame")
+
+        current_exported_portion = (frame - start_frame_export) * 1.0 / (end_frame_export - start_frame_export)
+        if ((current_exported_portion - self.last_displayed_exported_portion) > 0.0):
+            # the log10 of the difference of the fraction of the completed frames is the negativ
+            # number of digits after the decimal point after which the first digit is not 0
+            digits_after_decimalpoint = math.ceil( -2.0 - math.log10( current_exported_portion - self.last_displayed_exported_portion ))
+        else:
             digits_after_decimalpoint = 1
-            # Precision of the progress bar
-            format_of_progress_string = "%4.1f%% "
-
-            # Write each frame in the selected range
-            max_frame = 0
-            for frame in range(video_settings.get("start_frame"), video_settings.get("end_frame") + 1):
-                # Update progress bar (emit signal to main window)
-                end_time_export = time.time()
-                if ((frame % progressstep) == 0) or ((end_time_export - last_exported_time) > 1):
-                    current_exported_portion = (frame - start_frame_export) * 1.0  / (end_frame_export - start_frame_export)
-                    if ((current_exported_portion - last_displayed_exported_portion) > 0.0):
-                        # the log10 of the difference of the fraction of the completed frames is the negativ
-                        # number of digits after the decimal point after which the first digit is not 0
-                        digits_after_decimalpoint = math.ceil( -2.0 - math.log10( current_exported_portion - last_displayed_exported_portion ))
-                    else:
-                        digits_after_decimalpoint = 1
-                    if digits_after_decimalpoint < 1:
-                        # We want at least 1 digit after the decimal point
-                        digits_after_decimalpoint = 1
-                    if digits_after_decimalpoint > 5:
-                        # We don't want not more than 5 difits after the decimal point
-                        digits_after_decimalpoint = 5
-                    last_displayed_exported_portion = current_exported_portion
-                    format_of_progress_string = "%4." + str(digits_after_decimalpoint) + "f%% "
-                    last_exported_time = time.time()
-                    if ((( frame - start_frame_export ) != 0) & (( end_time_export - start_time_export ) != 0)):
-                        seconds_left = round(( start_time_export - end_time_export )*( frame - end_frame_export )/( frame - start_frame_export ))
-                        fps_encode = ((frame - start_frame_export)/(end_time_export-start_time_export))
-                        if frame == end_frame_export:
-                            title_message = _("Finalizing video export, please wait...")
-                        else:
-                            title_message = titlestring(seconds_left, fps_encode, "Remaining")
-
-                    # Emit frame exported
-                    self.ExportFrame.emit(
-                        title_message,
-                        video_settings.get("start_frame"),
-                        video_settings.get("end_frame"),
-                        frame,
-                        format_of_progress_string
-                    )
-
-                    # track largest frame processed
-                    max_frame = frame
-
-                    # Process events (to show the progress bar moving)
-                    QCoreApplication.processEvents()
-
-                # Write the frame object to the video
-                w.WriteFrame(self.timeline.GetFrame(frame))
-
-                # Check if we need to bail out
-                if not self.exporting:
-                    break
-
-            # Close writer
-            w.Close()
-
-            # Emit final exported frame (with elapsed time)
-            seconds_run = round((end_time_export - start_time_export))
-            title_message = titlestring(seconds_run, fps_encode, "Elapsed")
-
-            self.ExportFrame.emit(
-                title_message,
-                video_settings.get("start_frame"),
-                video_settings.get("end_frame"),
-                max_frame,
-                format_of_progress_string
-            )
-
-        except Exception as e:
+        if digits_after_decimalpoint < 1:
+            # We want at least 1 digit after the decimal point
+            digits_after_decimalpoint = 1
+        if digits_after_decimalpoint > 5:
+            # We don't want not more than 5 difits after the decimal point
+            digits_after_decimalpoint = 5
+        self.last_displayed_exported_portion = current_exported_portion
+        self.format_of_progress_string = "%4." + str(digits_after_decimalpoint) + "f%% "
+        if ((( frame - start_frame_export ) != 0) & ( seconds_elapsed != 0)):
+            seconds_left = round(seconds_elapsed * ( end_frame_export - frame ) / ( frame - start_frame_export ))
+            self.fps_encode = ((frame - start_frame_export) / seconds_elapsed)
+            if frame == end_frame_export:
+                self.title_message = _("Finalizing video export, please wait...")
+            else:
+                self.title_message = self.titlestring(seconds_left, self.fps_encode, "Remaining")
+        self.seconds_run = round(seconds_elapsed)
+
+        # Emit frame exported
+        self.ExportFrame.emit(
+            self.title_message,
+            start_frame_export,
+            end_frame_export,
+            frame,
+            self.format_of_progress_string
+        )
+
+        # track largest frame processed
+        self.max_frame = frame
+
+    @pyqtSlot(str)
+    def exportFinished(self, error_type_str):
+        """Show the result of an export (or its error), once the worker is done"""
+        _ = get_app()._tr
+        video_settings = self.video_settings
+        audio_settings = self.audio_settings
+        self.pause_button.setVisible(False)
+
+        if error_type_str:
             # TODO: Find a better way to catch the error. This is the only way I have found that
             # does not throw an error
-            error_type_str = str(e)
             log.info("Error type string: %s" % error_type_str)
 
             if "InvalidChannels" in error_type_str:
@@ -981,14 +885,15 @@ class Export(QDialog):
             # Show friendly error
             friendly_error = error_type_str.split("> ")[0].replace("<", "")
 
-            # Prompt error message
-            msg = QMessageBox()
-            msg.setWindowTitle(_("Export Error"))
-            msg.setText(_("Sorry, there was an error exporting your video: \n%s") % friendly_error)
-            msg.exec_()
+            # Prompt error message (unless the export was cancelled)
+            if self.exporting:
+                msg = QMessageBox()
+                msg.setWindowTitle(_("Export Error"))
+                msg.setText(_("Sorry, there was an error exporting your video: \n%s") % friendly_error)
+                msg.exec_()
 
-        # Notify window of export started
-        self.ExportEnded.emit(export_file_path)
+        # Notify window of export ended
+        self.ExportEnded.emit(self.export_file_path)
 
         # Close timeline object
         self.timeline.Close()
@@ -999,8 +904,33 @@ class Export(QDialog):
         # Return scale mode to lower quality scaling (for faster previews)
         openshot.Settings.Instance().HIGH_QUALITY_SCALING = False
 
+        if self.closing:
+            # Export was cancelled, and has now stopped (so close the dialog)
+            self.closing = False
+            super(Export, self).reject()
+            return
+
+        if not self.exporting:
+            # Export was cancelled (and the dialog rejected)
+            return
+
+        # Restore windows title to show elapsed time
+        self.title_message = self.titlestring(self.seconds_run, self.fps_encode, "Elapsed")
+        self.ExportFrame.emit(
+            self.title_message,
+            video_settings.get("start_frame"),
+            video_settings.get("end_frame"),
+            self.max_frame,
+            self.format_of_progress_string
+        )
+
+        # Show a summary of the performance report (if any)
+        if self.renderer.report:
+            self.lblReport.setText(self.reportSummary(self.renderer.report))
+            self.lblReport.setVisible(True)
+
         # Handle end of export (for non-canceled exports)
-        if self.s.get("show_finished_window") and self.exporting:
+        if self.s.get("show_finished_window"):
             # Hide cancel and export buttons
             self.cancel_button.setVisible(False)
             self.export_button.setVisible(False)
@@ -1008,17 +938,6 @@ class Export(QDialog):
             # Reveal done button
             self.close_button.setVisible(True)
 
-            # Restore windows title to show elapsed time
-            title_message = titlestring(seconds_run, fps_encode, "Elapsed")
-
-            self.ExportFrame.emit(
-                title_message,
-                video_settings.get("start_frame"),
-                video_settings.get("end_frame"),
-                frame,
-                format_of_progress_string
-            )
-
             # Make progress bar green (to indicate we are done)
             from PyQt5.QtGui import QPalette
             p = QPalette()
@@ -1031,7 +950,23 @@ class Export(QDialog):
             # Accept dialog
             super(Export, self).accept()
 
+    def pauseClicked(self):
+        """Pause (or resume) the export"""
+        _ = get_app()._tr
+        if self.renderer.resumed.is_set():
+            self.renderer.pause()
+            self.pause_button.setText(_("Resume"))
+            self.setWindowTitle(_("Export Paused"))
+        else:
+            self.renderer.resume()
+            self.pause_button.setText(_("Pause"))
+            self.setWindowTitle("%s %s" % (self.format_of_progress_string % (self.last_displayed_exported_portion * 100), self.title_message))
+
     def reject(self):
+        if self.closing:
+            # Already cancelled (waiting for the export to stop)
+            return
+
         if self.exporting and not self.close_button.isVisible():
             # Show confirmation dialog
             _ = get_app()._tr
@@ -1049,4 +984,40 @@ class Export(QDialog):
 
         # Cancel dialog
         self.exporting = False
+
+        # Stop the export (and wait a little for the worker to close the file)
+        if self.background and self.background.isRunning():
+            self.renderer.cancel()
+            if not self.background.wait(EXPORT_CANCEL_WAIT_MS):
+                # Still stopping (i.e. a frame or ffmpeg is slow to finish), so close once the worker
+                # is finished (see exportFinished), without blocking the interface
+                _ = get_app()._tr
+                log.info("Waiting for the cancelled export to stop")
+                self.closing = True
+                self.setWindowTitle(_("Cancelling Export..."))
+                self.buttonBox.setEnabled(False)
+                return
+
         super(Export, self).reject()
+
+
+class ExportWorker(QObject):
+    """ Background Worker Object (to export video on a separate thread) """
+
+    progress = pyqtSignal(int, float)
+    finished = pyqtSignal(str)
+
+    def __init__(self, renderer):
+        super().__init__()
+        self.renderer = renderer
+
+    @pyqtSlot()
+    def Render(self):
+        """Export all frames (and emit the error, if any)"""
+        error_type_str = ""
+        try:
+            self.renderer.render(self.progress.emit)
+        except Exception as ex:
+            log.warning("Export failed: %s", ex)
+            error_type_str = str(ex)
+        self.finished.emit(error_type_str)
@@ -57,10 +57,12 @@ from classes.importers.final_cut_pro import import_xml
 from classes.logger import log
 from classes.metrics import track_metric_session, track_metric_screen
 from classes.query import Clip, Transition, Marker, Track, Effect
-from classes.thumbnail import httpThumbnailServerThread
+from classes.thumbnail import httpThumbnailServerThread, ThumbnailService
+from classes.tiered_cache import TieredCache
 from classes.time_parts import secondsToTimecode
 from classes.timeline import TimelineSync
 from classes.version import get_current_Version
+from classes.waveform import WaveformScheduler
 from windows.models.effects_model import EffectsModel
 from windows.models.emoji_model import EmojisModel
 from windows.models.files_model import FilesModel
@@ -98,11 +100,12 @@ class MainWindow(updates.UpdateWatcher, QMainWindow):
     SpeedSignal = pyqtSignal(float)
     RecoverBackup = pyqtSignal()
     FoundVersionSignal = pyqtSignal(str)
-    WaveformReady = pyqtSignal(str, list)
+    WaveformReady = pyqtSignal(str, object, bool)
     TransformSignal = pyqtSignal(str)
     KeyFrameTransformSignal = pyqtSignal(str, str)
     SelectRegionSignal = pyqtSignal(str)
     MaxSizeChanged = pyqtSignal(object)
+    CacheChanged = pyqtSignal()          # Signal when cached frames were moved or cleared outside of playback
     InsertKeyframe = pyqtSignal(object)
     OpenProjectSignal = pyqtSignal(str)
     ThumbnailUpdated = pyqtSignal(str)
@@ -166,8 +169,13 @@ class MainWindow(updates.UpdateWatcher, QMainWindow):
         # Stop threads
         self.StopSignal.emit()
 
-        # Stop thumbnail server thread
-        self.http_server_thread.kill()
+        # Stop thumbnail server thread (if any) and thumbnail workers
+        if self.http_server_thread:
+            self.http_server_thread.kill()
+        self.thumbnail_service.close()
+
+        # Cancel any waveforms being decoded
+        self.waveform_scheduler.close()
 
         # Stop ZMQ polling thread
         get_app().logger_libopenshot.kill()
@@ -181,6 +189,10 @@ class MainWindow(updates.UpdateWatcher, QMainWindow):
         self.preview_parent.background.exit()
         self.preview_parent.background.wait(5000)
 
+        # Stop tiered cache balancing
+        if isinstance(self.cache_object, TieredCache):
+            self.cache_object.close()
+
         # Close Timeline
         if self.timeline_sync and self.timeline_sync.timeline:
             self.timeline_sync.timeline.Close()
@@ -504,6 +516,7 @@ class MainWindow(updates.UpdateWatcher, QMainWindow):
             clear_path = os.path.join(info.USER_PATH, "thumbnail")
             if os.path.exists(clear_path):
                 log.info("Clear all thumbnails: %s", clear_path)
+                self.thumbnail_service.close_store()
                 shutil.rmtree(clear_path)
                 os.mkdir(clear_path)
 
@@ -952,6 +965,10 @@ class MainWindow(updates.UpdateWatcher, QMainWindow):
         # Notify preview thread
         self.timeline.movePlayhead(position_frames)
 
+        # Notify tiered cache (frames near the playhead are kept in memory)
+        if isinstance(self.cache_object, TieredCache):
+            self.cache_object.set_playhead(position_frames)
+
     def SetPlayheadFollow(self, enable_follow):
         """ Enable / Disable follow mode """
         self.timeline.SetPlayheadFollow(enable_follow)
@@ -1066,7 +1083,10 @@ class MainWindow(updates.UpdateWatcher, QMainWindow):
         viewport_rect = self.videoPreview.centeredViewport(self.videoPreview.width(), self.videoPreview.height())
         self.timeline_sync.timeline.SetMaxSize(viewport_rect.width(), viewport_rect.height())
         self.cache_object.Clear()
-        self.timeline_sync.timeline.SetCache(old_cache_object)
+        if isinstance(old_cache_object, TieredCache):
+            old_cache_object.attach(self.timeline_sync.timeline)
+        else:
+            self.timeline_sync.timeline.SetCache(old_cache_object)
         self.cache_object = old_cache_object
         old_cache_object = None
         new_cache_object = None
@@ -2735,11 +2755,30 @@ class MainWindow(updates.UpdateWatcher, QMainWindow):
                 )
             self.timeline_sync.timeline.SetCache(new_cache_object)
 
+        elif s.get("cache-mode") == "CacheTiered":
+            # Create TieredCache object (memory tier is set on timeline, disk tier receives spilled frames)
+            disk_cache_limit = s.get("cache-disk-limit-mb") * 1024 * 1024  # Convert MB to Bytes
+            log.info("Creating TieredCache object with %s byte memory limit and %s byte disk limit at %s" % (
+                cache_limit, disk_cache_limit, info.PREVIEW_CACHE_PATH))
+            new_cache_object = TieredCache(
+                self,
+                cache_limit,
+                info.PREVIEW_CACHE_PATH,
+                s.get("cache-image-format"),
+                s.get("cache-quality"),
+                s.get("cache-scale"),
+                disk_cache_limit,
+                )
+            new_cache_object.attach(self.timeline_sync.timeline)
+
         # Clear old cache before it goes out of scope
-        if self.cache_object:
+        if isinstance(self.cache_object, TieredCache):
+            self.cache_object.close()
+        elif self.cache_object:
             self.cache_object.Clear()
         # Update cache reference, so it doesn't go out of scope
         self.cache_object = new_cache_object
+        self.CacheChanged.emit()
 
     def initModels(self):
         """Set up model/view classes for MainWindow"""
@@ -2868,9 +2907,14 @@ class MainWindow(updates.UpdateWatcher, QMainWindow):
         if self.mode != "unittest":
             self.RecoverBackup.connect(self.recover_backup)
 
-        # Initialize and start the thumbnail HTTP server
-        self.http_server_thread = httpThumbnailServerThread()
-        self.http_server_thread.start()
+        # Initialize the thumbnail service (shared by the timeline and files model)
+        self.thumbnail_service = ThumbnailService(
+            s.get("thumbnail-pack-store"),
+            s.get("thumbnail-cache-limit-mb") * 1024 * 1024)
+        self.http_server_thread = None
+
+        # Initialize the waveform scheduler (used by the timeline)
+        self.waveform_scheduler = WaveformScheduler()
 
         # Create the timeline sync object (used for previewing timeline)
         self.timeline_sync = TimelineSync(self)
@@ -2879,6 +2923,11 @@ class MainWindow(updates.UpdateWatcher, QMainWindow):
         self.timeline = TimelineWebView(self)
         self.frameWeb.layout().addWidget(self.timeline)
 
+        # Serve timeline thumbnails from a custom URL scheme, or fall back to a HTTP server
+        if not self.timeline.install_thumbnail_scheme(self.thumbnail_service):
+            self.http_server_thread = httpThumbnailServerThread(self.thumbnail_service)
+            self.http_server_thread.start()
+
         # Configure the side docks to full-height
         self.setCorner(Qt.TopLeftCorner, Qt.LeftDockWidgetArea)
         self.setCorner(Qt.BottomLeftCorner, Qt.LeftDockWidgetArea)
@@ -63,8 +63,10 @@ class TimelineModel():
 
             # Get thumbnail path
             if (file.data["media_type"] == "video" or file.data["media_type"] == "image"):
-                # Determine thumb path
-                thumb_path = os.path.join(info.THUMBNAIL_PATH, "%s.png" % file.data["id"])
+                # Determine thumb path (the same 1x PNG shown in the files view, if generated yet)
+                thumb_path = get_app().window.thumbnail_service.find_thumbnail_path(file.data["id"], 1)
+                if not thumb_path:
+                    thumb_path = os.path.join(info.PATH, "images", "ThumbnailPlaceholder.svg")
             else:
                 # Audio file
                 thumb_path = os.path.join(info.PATH, "images", "AudioThumbnail.svg")
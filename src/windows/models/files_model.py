@@ -45,10 +45,13 @@ from classes.image_types import is_image
 from classes.query import File
 from classes.logger import log
 from classes.app import get_app
-from requests import get
+from classes.thumbnail import PRIORITY_VISIBLE, PRIORITY_BACKGROUND
 
 import openshot
 
+# Number of new files (in model order) which get thumbnails before the rest
+VISIBLE_THUMBNAILS = 50
+
 
 class FileFilterProxyModel(QSortFilterProxyModel):
     """Proxy class used for sorting and filtering model data"""
@@ -106,6 +109,7 @@ class FileFilterProxyModel(QSortFilterProxyModel):
 
 class FilesModel(QObject, updates.UpdateInterface):
     ModelRefreshed = pyqtSignal()
+    ThumbnailReady = pyqtSignal(str, str)
 
     # This method is invoked by the UpdateManager each time a change happens (i.e UpdateInterface)
     def changed(self, action):
@@ -163,6 +167,7 @@ class FilesModel(QObject, updates.UpdateInterface):
 
         # add item for each file
         row_added_count = 0
+        thumbnails_queued = 0
         for file in files:
             id = file.data["id"]
             if id in self.model_ids and self.model_ids[id].isValid():
@@ -184,8 +189,17 @@ class FilesModel(QObject, updates.UpdateInterface):
                     fps_float = float(fps["num"]) / float(fps["den"])
                     thumbnail_frame = round(float(file.data['start']) * fps_float) + 1
 
-                # Get thumb path
-                thumb_icon = QIcon(self.get_thumb_path(file.id, thumbnail_frame))
+                # Use existing thumbnail, or show a placeholder until it's generated in the background
+                thumb_path = get_app().window.thumbnail_service.find_thumbnail_path(file.id, thumbnail_frame)
+                if thumb_path is None:
+                    thumb_path = os.path.join(info.PATH, "images", "ThumbnailPlaceholder.svg")
+                    priority = PRIORITY_VISIBLE if thumbnails_queued < VISIBLE_THUMBNAILS else PRIORITY_BACKGROUND
+                    get_app().window.thumbnail_service.queue_thumbnail_path(
+                        file.id, thumbnail_frame,
+                        functools.partial(self.ThumbnailReady.emit, file.id),
+                        priority)
+                    thumbnails_queued += 1
+                thumb_icon = QIcon(thumb_path)
             else:
                 # Audio file
                 thumb_icon = QIcon(os.path.join(info.PATH, "images", "AudioThumbnail.svg"))
@@ -462,27 +476,22 @@ class FilesModel(QObject, updates.UpdateInterface):
 
     def get_thumb_path(
             self, file_id, thumbnail_frame, clear_cache=False):
-        """Get thumbnail path by invoking HTTP thumbnail request"""
-
-        # Clear thumb cache (if requested)
-        thumb_cache = ""
-        if clear_cache:
-            thumb_cache = "no-cache/"
-
-        # Connect to thumbnail server and get image
-        thumb_server_details = get_app().window.http_server_thread.server_address
-        thumb_address = "http://%s:%s/thumbnails/%s/%s/path/%s" % (
-            thumb_server_details[0],
-            thumb_server_details[1],
-            file_id,
-            thumbnail_frame,
-            thumb_cache)
-        r = get(thumb_address)
-        if r.ok:
-            # Update thumbnail path to real one
-            return r.text
-        else:
-            return ''
+        """Get thumbnail path from the thumbnail service (generating it, if needed)"""
+        return get_app().window.thumbnail_service.get_thumbnail_path(
+            file_id, thumbnail_frame, clear_cache)
+
+    def thumbnail_ready(self, file_id, thumb_path):
+        """Swap a placeholder icon for a thumbnail generated in the background"""
+        if not thumb_path or file_id not in self.model_ids:
+            return
+        id_index = self.model_ids[file_id]
+        if not id_index.isValid():
+            return
+
+        self.ignore_updates = True
+        item = self.model.itemFromIndex(id_index.sibling(id_index.row(), 0))
+        item.setIcon(QIcon(thumb_path))
+        self.ignore_updates = False
 
     def update_file_thumbnail(self, file_id):
         """Update/re-generate the thumbnail of a specific file"""
@@ -576,6 +585,9 @@ class FilesModel(QObject, updates.UpdateInterface):
         # Call init for superclass QObject
         super(QObject, FilesModel).__init__(self, *args)
 
+        # Thumbnails are generated on worker threads (and swapped in on the UI thread)
+        self.ThumbnailReady.connect(self.thumbnail_ready)
+
         # Attempt to load model testing interface, if requested
         # (will only succeed with Qt 5.11+)
         if info.MODEL_TEST:
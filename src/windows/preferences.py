@@ -510,7 +510,7 @@ class Preferences(QDialog):
             openshot.Settings.Instance().DE_LIMIT_HEIGHT_MAX = int(str(value))
 
         # Apply cache settings (if needed)
-        if param["setting"] in ["cache-limit-mb", "cache-scale", "cache-quality"]:
+        if param["setting"] in ["cache-limit-mb", "cache-disk-limit-mb", "cache-scale", "cache-quality"]:
             get_app().window.InitCacheSettings()
 
         # Check for restart
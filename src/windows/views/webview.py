@@ -45,12 +45,16 @@ from classes import info, updates
 from classes.app import get_app
 from classes.logger import log
 from classes.query import File, Clip, Transition, Track
-from classes.waveform import get_audio_data
+from classes.tiered_cache import TieredCache, cached_frame_ranges
+from classes.waveform import PeakStream, get_level_index, PEAKS_PER_SECOND, PYRAMID_LEVELS
 from classes.effect_init import effect_options
 
 # Constants used by this file
 JS_SCOPE_SELECTOR = "$('body').scope()"
 
+# Number of unchanged cache checks before the cache renderer stops (until the cache changes again)
+CACHE_RENDERER_IDLE_CHECKS = 4
+
 MENU_FADE_NONE = 0
 MENU_FADE_IN_FAST = 1
 MENU_FADE_IN_SLOW = 2
@@ -188,7 +192,10 @@ class TimelineWebView(updates.UpdateInterface, WebViewClass):
 
     @pyqtSlot(result=str)
     def get_thumb_address(self):
-        """Return the thumbnail HTTP server address"""
+        """Return the thumbnail address (custom URL scheme, or HTTP server)"""
+        if not self.window.http_server_thread:
+            return "%s:/thumbnails/" % info.THUMBNAIL_SCHEME
+
         thumb_server_details = self.window.http_server_thread.server_address
         while not thumb_server_details:
             log.info('No HTTP thumbnail server found yet... keep waiting...')
@@ -216,10 +223,30 @@ class TimelineWebView(updates.UpdateInterface, WebViewClass):
             # Load entire project data
             self.run_js(JS_SCOPE_SELECTOR + ".loadJson(" + action.json() + ");")
 
+            # Re-send all cached ranges (since the timeline project data was replaced)
+            self.cache_renderer_state = None
+            self.cache_renderer_ranges = None
+            self.cache_changed()
+
+            # Cancel (and forget) waveforms of the previous project
+            for clip_id in list(self.waveform_pending):
+                self.Waveform_Cancel(clip_id)
+            self.waveform_cache.clear()
+            self.waveform_levels.clear()
+
         elif action.key[0] != "files":
             # Apply diff to part of project data
             self.run_js(JS_SCOPE_SELECTOR + ".applyJsonDiff([" + action.json() + "]);")
 
+            # Cancel (and forget) the waveform of a deleted clip
+            if action.type == "delete" and action.key[0] == "clips" and isinstance(action.key[-1], dict):
+                self.Waveform_Cancel(action.key[-1].get("id"))
+                self.waveform_cache.pop(action.key[-1].get("id"), None)
+                self.waveform_levels.pop(action.key[-1].get("id"), None)
+
+            # Changes to the project clear cached frames
+            self.cache_changed()
+
         # Reset the scale when loading new JSON
         if action.type == "load":
             # Set the scale again (to project setting)
@@ -973,12 +1000,14 @@ class TimelineWebView(updates.UpdateInterface, WebViewClass):
                 # Find frame 1 channel_filter property
                 channel_filter = c.channel_filter.GetInt(1)
 
-                # Set cursor to waiting
-                get_app().setOverrideCursor(QCursor(Qt.WaitCursor))
+                # Set cursor to waiting (until all pending waveforms are complete)
+                if not self.waveform_pending:
+                    get_app().setOverrideCursor(QCursor(Qt.WaitCursor))
+                self.waveform_pending.add(clip_id)
+                self.waveform_streams.pop(clip_id, None)
 
-                # Get audio data in a separate thread (so it doesn't block the UI)
-                channel_filter = channel_filter
-                get_audio_data(clip_id, file_path, channel_filter, c.volume)
+                # Get audio data on the waveform workers (so it doesn't block the UI)
+                self.window.waveform_scheduler.request(clip_id, file_path, channel_filter, c.volume)
 
     def Hide_Waveform_Triggered(self, clip_ids):
         """Hide the waveform for the selected clip"""
@@ -989,29 +1018,75 @@ class TimelineWebView(updates.UpdateInterface, WebViewClass):
             # Get existing clip object
             clip = Clip.get(id=clip_id)
 
+            # Stop generating its waveform (if still pending), and forget it
+            self.Waveform_Cancel(clip_id)
+            self.waveform_cache.pop(clip_id, None)
+            self.waveform_levels.pop(clip_id, None)
+
             if clip:
                 # Pass to javascript timeline (and render)
                 self.run_js(JS_SCOPE_SELECTOR + ".hideAudioData('" + clip_id + "');")
 
-    def Waveform_Ready(self, clip_id, audio_data):
-        """Callback when audio waveform is ready"""
-        log.info("Waveform_Ready for clip ID: %s" % (clip_id))
-
-        # Convert waveform data to JSON
-        serialized_audio_data = json.dumps(audio_data)
-
-        # Set waveform cache (with clip_id as key)
-        self.waveform_cache[clip_id] = serialized_audio_data
-
-        # Pass to javascript timeline (and render)
-        self.run_js(JS_SCOPE_SELECTOR + ".setAudioData('" + clip_id + "', " + serialized_audio_data + ");")
-
-        # Restore normal cursor
-        get_app().restoreOverrideCursor()
+    def Waveform_Cancel(self, clip_id):
+        """Cancel a pending waveform (and restore the cursor once none are pending)"""
+        self.window.waveform_scheduler.cancel(clip_id)
+        self.waveform_streams.pop(clip_id, None)
+        if clip_id in self.waveform_pending:
+            self.waveform_pending.discard(clip_id)
+            if not self.waveform_pending:
+                get_app().restoreOverrideCursor()
+
+    def Waveform_Ready(self, clip_id, peaks, complete):
+        """Callback when audio waveform is ready (a PeakPyramid), or partially decoded (the new full resolution
+        peaks since the last callback)"""
+        if clip_id not in self.waveform_pending:
+            # Waveform was cancelled (hidden or deleted clip)
+            return
+        log.info("Waveform_Ready for clip ID: %s (complete: %s)" % (clip_id, complete))
+
+        if complete:
+            # Keep every level of the waveform (with clip_id as key), and send the level for the current zoom
+            self.waveform_streams.pop(clip_id, None)
+            if peaks:
+                # Always send a new waveform (i.e. after a volume change), even at the same level
+                self.waveform_cache[clip_id] = peaks
+                self.send_waveform_level(clip_id, force=True)
+
+            # Restore normal cursor (if no other waveforms are pending)
+            self.waveform_pending.discard(clip_id)
+            if not self.waveform_pending:
+                get_app().restoreOverrideCursor()
+        else:
+            # Append the new peaks (reduced to the level for the zoom when decoding started)
+            stream = self.waveform_streams.get(clip_id)
+            if not stream:
+                rates = [PEAKS_PER_SECOND / 2 ** index for index in range(PYRAMID_LEVELS)]
+                stream = self.waveform_streams[clip_id] = PeakStream(
+                    get_level_index(rates, self.get_pixels_per_second()))
+            chunk = stream.add(peaks)
+            if not chunk:
+                return
+            self.run_js(JS_SCOPE_SELECTOR + ".appendAudioData('" + clip_id + "', " + json.dumps(chunk) + ");")
 
         # Start timer to redraw audio
         self.redraw_audio_timer.start()
 
+    def get_pixels_per_second(self):
+        """Get the timeline zoom (same as pixelsPerSecond in the timeline)"""
+        project = get_app().project
+        return float(project.get("tick_pixels") or 100) / float(project.get("scale") or 15.0)
+
+    def send_waveform_level(self, clip_id, force=False):
+        """Send the level of a clip's waveform which matches the timeline zoom (if not already sent, or if forced)"""
+        pyramid = self.waveform_cache.get(clip_id)
+        if not pyramid:
+            return
+        index = pyramid.level_index(self.get_pixels_per_second())
+        if self.waveform_levels.get(clip_id) == index and not force:
+            return
+        self.waveform_levels[clip_id] = index
+        self.run_js(JS_SCOPE_SELECTOR + ".setAudioData('" + clip_id + "', [" + json.dumps(pyramid.encode_level(index)) + "]);")
+
     def Thumbnail_Updated(self, clip_id):
         """Callback when thumbnail needs to be updated"""
         # Pass to javascript timeline (and render)
@@ -1954,12 +2029,9 @@ class TimelineWebView(updates.UpdateInterface, WebViewClass):
                 self.update_clip_data(right_clip.data, only_basic_props=False, ignore_reader=True)
 
                 if has_audio_data:
-                    # Add right clip audio to cache
-                    self.waveform_cache[right_clip.id] = self.waveform_cache.get(clip_id, '[]')
-
-                    # Pass audio to javascript timeline (and render)
-                    self.run_js(JS_SCOPE_SELECTOR + ".setAudioData('{}',{});"
-                        .format(right_clip.id, self.waveform_cache.get(right_clip.id)))
+                    # Add right clip audio to cache, and pass it to javascript timeline (and render)
+                    self.waveform_cache[right_clip.id] = self.waveform_cache[clip_id]
+                    self.send_waveform_level(right_clip.id)
 
             # Save changes
             self.update_clip_data(clip.data, only_basic_props=False, ignore_reader=True)
@@ -2697,6 +2769,9 @@ class TimelineWebView(updates.UpdateInterface, WebViewClass):
         # Get access to timeline scope and set scale to zoom slider value (passed in)
         self.run_js(JS_SCOPE_SELECTOR + ".movePlayheadToFrame(%s);" % (str(position_frames)))
 
+        # Cached ranges usually change during playback
+        self.cache_changed()
+
     @pyqtSlot()
     def centerOnPlayhead(self):
         """ Center the timeline on the current playhead position """
@@ -3111,6 +3186,10 @@ class TimelineWebView(updates.UpdateInterface, WebViewClass):
         """Timer is ready to redraw audio (if any)"""
         log.debug('redraw_audio_onTimeout')
 
+        # Send other waveform levels (if the zoom has changed)
+        for clip_id in list(self.waveform_cache):
+            self.send_waveform_level(clip_id)
+
         # Pass to javascript timeline (and render)
         self.run_js(JS_SCOPE_SELECTOR + ".reDrawAllAudioData();")
 
@@ -3126,26 +3205,57 @@ class TimelineWebView(updates.UpdateInterface, WebViewClass):
         # Call javascript command
         self.run_js(JS_SCOPE_SELECTOR + ".selectAll();")
 
-    def render_cache_json(self):
-        """Render the cached frames to the timeline (called every X seconds), and only if changed"""
+    def cache_changed(self, *args):
+        """Schedule sending the cached ranges to the timeline (at most once per cache_renderer interval)"""
+        if not self.cache_renderer.isActive():
+            self.cache_renderer.start()
+
+    def render_cache_ranges(self):
+        """Send any added / removed cached frame ranges to the timeline, and only if changed. This keeps
+        running while the cache changes (frames are cached in the background), and stops once it settles."""
 
         # Get final cache object from timeline
         try:
             if self.window.timeline_sync and self.window.timeline_sync.timeline:
                 cache_object = self.window.timeline_sync.timeline.GetCache()
-                if not cache_object or cache_object.Count() <= 0:
+                tiered_cache = self.window.cache_object if isinstance(self.window.cache_object, TieredCache) else None
+                if not cache_object:
+                    return
+
+                # Cheap check for changes (before parsing the cache JSON)
+                cache_state = (
+                    cache_object.Count(),
+                    cache_object.GetBytes(),
+                    len(tiered_cache.disk_frames) if tiered_cache else 0,
+                )
+                if self.cache_renderer_state == cache_state:
+                    # Nothing has changed, check again a few times (in case the cache is still filling)
+                    self.cache_renderer_idle += 1
+                    if self.cache_renderer_idle < CACHE_RENDERER_IDLE_CHECKS:
+                        self.cache_renderer.start()
                     return
-                # Get the JSON from the cache object (i.e. which frames are cached)
-                cache_json = cache_object.Json()
-                cache_dict = json.loads(cache_json)
-                cache_version = cache_dict["version"]
+                self.cache_renderer_state = cache_state
+                self.cache_renderer_idle = 0
+                self.cache_renderer.start()
 
-                if self.cache_renderer_version == cache_version:
-                    # Nothing has changed, ignore
+                # Get merged ranges of cached frames
+                if tiered_cache:
+                    cache_ranges = set(tiered_cache.frame_ranges())
+                else:
+                    cache_ranges = set(cached_frame_ranges(cache_object))
+
+                # Diff against the ranges last sent to the timeline
+                reset = self.cache_renderer_ranges is None
+                previous_ranges = self.cache_renderer_ranges or set()
+                added = sorted(cache_ranges - previous_ranges)
+                removed = sorted(previous_ranges - cache_ranges)
+                if not reset and not added and not removed:
                     return
-                # Cache has changed, re-render it
-                self.cache_renderer_version = cache_version
-                self.run_js(JS_SCOPE_SELECTOR + ".renderCache({});".format(cache_json))
+
+                # Cache has changed, send only the differences
+                self.cache_renderer_ranges = cache_ranges
+                self.run_js(JS_SCOPE_SELECTOR + ".renderCacheDelta({}, {}, {});".format(
+                    json.dumps(added), json.dumps(removed), json.dumps(reset)))
         except Exception as ex:
             # Log the exception and ignore
             log.warning("Exception processing timeline cache: %s", ex)
@@ -3173,8 +3283,12 @@ class TimelineWebView(updates.UpdateInterface, WebViewClass):
         # Connect waveform generation signal
         window.WaveformReady.connect(self.Waveform_Ready)
 
-        # Local audio waveform cache
+        # Local audio waveform cache (every level of each clip's waveform), the level sent to the timeline,
+        # waveforms still decoding, and clips waiting on a waveform
         self.waveform_cache = {}
+        self.waveform_levels = {}
+        self.waveform_streams = {}
+        self.waveform_pending = set()
 
         # Connect update thumbnail signal
         window.ThumbnailUpdated.connect(self.Thumbnail_Updated)
@@ -3194,11 +3308,16 @@ class TimelineWebView(updates.UpdateInterface, WebViewClass):
         self.redraw_audio_timer.setSingleShot(True)
         self.redraw_audio_timer.timeout.connect(self.redraw_audio_onTimeout)
 
-        # QTimer for cache rendering
-        self.cache_renderer_version = None
+        # QTimer for cache rendering (started when the cache changes, and only changed ranges are sent to the timeline)
+        self.cache_renderer_state = None
+        self.cache_renderer_ranges = None
+        self.cache_renderer_idle = 0
         self.cache_renderer = QTimer(self)
         self.cache_renderer.setInterval(500)
-        self.cache_renderer.timeout.connect(self.render_cache_json)
+        self.cache_renderer.setSingleShot(True)
+        self.cache_renderer.timeout.connect(self.render_cache_ranges)
+        window.CacheChanged.connect(self.cache_changed)
+        window.refreshFrameSignal.connect(self.cache_changed)
 
         # Connect shutdown signals
         app.aboutToQuit.connect(self.redraw_audio_timer.stop)
@@ -3206,5 +3325,5 @@ class TimelineWebView(updates.UpdateInterface, WebViewClass):
         app.lastWindowClosed.connect(self.deleteLater)
 
         # Delay the start of cache rendering
-        QTimer.singleShot(1500, self.cache_renderer.start)
+        QTimer.singleShot(1500, self.cache_changed)
 
@@ -27,17 +27,26 @@
  """
 
 import os
+import json
 import logging
+import sip
 from functools import partial
 
 from classes import info
 from classes.logger import log
 
-from PyQt5.QtCore import QFileInfo, QUrl, Qt, QTimer
+from PyQt5.QtCore import QFileInfo, QUrl, Qt, QTimer, QBuffer, pyqtSignal
 from PyQt5.QtGui import QColor
 from PyQt5.QtWebEngineWidgets import QWebEngineView, QWebEnginePage
+from PyQt5.QtWebEngineCore import QWebEngineUrlSchemeHandler, QWebEngineUrlRequestJob
 from PyQt5.QtWebChannel import QWebChannel
 
+try:
+    from PyQt5.QtWebEngineCore import QWebEngineUrlScheme
+except ImportError:
+    # Custom schemes can't be registered before Qt 5.12
+    QWebEngineUrlScheme = None
+
 
 class LoggingWebEnginePage(QWebEnginePage):
     """Override console.log message to display messages"""
@@ -52,6 +61,70 @@ class LoggingWebEnginePage(QWebEnginePage):
         self.levels = [logging.INFO, logging.WARNING, logging.ERROR]
 
 
+class ThumbnailSchemeHandler(QWebEngineUrlSchemeHandler):
+    """Serve timeline thumbnails from the thumbnail service (without a local HTTP server)"""
+
+    # Emitted from a thumbnail worker thread, and handled on the UI thread
+    thumbnailReady = pyqtSignal(object, object)
+
+    def __init__(self, service, parent=None):
+        super().__init__(parent)
+        self.service = service
+        self.thumbnailReady.connect(self.reply)
+
+    def requestStarted(self, job):
+        """Look up (or queue) the requested thumbnail"""
+        url = job.requestUrl()
+        if self.service.is_stats_path(url.path()):
+            self.reply_content(job, "application/json", json.dumps(self.service.get_stats(), indent=2).encode("utf-8"))
+            return
+        request = self.service.parse_request(url.path(), url.query())
+        if not request:
+            self.service.stats.count("not_found")
+            job.fail(QWebEngineUrlRequestJob.UrlNotFound)
+            return
+
+        if not self.service.needs_generation(request):
+            self.reply(job, request)
+            return
+
+        # Queue thumbnail, or join a matching request already in progress
+        request.thumb_job = self.service.join(request)
+        job.destroyed.connect(partial(self.release, request))
+        request.thumb_job.add_done_callback(partial(self.thumbnailReady.emit, job, request))
+
+    def release(self, request):
+        """Stop waiting on a thumbnail job (if not already released)"""
+        if request.thumb_job:
+            self.service.leave(request, request.thumb_job)
+            request.thumb_job = None
+
+    def reply(self, job, request):
+        """Send a thumbnail (or file path) back to the timeline"""
+        self.release(request)
+        if sip.isdeleted(job):
+            # Request was aborted (i.e. the timeline no longer needs this image)
+            return
+
+        try:
+            content = self.service.read(request)
+        except Exception as ex:
+            log.warning("Failed to read thumbnail %s: %s", request.output_path, ex)
+            content = None
+        if content is None:
+            self.service.stats.count("not_found")
+            job.fail(QWebEngineUrlRequestJob.UrlNotFound)
+            return
+
+        self.reply_content(job, 'text/html' if request.only_path else request.content_type, content)
+        self.service.finish(request, len(content))
+
+    def reply_content(self, job, content_type, content):
+        buffer = QBuffer(parent=job)
+        buffer.setData(content)
+        job.reply(content_type.encode("utf-8"), buffer)
+
+
 class TimelineWebEngineView(QWebEngineView):
     """QtWebEngine Timeline Widget"""
 
@@ -124,6 +197,18 @@ class TimelineWebEngineView(QWebEngineView):
                 <script type="text/javascript" src="js/mixin_webengine.js"></script>
             """)
 
+    def install_thumbnail_scheme(self, service):
+        """Serve thumbnails from a custom URL scheme (returns False if not supported)"""
+        scheme_name = info.THUMBNAIL_SCHEME.encode("utf-8")
+        if not QWebEngineUrlScheme or QWebEngineUrlScheme.schemeByName(scheme_name).name() != scheme_name:
+            log.info("Thumbnail URL scheme not registered, using HTTP thumbnail server")
+            return False
+
+        self.thumbnail_scheme_handler = ThumbnailSchemeHandler(service, self)
+        self.page().profile().installUrlSchemeHandler(scheme_name, self.thumbnail_scheme_handler)
+        log.info("Serving thumbnails from URL scheme: %s", info.THUMBNAIL_SCHEME)
+        return True
+
     def keyPressEvent(self, event):
         """ Keypress callback for timeline """
         key_value = event.key()
@@ -114,6 +114,10 @@ class TimelineWebKitView(QWebView):
                 <script type="text/javascript" src="js/mixin_webkit.js"></script>
             """)
 
+    def install_thumbnail_scheme(self, service):
+        """WebKit does not support custom URL schemes (thumbnails use the HTTP server instead)"""
+        return False
+
     def keyPressEvent(self, event):
         """ Keypress callback for timeline """
         key_value = event.key()